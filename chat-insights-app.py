@@ -18,14 +18,33 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 import os
 import sys
+import argparse
 import json
 import re
 import threading
+import hashlib
+import time
+import multiprocessing
+import queue
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-from datetime import datetime
-from collections import Counter
+from datetime import datetime, timezone
+from collections import Counter, OrderedDict, defaultdict, deque
+import math
 import shutil
+import zipfile
+import io
+import gzip
+import random
+import tempfile
+import zlib
+import sqlite3
+from contextlib import closing, contextmanager, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+from urllib.request import pathname2url
+from array import array
 
 """
 ChatInsights v3 - AI Chat Analysis Tool
@@ -54,13 +73,1228 @@ Original application structure by Eden_Eldith(P.C O'Brien).
 # Global variables
 OUTPUT_DIR = os.path.join(os.path.expanduser("~"), "ChatInsights")
 CONFIG_FILE = os.path.join(OUTPUT_DIR, "config.json")
+CACHE_DIR_NAME = "cache"
+CONCEPT_CACHE_FILE = "concept_patterns.json"
+CONCEPT_CACHE_VERSION = 1
+CONCEPT_CACHE_ENTRIES = 20  # concept definitions kept in the on-disk pattern cache
+CORPUS_INDEX_FILE = "corpus_index.json"
+CORPUS_DB_FILE = "corpus.db"
+CORPUS_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,  -- platform:conversation id
+    platform TEXT NOT NULL,
+    conversation_id TEXT,
+    title TEXT,
+    summary TEXT,
+    model_id INTEGER REFERENCES models(id),
+    month TEXT,  -- output folder, e.g. January_2024
+    created TEXT,  -- ISO 8601 UTC
+    updated TEXT,
+    file TEXT,  -- transcript path
+    content_hash TEXT,
+    tokens INTEGER,
+    token_counter TEXT  -- tokenizer name, or approx:<chars per token>
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    author TEXT,
+    role TEXT,
+    block_type TEXT,
+    text TEXT,
+    model_id INTEGER REFERENCES models(id),  -- set when the message names its own model
+    tokens INTEGER
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    conversation INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    block_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (conversation, block_type)
+);
+CREATE TABLE IF NOT EXISTS concept_matches (
+    concept TEXT NOT NULL,
+    conversation INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    PRIMARY KEY (concept, conversation)
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages(conversation, position);
+CREATE INDEX IF NOT EXISTS messages_by_role ON messages(role, block_type);
+CREATE INDEX IF NOT EXISTS conversations_by_month ON conversations(month);
+CREATE INDEX IF NOT EXISTS conversations_by_updated ON conversations(updated);
+CREATE INDEX IF NOT EXISTS concept_matches_by_conversation ON concept_matches(conversation);
+"""
+CORPUS_DB_ADDED_COLUMNS = (  # Columns added since the first schema, for databases created before them
+    ("messages", "model_id", "INTEGER REFERENCES models(id)"),
+    ("messages", "tokens", "INTEGER"),
+    ("conversations", "tokens", "INTEGER"),
+    ("conversations", "token_counter", "TEXT"),
+)
+EXPORT_PATH_SEPARATOR = ";"
+EXPORT_PREFETCH = 64  # Conversations decoded ahead of the one being rendered
+WATCH_STATE_FILE = "watch_state.json"
+WATCH_EXTENSIONS = (".json", ".zip")
+INOTIFY_EVENTS = 0x2 | 0x8 | 0x80 | 0x100  # IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE
+SERVE_MAX_RESULTS = 200  # Upper bound for the limit parameter of list endpoints
+SERVE_EXPORT_CHUNK = 64 * 1024  # Bytes of JSONL gathered per chunk of a streamed export
+SERVE_CACHE_ENTRY_SHARE = 8  # One response may take at most 1/8 of the response cache
+DEFAULT_CONCEPTS = """
+AI: \\bAI\\b|Artificial Intelligence|GPT|Claude|LLM|Language Model|Deepseek
+Claude: \\bClaude\\b|Anthropic
+ChatGPT: \\bChatGPT\\b|\\bGPT\\b|OpenAI
+Deepseek: \\bDeepseek\\b|\\bDeepSeek\\b
+Programming: Python|JavaScript|Code|Programming|Script|Function|API
+Framework: Framework|Library|Architecture|Structure|System
+Data: Data|Database|CSV|JSON|Analysis|Dataset
+Machine Learning: Machine Learning|ML|Training|Model|Neural|Deep Learning
+Development: Development|Software|Application|Project|Build
+Security: Security|Privacy|Encryption|Authentication|Safety
+Cloud: Cloud|AWS|Azure|Google Cloud|Deployment
+"""
+DEBUG_LOG_SAMPLE = 3  # Debug lines logged per kind when debug_logging is off
+
+# Repeated groups containing a quantifier, like (a+)+, (\w+\s?)+ or (.*a){20}, and quantified
+# overlapping alternations like (a|a)* are the usual sources of catastrophic backtracking in
+# user-supplied concept patterns. These checks only label the risk; every pattern is probed.
+RISKY_PATTERN_CHECKS = [
+    (re.compile(r'\((?:\?:)?[^()]*(?:[+*]|\{\d+(?:,\d*)?\})[^()]*\)(?:[+*]|\{\d+(?:,\d*)?\})'), "nested quantifier"),
+    (re.compile(r'\((?:\?:)?[^()]*\|[^()]*\)(?:[+*]|\{\d+,\d*\})'), "quantified alternation"),
+    (re.compile(r'(?:\.\*|\\w\*|\\s\*|\.\+|\\w\+|\\s\+).*(?:\.\*|\.\+)'), "adjacent unbounded wildcards"),
+]
+DEFAULT_TERM_STOPWORDS = {
+    'with', 'that', 'this', 'from', 'have', 'what', 'your', 'request', 'help', 'about', 'using',
+    'the', 'and', 'for', 'are', 'was', 'were', 'will', 'would', 'could', 'should', 'there',
+    'their', 'they', 'them', 'then', 'than', 'when', 'where', 'which', 'while', 'into', 'onto',
+    'just', 'like', 'some', 'more', 'most', 'also', 'only', 'very', 'been', 'being', 'does',
+    'doing', 'done', 'make', 'need', 'want', 'here', 'these', 'those', 'each', 'other', 'over',
+    'such', 'because', 'can', 'you', 'not', 'but', 'how', 'why', 'who', 'its', 'it\'s', 'our',
+    'all', 'any', 'has', 'had', 'get', 'got', 'one', 'two', 'new', 'use', 'let', 'may', 'might',
+}
+PATTERN_PROBES = [
+    "a" * 5000 + "!",
+    " ".join(["word"] * 1000) + "!",
+    "_".join(["x1"] * 2000),
+    "aaaa " * 1000 + "!",
+    ("a" + "x" * 40) * 19,
+]
+
+try:
+    import re2  # Optional linear-time engine (pip install google-re2)
+except ImportError:
+    re2 = None
+
+try:
+    import zstandard  # Optional zstd output compression (pip install zstandard)
+except ImportError:
+    zstandard = None
+
+
+SNIFF_MAX_BYTES = 8 * 1024 * 1024  # Give up decoding the first conversation after this much
+SNIFF_SAMPLE_BYTES = 256 * 1024  # Decode conversations until this much is read, for the count estimate
+EXPORT_METADATA_FILES = {"users.json", "user.json", "projects.json"}
+ZIP_PLATFORM_HINTS = {
+    "chatgpt": ["chat.html", "message_feedback.json", "shared_conversations.json"],
+    "claude": ["projects.json", "users.json"],
+}
+TOKEN_DATASET_VERSION = 1
+TRAINING_FORMATS = ("pairs", "chat", "reasoning")
+TRAINING_FORMAT_FILES = {"pairs": "training_data", "chat": "training_chat", "reasoning": "training_reasoning"}
+TRAINING_PREVIEW_SIZE = 5
+TOKENIZE_BATCH_SIZE = 256  # Training pairs handed to a tokenizer worker per task
+TOKEN_COUNT_BATCH_SIZE = 1024  # Texts handed to a token counting worker per task
+TOKEN_CACHE_SIZE = 200000  # Exact token counts kept in the LRU cache, keyed by text hash
+TOKEN_CALIBRATION_FILE = "token_calibration.json"
+DEDUP_BATCH_SIZE = 512  # Samples hashed per dedup worker task
+DEDUP_MEMORY_ROWS = 250000  # Kept samples indexed in memory before the dedup index spills to disk
+MINHASH_PERMUTATIONS = 64
+MINHASH_SHINGLE_WORDS = 3
+SHARD_SCATTER_BUCKETS = 64  # Spill buckets samples are scattered into before shuffled shards are written
+SHARD_SPILL_ROWS = 50000  # Rows per spill bucket when shards keep the original order
+TABLE_ROW_GROUP_ROWS = 100000  # Messages per Parquet row group / Arrow record batch
+TABLE_DICTIONARY_COLUMNS = ("conversation_id", "platform", "model", "month", "author", "role", "block_type")
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+COMPRESSION_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+USAGE_CSV_FILE = "model_usage.csv"
+USAGE_NOTE_FILE = "Model-Usage-Dashboard.md"
+USAGE_COLUMNS = ("conversations", "messages", "user_messages", "assistant_messages", "chars", "tokens",
+                 "thinking_blocks", "thinking_chars", "tool_use_blocks", "response_chars")
+EMBEDDING_DIR = "embeddings"
+EMBED_BATCH_SIZE = 64  # Conversations embedded per worker task
+EMBED_TEXT_CHARS = 2000  # Title, summary and opening messages embedded per conversation
+EMBED_MAX_TOKENS = 512
+EMBED_MAX_WORKERS = 4  # Default embedding processes; each loads its own copy of the model
+EXACT_SCORE_CELLS = 1 << 22  # Query x vector scores computed per block of an exact search
+LINK_QUERY_BLOCK = 2048  # Conversations whose neighbours are searched together for Obsidian links
+IVF_MIN_ROWS = 20000  # Below this, "auto" without hnswlib searches exactly instead of building IVF lists
+TRACKER_STATE_FILE = "concept_tracker_state.json"
+TRACKER_STATE_VERSION = 2
+TRACKER_DB_FILE = "concept_tracker_state.db"  # Postings and term counts when there is no corpus.db
+TRACKER_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracker_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS tracker_postings (
+    concept TEXT NOT NULL,
+    key TEXT NOT NULL,  -- clean file name of the conversation
+    PRIMARY KEY (concept, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tracker_month_terms (
+    month TEXT NOT NULL,  -- year-month
+    term TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    position INTEGER NOT NULL,  -- first-seen order within the month, so ties rank as in a full count
+    PRIMARY KEY (month, term)
+) WITHOUT ROWID;
+"""
+CLUSTER_STATE_FILE = "concept_clusters.json"
+CLUSTER_STATE_VERSION = 1
+CLUSTER_BATCH_SIZE = 256  # Conversations per mini-batch k-means step
+CLUSTER_PASSES = 5  # Mini-batch steps amount to this many passes over the corpus
+CLUSTER_MAX_COUNT = 30  # Upper bound for the automatic number of discovered concepts
+CLUSTER_DOC_TERMS = 64  # Highest-weighted terms kept per conversation vector
+CLUSTER_KEEP_TERMS = 300  # Highest-weighted terms kept per cluster centroid
+CLUSTER_LABEL_WORDS = 3
+CLUSTER_REFIT_FRACTION = 0.5  # Refit from scratch once this share of conversations is new
+NPY_HEADER_SIZE = 128  # Fixed .npy header size, so the shape can be patched in after streaming
+TIKTOKEN_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+
+
+class _JsonStream:
+    """Incremental JSON decoding over a text stream: values are decoded one at a time"""
+    
+    def __init__(self, stream, chunk_size=1 << 20):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = stream.read(chunk_size).lstrip('\ufeff')
+        self.pos = 0
+        self.eof = not self.buffer
+    
+    def skip(self, separators=""):
+        """Move past whitespace and separators, reading on as needed; False at end of input"""
+        while True:
+            while self.pos < len(self.buffer) and (self.buffer[self.pos].isspace() or self.buffer[self.pos] in separators):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return True
+            if self.eof:
+                return False
+            self.buffer = self.stream.read(self.chunk_size)
+            self.pos = 0
+            self.eof = not self.buffer
+    
+    def peek(self):
+        """The character at the current position"""
+        return self.buffer[self.pos]
+    
+    def take(self):
+        """Step over the current character"""
+        self.pos += 1
+    
+    def decode(self):
+        """Decode the value at the current position, reading more while it straddles the end of the buffer"""
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut off by the buffer still decodes, so only trust values that end early
+                complete = end < len(self.buffer) or self.eof
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                complete = False
+            if complete:
+                break
+            # Grow the read so huge items stay linear
+            more = self.stream.read(read_size)
+            read_size *= 2
+            self.buffer = self.buffer[self.pos:] + more
+            self.pos = 0
+            self.eof = not more
+        self.pos = end
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        return value
+    
+    def items(self):
+        """Array items from just past its '[' up to and including the ']'"""
+        while True:
+            if not self.skip(","):
+                raise ValueError("Unexpected end of JSON array")
+            if self.peek() == ']':
+                self.take()
+                return
+            yield self.decode()
+    
+    def members(self):
+        """Each key of an object, from just past its '{' up to and including the '}'.
+        
+        The caller decodes (or walks into) each value before asking for the next key.
+        """
+        while True:
+            if not self.skip(","):
+                raise ValueError("Unexpected end of JSON object")
+            if self.peek() == '}':
+                self.take()
+                return
+            key = self.decode()
+            if not self.skip(":"):
+                raise ValueError("Unexpected end of JSON object")
+            yield key
+
+
+def iter_json_array(stream, chunk_size=1 << 20):
+    """Yield the items of a top-level JSON array one at a time from a text stream.
+    
+    Only the item currently being decoded is held in memory. Exports wrapped in an
+    object ({"conversations": [...]}) are streamed from inside the wrapper the same
+    way; an object without a conversations array is yielded as a single item.
+    """
+    reader = _JsonStream(stream, chunk_size)
+    if not reader.skip():
+        return
+    if reader.peek() == '[':
+        reader.take()
+        yield from reader.items()
+        return
+    if reader.peek() != '{':
+        raise ValueError("Expected a JSON array or object")
+    
+    # Walk the wrapper object's members until the conversations array
+    reader.take()
+    wrapper = {}
+    for key in reader.members():
+        if key == 'conversations' and reader.peek() == '[':
+            reader.take()
+            yield from reader.items()
+            return
+        wrapper[key] = reader.decode()
+    yield wrapper
+
+
+def iter_json_object_arrays(stream, chunk_size=1 << 20):
+    """Yield (key, item) for the items of each array in a top-level JSON object, one item at a time.
+    
+    For stores shaped like pruned.json ({"January_2024": [...], ...}). Members whose
+    value is not an array are skipped.
+    """
+    reader = _JsonStream(stream, chunk_size)
+    if not reader.skip():
+        return
+    if reader.peek() != '{':
+        raise ValueError("Expected a JSON object")
+    reader.take()
+    for key in reader.members():
+        if reader.peek() == '[':
+            reader.take()
+            for item in reader.items():
+                yield key, item
+        else:
+            reader.decode()
+
+
+def prefetch(iterable, size):
+    """Iterate in a background thread, at most size items ahead of the consumer.
+    
+    The bounded queue lets the producer (e.g. JSON decoding) overlap with the consumer
+    (e.g. writing transcripts) without reading further ahead than size items. Errors
+    in the producer are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=size)
+    end = object()
+    stop = threading.Event()
+    failure = []
+    
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            failure.append(e)
+        items.put(end)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                break
+            yield item
+        if failure:
+            raise failure[0]
+    finally:
+        # A consumer that stops early releases the producer
+        stop.set()
+
+
+def open_inotify(folder):
+    """An inotify descriptor watching folder for new and written files (Linux only), or None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(folder), INOTIFY_EVENTS) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def wait_for_change(fd, timeout):
+    """Wait until the inotify descriptor reports a change (True) or timeout seconds pass (False)"""
+    if fd is None:
+        time.sleep(timeout)
+        return False
+    import select
+    ready, _, _ = select.select([fd], [], [], timeout)
+    if not ready:
+        return False
+    # Drain the queued events; the folder is scanned afterwards anyway
+    try:
+        while os.read(fd, 65536):
+            pass
+    except BlockingIOError:
+        pass
+    return True
+
+
+def compressed_path(path, compression):
+    """path with the suffix for the given compression (unchanged for None)"""
+    return path + COMPRESSION_SUFFIXES.get(compression, "")
+
+
+def strip_compression_suffix(path):
+    """path without a trailing .gz / .zst"""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def find_output_file(path):
+    """The existing (possibly compressed) variant of an output file, newest first, else path itself"""
+    variants = [candidate for candidate in [path] + [path + suffix for suffix in COMPRESSION_SUFFIXES.values()]
+                if os.path.exists(candidate)]
+    return max(variants, key=os.path.getmtime) if variants else path
+
+
+def remove_other_variants(path):
+    """Delete stale compressed/uncompressed siblings of a file that has just been written"""
+    base = strip_compression_suffix(path)
+    for candidate in [base] + [base + suffix for suffix in COMPRESSION_SUFFIXES.values()]:
+        if candidate != path and os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def detect_compression(path):
+    """Compression of a file from its magic bytes: "gzip", "zstd" or None"""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def compress_bytes(data, compression, level=0):
+    """Compress a whole buffer in one call (used by shard writer processes)"""
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=level or 6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    return data
+
+
+def open_output(path, mode='w', compression=None, level=0, threads=0, newline=None):
+    """Open an output file, compressing transparently.
+    
+    gzip is always available. zstd needs the zstandard package and compresses on
+    threads worker threads (-1 = one per core). Text modes are UTF-8.
+    """
+    binary = 'b' in mode
+    if compression == "gzip":
+        raw = gzip.open(path, 'wb', compresslevel=level or 6)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package (pip install zstandard)")
+        compressor = zstandard.ZstdCompressor(level=level or 3, threads=threads)
+        raw = compressor.stream_writer(open(path, 'wb'), closefd=True)
+    else:
+        return open(path, mode, encoding=None if binary else 'utf-8', newline=None if binary else newline)
+    return raw if binary else io.TextIOWrapper(raw, encoding='utf-8', newline=newline)
+
+
+def open_input(path, mode='r', newline=None):
+    """Open a file for reading, decompressing gzip/zstd detected from its magic bytes"""
+    binary = 'b' in mode
+    compression = detect_compression(path)
+    if compression == "gzip":
+        raw = gzip.open(path, 'rb')
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError(f"{os.path.basename(path)} is zstd-compressed; install the zstandard package to read it")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        return open(path, mode, encoding=None if binary else 'utf-8', newline=None if binary else newline)
+    return raw if binary else io.TextIOWrapper(raw, encoding='utf-8', newline=newline)
+
+
+def is_empty_output(path):
+    """True for zero-byte files and compressed files with no content"""
+    if os.path.getsize(path) == 0:
+        return True
+    if detect_compression(path) is None:
+        return False
+    with open_input(path, 'rb') as f:
+        return not f.read(1)
+
+
+def open_corpus_db(path):
+    """Open (creating if needed) the SQLite corpus database in WAL mode"""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(CORPUS_DB_SCHEMA)
+    for table, column, definition in CORPUS_DB_ADDED_COLUMNS:
+        if column not in {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}:
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return connection
+
+
+def probe_pattern(source, probes):
+    """Run a pattern against adversarial probes (executed in a child process by the pattern guard)"""
+    pattern = re.compile(source, re.I)
+    for probe in probes:
+        pattern.search(probe)
+
+
+def match_titles(pattern, titles, connection, batch_size=256):
+    """Send the positions of titles matching pattern a batch at a time, then None.
+    
+    Runs in a child process the concept tracker kills once the pattern's time budget
+    is spent, since a single backtracking search() cannot be interrupted in-process.
+    """
+    for start in range(0, len(titles), batch_size):
+        connection.send([i for i in range(start, min(start + batch_size, len(titles))) if pattern.search(titles[i])])
+    connection.send(None)
+    connection.close()
+
+
+def load_tokenizer(spec):
+    """Load a local tokenizer for pre-tokenised training output.
+    
+    spec is a SentencePiece .model file, a Hugging Face tokenizer.json, a tiktoken
+    .tiktoken BPE file, or the name of a tiktoken encoding already in its local cache.
+    Returns a dict with name, encode (text -> ids), eos_id (or None) and vocab_size.
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        raise ValueError("No tokenizer selected")
+    name = os.path.basename(spec)
+    
+    if spec.lower().endswith(".model"):
+        try:
+            import sentencepiece
+        except ImportError:
+            raise ImportError("SentencePiece .model tokenizers need the sentencepiece package (pip install sentencepiece)")
+        processor = sentencepiece.SentencePieceProcessor(model_file=spec)
+        eos_id = processor.eos_id()
+        return {"name": name, "encode": processor.encode, "eos_id": eos_id if eos_id >= 0 else None,
+                "vocab_size": processor.get_piece_size()}
+    
+    if spec.lower().endswith(".json"):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("tokenizer.json files need the tokenizers package (pip install tokenizers)")
+        tokenizer = Tokenizer.from_file(spec)
+        eos_id = next((tokenizer.token_to_id(token) for token in ("</s>", "<|endoftext|>", "<eos>")
+                       if tokenizer.token_to_id(token) is not None), None)
+        return {"name": name, "encode": lambda text: tokenizer.encode(text, add_special_tokens=False).ids,
+                "eos_id": eos_id, "vocab_size": tokenizer.get_vocab_size()}
+    
+    try:
+        import tiktoken
+    except ImportError:
+        raise ImportError("tiktoken encodings need the tiktoken package (pip install tiktoken)")
+    if os.path.isfile(spec):
+        from tiktoken.load import load_tiktoken_bpe
+        ranks = load_tiktoken_bpe(spec)
+        encoding = tiktoken.Encoding(name=os.path.splitext(name)[0], pat_str=TIKTOKEN_PATTERN,
+                                     mergeable_ranks=ranks, special_tokens={"<|endoftext|>": len(ranks)})
+    else:
+        encoding = tiktoken.get_encoding(spec)
+    eos_id = encoding.encode_single_token("<|endoftext|>") if "<|endoftext|>" in encoding.special_tokens_set else None
+    # encode_ordinary treats special-token text in conversations as plain text instead of raising
+    return {"name": name, "encode": encoding.encode_ordinary, "eos_id": eos_id, "vocab_size": encoding.n_vocab}
+
+
+_worker_tokenizer = None
+
+
+def init_tokenize_worker(spec):
+    """Pool initializer - load the tokenizer once per worker process"""
+    global _worker_tokenizer
+    _worker_tokenizer = load_tokenizer(spec)
+
+
+def tokenize_pair_batch(task, tokenizer=None):
+    """Tokenize a batch of (instruction, response) pairs (run in a worker process).
+    
+    Returns the packed ids as little-endian bytes and (instruction, response) lengths
+    per pair. Responses end with the tokenizer's EOS token when it has one.
+    """
+    pairs, typecode = task
+    tokenizer = tokenizer or _worker_tokenizer
+    encode = tokenizer["encode"]
+    eos_id = tokenizer["eos_id"]
+    ids = array(typecode)
+    lengths = []
+    for instruction, response in pairs:
+        instruction_ids = encode(instruction)
+        response_ids = encode(response)
+        ids.extend(instruction_ids)
+        ids.extend(response_ids)
+        response_length = len(response_ids)
+        if eos_id is not None:
+            ids.append(eos_id)
+            response_length += 1
+        lengths.append((len(instruction_ids), response_length))
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids.tobytes(), lengths
+
+
+def count_token_batch(texts, tokenizer=None):
+    """Token counts for a batch of texts (run in a worker process)"""
+    encode = (tokenizer or _worker_tokenizer)["encode"]
+    return [len(encode(text)) for text in texts]
+
+
+def minhash_batch(texts, num_perm=MINHASH_PERMUTATIONS, shingle_words=MINHASH_SHINGLE_WORDS, seed=1):
+    """Exact keys and MinHash signatures for a batch of sample texts (run in a worker process).
+    
+    The exact key hashes the lowercased word sequence, so case, punctuation and spacing
+    differences still count as exact duplicates. Signatures use one-permutation hashing:
+    each word shingle is hashed once into one of num_perm bins keeping the bin minimum,
+    and empty bins borrow from the next filled bin (rotation densification), so the cost
+    is linear in the text rather than num_perm times it. Returns [(exact key, signature bytes)].
+    """
+    salt = seed.to_bytes(8, "little")
+    results = []
+    for text in texts:
+        words = re.findall(r"\w+", text.lower())
+        exact = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).digest()
+        if len(words) > shingle_words:
+            shingles = {" ".join(words[i:i + shingle_words]) for i in range(len(words) - shingle_words + 1)}
+        else:
+            shingles = {" ".join(words)}
+        
+        bins = [None] * num_perm
+        for shingle in shingles:
+            h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8, salt=salt).digest(), "little")
+            slot, value = h % num_perm, (h // num_perm) & 0xFFFFFFFF
+            if bins[slot] is None or value < bins[slot]:
+                bins[slot] = value
+        for slot in range(num_perm):
+            if bins[slot] is None:
+                distance = 1
+                while bins[(slot + distance) % num_perm] is None:
+                    distance += 1
+                # Mix in the distance so borrowed values differ from the source bin
+                bins[slot] = (bins[(slot + distance) % num_perm] ^ (distance * 0x9E3779B1)) & 0xFFFFFFFF
+        results.append((exact, array("I", bins).tobytes()))
+    return results
+
+
+def lsh_bands(num_perm, threshold):
+    """Pick (bands, rows) so the LSH candidate threshold (1/bands)^(1/rows) sits just below threshold"""
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below or options, key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+
+def signature_similarity(first, second):
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    first, second = array("I", first), array("I", second)
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+class DedupIndex:
+    """Exact keys, LSH band buckets and signatures of kept samples, for training-sample dedup.
+    
+    Rows live in dicts until about max_rows samples are indexed, then move to a temporary SQLite
+    file, so memory stays bounded however large the corpus. prefetch() loads the disk rows
+    a batch can hit before the batch is checked, keeping lookups in bulk queries.
+    """
+    
+    def __init__(self, bands, max_rows=DEDUP_MEMORY_ROWS):
+        self.max_rows = max_rows
+        self.exact = {}  # exact key -> position of the kept sample
+        self.buckets = [{} for _ in range(bands)]  # band hash -> position of the first kept sample
+        self.signatures = {}  # position -> signature
+        self.disk_exact, self.disk_buckets, self.disk_signatures = {}, {}, {}
+        self.db = None
+        self.path = None
+    
+    def select(self, query, values):
+        # IN lists in chunks that stay under SQLite's parameter limit
+        values = list(values)
+        for i in range(0, len(values), 900):
+            chunk = values[i:i + 900]
+            yield from self.db.execute(query.format(",".join("?" * len(chunk))), chunk)
+    
+    def prefetch(self, exact_keys, band_keys=()):
+        """Load the spilled rows a batch with these exact keys and [band keys per sample] can match.
+        
+        Spilling happens here, between batches, so rows a batch adds stay in memory until it is done.
+        """
+        if len(self.exact) >= self.max_rows:
+            self.spill()
+        if self.db is None:
+            return
+        self.disk_exact = dict(self.select("SELECT key, position FROM exact WHERE key IN ({})", set(exact_keys)))
+        wanted = {(band, key) for keys in band_keys for band, key in enumerate(keys)}
+        self.disk_buckets = {(band, key): position for band, key, position in self.select(
+            "SELECT band, key, position FROM buckets WHERE key IN ({})", {key for _, key in wanted}) if (band, key) in wanted}
+        self.disk_signatures = dict(self.select("SELECT position, signature FROM signatures WHERE position IN ({})",
+                                                set(self.disk_buckets.values())))
+    
+    def find_exact(self, key):
+        position = self.exact.get(key)
+        return self.disk_exact.get(key) if position is None else position
+    
+    def find_near(self, band_keys, signature, threshold):
+        """Position of a kept sample sharing a band and at least threshold similar, or None"""
+        for band, band_key in enumerate(band_keys):
+            candidate = self.buckets[band].get(band_key)
+            if candidate is None:
+                candidate = self.disk_buckets.get((band, band_key))
+            if candidate is None:
+                continue
+            kept = self.signatures.get(candidate)
+            if kept is None:
+                kept = self.disk_signatures[candidate]
+            if signature_similarity(kept, signature) >= threshold:
+                return candidate
+        return None
+    
+    def add(self, key, position, signature=None, band_keys=()):
+        self.exact[key] = position
+        if signature is not None:
+            self.signatures[position] = signature
+            for band, band_key in enumerate(band_keys):
+                if (band, band_key) not in self.disk_buckets:
+                    self.buckets[band].setdefault(band_key, position)
+    
+    def spill(self):
+        """Move the in-memory rows to the temporary database"""
+        if self.db is None:
+            handle, self.path = tempfile.mkstemp(prefix="dedup-", suffix=".db")
+            os.close(handle)
+            self.db = sqlite3.connect(self.path)
+            self.db.execute("PRAGMA journal_mode=OFF")
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.executescript(
+                "CREATE TABLE exact (key BLOB PRIMARY KEY, position INTEGER) WITHOUT ROWID;"
+                "CREATE TABLE buckets (band INTEGER, key INTEGER, position INTEGER, PRIMARY KEY (key, band)) WITHOUT ROWID;"
+                "CREATE TABLE signatures (position INTEGER PRIMARY KEY, signature BLOB);"
+            )
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO exact VALUES (?, ?)", self.exact.items())
+            self.db.executemany("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)",
+                                ((band, key, position) for band, bucket in enumerate(self.buckets) for key, position in bucket.items()))
+            self.db.executemany("INSERT OR IGNORE INTO signatures VALUES (?, ?)", self.signatures.items())
+        self.exact.clear()
+        self.signatures.clear()
+        for bucket in self.buckets:
+            bucket.clear()
+    
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.path)
+            self.db = None
+
+
+def spool_samples(samples, spool):
+    """Pass (key, sample) items through, writing each sample to spool as a JSON line"""
+    for key, sample in samples:
+        spool.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        yield key, sample
+
+
+def write_shard_group(task):
+    """Write one group of spill buckets as size-bounded shards (run in a worker process).
+    
+    The group is read, shuffled with its own seed (when shuffling), and cut into parts of
+    about equal byte size. A part is closed early whenever the next sample would take it
+    past max_rows or max_bytes (UTF-8 JSON lines, before compression), so skewed sample
+    sizes can't overfill a shard; only a single sample larger than max_bytes gets a part
+    to itself. Returns one entry per part with its temporary path, row count, byte size
+    and sha256.
+    """
+    bucket_files, part_prefix, seed, shuffle, max_rows, max_bytes, min_parts, columns, compression, level = task
+    lines = []
+    for bucket_file in bucket_files:
+        with open(bucket_file, 'r', encoding='utf-8') as f:
+            lines.extend(f)
+    if shuffle:
+        random.Random(seed).shuffle(lines)
+    
+    sizes = [len(line.encode("utf-8")) for line in lines]
+    size = sum(sizes)
+    parts = max(min_parts, math.ceil(len(lines) / max_rows) if max_rows else 1, math.ceil(size / max_bytes) if max_bytes else 1)
+    target_bytes = math.ceil(size / parts)
+    
+    chunks = []
+    start = part_bytes = 0
+    for i, line_size in enumerate(sizes):
+        if i > start and ((max_rows and i - start >= max_rows) or (max_bytes and part_bytes + line_size > max_bytes)):
+            chunks.append(lines[start:i])
+            start, part_bytes = i, 0
+        part_bytes += line_size
+        if part_bytes >= target_bytes:
+            chunks.append(lines[start:i + 1])
+            start, part_bytes = i + 1, 0
+    if start < len(lines):
+        chunks.append(lines[start:])
+    
+    shards = []
+    for part, chunk in enumerate(chunks):
+        if columns:
+            import csv
+            buffer = io.StringIO(newline='')
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for line in chunk:
+                sample = json.loads(line)
+                writer.writerow([sample[column] for column in columns])
+            data = buffer.getvalue().encode("utf-8")
+        else:
+            data = "".join(chunk).encode("utf-8")
+        data = compress_bytes(data, compression, level)
+        path = f"{part_prefix}-{part:03d}"
+        with open(path, 'wb') as f:
+            f.write(data)
+        shards.append({"path": path, "rows": len(chunk), "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()})
+    return shards
+
+
+def load_embedder(model_path, threads=0):
+    """Load a local sentence-embedding model for the similarity index.
+    
+    model_path is a sentence-transformers model folder, or a folder holding an exported
+    model.onnx (or onnx/model.onnx) and tokenizer.json, which runs on onnxruntime with
+    mean pooling. Nothing is downloaded. Returns a dict with name, dim and encode
+    (texts -> float32 array of unit-length rows). threads > 0 caps intra-op threads.
+    """
+    model_path = (model_path or "").strip()
+    if not model_path or not os.path.isdir(model_path):
+        raise ValueError("No local embedding model folder selected")
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("Embeddings need numpy (pip install numpy)")
+    name = os.path.basename(os.path.normpath(model_path))
+    onnx_file = next((path for path in (os.path.join(model_path, "model.onnx"), os.path.join(model_path, "onnx", "model.onnx"))
+                      if os.path.exists(path)), None)
+    
+    if onnx_file:
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("ONNX embedding models need onnxruntime and tokenizers (pip install onnxruntime tokenizers)")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(onnx_file, options, providers=["CPUExecutionProvider"])
+        input_names = {item.name for item in session.get_inputs()}
+        tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        tokenizer.enable_truncation(EMBED_MAX_TOKENS)
+        tokenizer.enable_padding()
+        
+        def encode(texts):
+            encodings = tokenizer.encode_batch(list(texts))
+            ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = session.run(None, feeds)[0]
+            # Mean pooling over the real (unpadded) tokens
+            weights = mask[..., None].astype(np.float32)
+            vectors = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        
+        return {"name": name, "dim": int(encode(["probe"]).shape[1]), "encode": encode}
+    
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError("Embedding model folders need sentence-transformers, or an exported model.onnx "
+                          "(pip install sentence-transformers)")
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(model_path, device="cpu")
+    
+    def encode(texts):
+        return model.encode(list(texts), batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True,
+                            normalize_embeddings=True, show_progress_bar=False)
+    
+    return {"name": name, "dim": int(model.get_sentence_embedding_dimension()), "encode": encode}
+
+
+_worker_embedder = None
+
+
+def init_embed_worker(model_path, threads):
+    """Pool initializer - load the embedding model once per worker process"""
+    global _worker_embedder
+    _worker_embedder = load_embedder(model_path, threads)
+
+
+def embed_batch(texts, embedder=None):
+    """Embed a batch of texts (run in a worker process) as float16 rows"""
+    embedder = embedder or _worker_embedder
+    return embedder["encode"](texts).astype("float16")
+
+
+def build_ivf_index(vectors, lists, iterations=10, seed=0):
+    """Train a coarse k-means quantiser over unit vectors for approximate search.
+    
+    Centroids are trained on a sample, then every row is assigned to its nearest one.
+    Returns (centroids, order, offsets): row numbers grouped by list and where each list
+    starts, so a query only scores the rows in its nearest few lists.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, min(count, lists * 64), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for list_id in range(lists):
+            members = sample[assignment == list_id]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[list_id] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+    
+    assignment = np.concatenate([np.argmax(np.asarray(vectors[i:i + 8192], dtype=np.float32) @ centroids.T, axis=1)
+                                 for i in range(0, count, 8192)])
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+    return centroids, order, offsets
+
+
+def top_terms(weights, words):
+    """Heaviest terms of a sparse vector that together use at most `words` distinct words"""
+    chosen = []
+    used = set()
+    for term, _ in sorted(weights.items(), key=lambda item: item[1], reverse=True):
+        term_words = term.split()
+        if len(set(term_words)) < len(term_words) or used.intersection(term_words) or len(used) + len(term_words) > words:
+            continue
+        chosen.append(term)
+        used.update(term_words)
+        if len(used) == words:
+            break
+    return chosen
+
+
+def approx_token_count(text, chars_per_token=4.0):
+    """Rough token count (about four characters per token, or a calibrated ratio)"""
+    return math.ceil(len(text) / chars_per_token)
+
+
+def npy_header(dtype, shape):
+    """Build a fixed-size .npy (v1.0) header, so arrays can be streamed to disk without numpy"""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (dtype, tuple(shape))
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    if len(header) + 10 != NPY_HEADER_SIZE:
+        raise ValueError(f"Array shape {shape} does not fit in the .npy header")
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+def length_stats(lengths):
+    """Summarise a list of token lengths (count, total, min/mean/max and percentiles)"""
+    if not lengths:
+        return {"count": 0, "total": 0}
+    ordered = sorted(lengths)
+    count = len(ordered)
+    
+    def percentile(fraction):
+        return ordered[min(count - 1, int(fraction * count))]
+    
+    return {
+        "count": count,
+        "total": sum(ordered),
+        "min": ordered[0],
+        "mean": round(sum(ordered) / count, 1),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+
+def open_corpus_reader(path):
+    """Open the corpus database read-only, usable from any thread"""
+    connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True, check_same_thread=False)
+    connection.execute("PRAGMA query_only=ON")
+    return connection
+
+
+def int_param(params, name, default, low, high=None):
+    """An integer query parameter clamped to [low, high]; ValueError (400) if it isn't a number"""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number")
+    return max(low, value if high is None else min(value, high))
+
+
+def corpus_stamp(data_dir):
+    """Size and mtime of the corpus database, its WAL and the embedding index; changes whenever any is written"""
+    stamp = []
+    for name in (CORPUS_DB_FILE, CORPUS_DB_FILE + "-wal", os.path.join(EMBEDDING_DIR, "index.json")):
+        try:
+            stat = os.stat(os.path.join(data_dir, name))
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+class CorpusConnectionPool:
+    """Up to size read-only connections to the corpus database, reused across requests"""
+    
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one when all are in use"""
+        self.slots.acquire()
+        try:
+            try:
+                db = self.idle.get_nowait()
+            except queue.Empty:
+                db = open_corpus_reader(self.path)
+            try:
+                yield db
+            except BaseException:
+                # A half-read statement may still be open, so don't hand this one out again
+                db.close()
+                raise
+            self.idle.put(db)
+        finally:
+            self.slots.release()
+    
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ResponseCache:
+    """LRU of encoded responses bounded by total bytes, emptied whenever the corpus stamp changes"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stamp = None
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+    
+    def get(self, key, stamp):
+        with self.lock:
+            if stamp != self.stamp:
+                self.entries.clear()
+                self.bytes = 0
+                self.stamp = stamp
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+    
+    def put(self, key, body, stamp):
+        if len(body) * SERVE_CACHE_ENTRY_SHARE > self.max_bytes:
+            return
+        with self.lock:
+            if stamp != self.stamp:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self.entries[key] = body
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+    
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class CorpusRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of the query service; the server carries app, pool and cache"""
+    
+    protocol_version = "HTTP/1.1"  # keep-alive, and chunked exports
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        route = [unquote(part) for part in parts.path.split("/") if part]
+        params = dict(parse_qsl(parts.query))
+        app = self.server.app
+        try:
+            if route == ["export"]:
+                self.send_export(params)
+                return
+            
+            # Responses are cached until the database or embedding index changes (health is always live)
+            key = "/".join(route) + "?" + urlencode(sorted(params.items())) if route and route != ["health"] else None
+            stamp = corpus_stamp(self.server.data_dir)
+            body = self.server.cache.get(key, stamp) if key else None
+            if body is not None:
+                self.send_body(200, body, "hit")
+                return
+            with self.server.pool.connection() as db:
+                payload = app.answer_query(db, route, params, self.server)
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            if key:
+                self.server.cache.put(key, body, stamp)
+            self.send_body(200, body, "miss" if key else None)
+        except LookupError as e:
+            self.send_error_json(404, str(e).strip("'\""))
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception as e:
+            app.log(f"Error answering {self.path}: {e}")
+            self.send_error_json(500, str(e))
+    
+    def send_body(self, status, body, cache_state=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if cache_state:
+            self.send_header("X-Cache", cache_state)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_error_json(self, status, message):
+        self.send_body(status, json.dumps({"error": message}).encode("utf-8"))
+    
+    def send_export(self, params):
+        """Stream training samples as chunked JSONL straight from the database, never holding the whole export"""
+        app = self.server.app
+        sample_format = params.get("format", "pairs")
+        if sample_format not in TRAINING_FORMATS:
+            raise ValueError(f"Unknown format {sample_format!r}, expected one of {', '.join(TRAINING_FORMATS)}")
+        min_length = int_param(params, "min_length", 10, 0)
+        limit = int_param(params, "limit", 0, 1) if "limit" in params else None
+        
+        with self.server.pool.connection() as db:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            
+            buffer = []
+            buffered = 0
+            try:
+                for count, (_, sample) in enumerate(app.iter_training_samples(db, sample_format, min_length)):
+                    if limit is not None and count >= limit:
+                        break
+                    buffer.append(json.dumps(sample, ensure_ascii=False) + "\n")
+                    buffered += len(buffer[-1])
+                    if buffered >= SERVE_EXPORT_CHUNK:
+                        self.write_chunk("".join(buffer))
+                        buffer.clear()
+                        buffered = 0
+                if buffer:
+                    self.write_chunk("".join(buffer))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                # The status line is already sent, so cut the stream short instead
+                app.log(f"Error streaming {self.path}: {e}")
+                self.close_connection = True
+    
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+    
+    def log_message(self, format, *args):
+        self.server.app.debug_log(f"{self.address_string()} {format % args}", key="serve-request")
+
+
+def run_load_test(host, port, paths, requests, concurrency):
+    """Replay paths over concurrency keep-alive connections; returns per-request latencies (ms), errors and seconds taken"""
+    import http.client
+    
+    def client(worker):
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        latencies = []
+        errors = 0
+        for i in range(worker, requests, concurrency):
+            start = time.perf_counter()
+            connection.request("GET", paths[i % len(paths)])
+            response = connection.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status >= 500
+        connection.close()
+        return latencies, errors
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return [latency for latencies, _ in outcomes for latency in latencies], sum(errors for _, errors in outcomes), elapsed
+
 
 class ChatInsightsApp:
-    def __init__(self, root):
+    def __init__(self, root=None):
         self.root = root
-        self.root.title("ChatInsights v3 - AI Chat Analysis Tool (ChatGPT, Claude & Deepseek)")
-        self.root.geometry("900x700")
-        self.root.minsize(800, 600)
         
         # Default configuration
         self.config = {
@@ -74,10 +1308,86 @@ class ChatInsightsApp:
                 "light": {"bg": "#f0f0f0", "fg": "#333333", "button": "#e0e0e0", "highlight": "#4a86e8"}
             },
             "current_theme": "light",
-            "last_platform": "auto"  # auto, chatgpt, claude
+            "last_platform": "auto",  # auto, chatgpt, claude
+            "regex_engine": "auto",  # auto (RE2 when installed), re, re2
+            "pattern_time_budget": 2.0,  # seconds of matching allowed per concept pattern per run
+            "pattern_probe_timeout": 2.0,  # seconds a risky pattern may take on adversarial probes
+            "term_stopwords": [],  # extra words to ignore when mining recurring terms
+            "term_max_ngram": 3,  # mine phrases up to this many words
+            "mine_message_bodies": False,  # mine terms from message text as well as titles
+            "auto_concepts": False,  # discover concepts by clustering conversations
+            "auto_concept_count": 0,  # clusters to discover (0 = automatic)
+            "auto_concept_source": "auto",  # tfidf, embeddings, or auto (embeddings when the index exists)
+            "incremental_tracker": True,  # keep tracker state and only process new or changed conversations
+            "usage_analytics": True,  # per-model/platform/month usage CSV and Obsidian dashboard after each import
+            "pipeline_workers": 0,  # post-import stages run side by side (0 = up to 4)
+            "watch_poll_seconds": 30,  # watch mode rescan interval (a safety net when inotify is available)
+            "watch_settle_seconds": 10,  # an export must stay unchanged this long before it is imported
+            "watch_analyze": True,  # run the concept tracker after each watched import
+            "watch_concepts_file": "",  # Concept-regex.md style file for watch mode (empty = default concepts)
+            "serve_host": "127.0.0.1",  # query service address; keep it local unless the corpus may be shared
+            "serve_port": 8765,
+            "serve_pool_size": 4,  # read-only database connections shared by the request threads
+            "serve_cache_mb": 64,  # memory for cached query responses (least recently used are evicted)
+            "import_attachments": False,  # copy attachments out of export zips into data/attachments
+            "merge_into_existing": False,  # dedupe new exports against the existing corpus instead of replacing it
+            "debug_logging": False,  # log every parser debug line instead of a small sample
+            "deepseek_export_branches": False,  # also export abandoned (regenerated) Deepseek branches
+            "pretokenize_training": False,  # also write token ids (.npy) alongside the training data
+            "tokenizer_path": "",  # .model / tokenizer.json / .tiktoken file, or a cached tiktoken encoding name
+            "tokenize_workers": 0,  # tokenizer processes (0 = one per CPU)
+            "token_count_mode": "approx",  # approx (chars per token) or exact (tokenizer_path, cached)
+            "chars_per_token": 4.0,  # approximation ratio until the tokenizer has been calibrated
+            "min_length_unit": "chars",  # chars or tokens for the minimum instruction length
+            "training_formats": ["pairs"],  # pairs, chat (multi-turn windows), reasoning (with thinking)
+            "chat_token_budget": 2048,  # approximate tokens per multi-turn chat sample
+            "chat_window_overlap": 1,  # turns repeated at the start of the next chat window
+            "dedup_mode": "off",  # off, exact, near (exact + MinHash/LSH near duplicates)
+            "dedup_threshold": 0.8,  # estimated Jaccard similarity at which samples count as near duplicates
+            "dedup_action": "drop",  # drop duplicates, or cluster (keep them and write <file>_clusters.jsonl)
+            "dedup_workers": 0,  # hashing processes (0 = one per CPU)
+            "shard_output": False,  # write training samples as shards plus a manifest instead of one file
+            "shard_max_mb": 256,  # size limit per shard (0 = no limit)
+            "shard_max_rows": 0,  # row limit per shard (0 = no limit)
+            "shard_count": 0,  # minimum number of shards per split (0 = as few as the limits allow)
+            "shuffle_training": True,  # shuffle samples across shards
+            "shuffle_seed": 42,  # seed for the shuffle and the train/validation split
+            "validation_fraction": 0.0,  # share of conversations held out as the validation split
+            "shard_workers": 0,  # shard writer processes (0 = one per CPU)
+            "output_compression": "none",  # none, gzip or zstd for pruned.json and training data
+            "compression_level": 0,  # 0 = codec default (gzip 6, zstd 3)
+            "compress_transcripts": False,  # also compress the per-conversation .txt files
+            "export_tables": False,  # write messages/conversations tables after processing (needs pyarrow)
+            "table_format": "parquet",  # parquet, or arrow (IPC stream)
+            "corpus_db": True,  # keep data/corpus.db (SQLite) as the store later stages query
+            "build_embeddings": False,  # embed conversations after processing (needs embedding_model)
+            "embedding_model": "",  # local sentence-transformers or ONNX model folder
+            "embed_workers": 0,  # embedding processes (0 = up to 4, sharing the CPU threads)
+            "ann_index": "auto",  # auto, hnsw (needs hnswlib), ivf or exact
+            "ivf_probe": 8,  # IVF lists scanned per query
+            "similar_links": 5  # similar conversations linked from each Obsidian note (0 = off)
         }
         self.load_config()
         
+        # Per-session caches, filled on first use
+        self._concept_pattern_cache = {}  # definition hash -> compiled concept patterns
+        self._pattern_guard_cache = {}  # pattern source -> probe verdict
+        self._role_table = None
+        self._role_table_names = None  # names the role table was built from
+        self._debug_log_counts = Counter()
+        self._zstd_fallback_logged = False
+        self._embedding_index = None
+        self._query_embedder = None
+        self._token_counter = None
+        self._similar_links = None  # (index stamp, k, links) from the last similar_conversation_links
+        
+        # Without a root window the app runs headless (watch mode) and logs to stdout
+        if root is None:
+            return
+        self.root.title("ChatInsights v3 - AI Chat Analysis Tool (ChatGPT, Claude & Deepseek)")
+        self.root.geometry("900x700")
+        self.root.minsize(800, 600)
+        
         # Create main frame
         self.main_frame = ttk.Frame(root, padding="10")
         self.main_frame.pack(fill=tk.BOTH, expand=True)
@@ -147,11 +1457,12 @@ class ChatInsightsApp:
         frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # File selection
-        file_frame = ttk.LabelFrame(frame, text="AI Chat Export File (ChatGPT, Claude or Deepseek)")
+        file_frame = ttk.LabelFrame(frame, text="AI Chat Export File or .zip (ChatGPT, Claude or Deepseek)")
         file_frame.pack(fill=tk.X, pady=10)
         
         self.file_path_var = tk.StringVar()
-        if self.config["last_import_file"] and os.path.exists(self.config["last_import_file"]):
+        last_exports = [path for path in self.config["last_import_file"].split(EXPORT_PATH_SEPARATOR) if path]
+        if last_exports and all(os.path.exists(path) for path in last_exports):
             self.file_path_var.set(self.config["last_import_file"])
         
         file_entry = ttk.Entry(file_frame, textvariable=self.file_path_var, width=70)
@@ -211,6 +1522,16 @@ class ChatInsightsApp:
         self.system_name_var = tk.StringVar(value=self.config["system_name"])
         ttk.Entry(names_frame, textvariable=self.system_name_var, width=20).grid(row=1, column=1, padx=5, pady=2)
         
+        # Zip exports
+        self.import_attachments_var = tk.BooleanVar(value=self.config.get("import_attachments", False))
+        ttk.Checkbutton(names_frame, text="Copy attachments from .zip exports", variable=self.import_attachments_var).grid(row=1, column=2, columnspan=2, padx=5, pady=2, sticky=tk.W)
+        
+        self.merge_existing_var = tk.BooleanVar(value=self.config.get("merge_into_existing", False))
+        ttk.Checkbutton(names_frame, text="Merge into existing corpus (dedupe snapshots)", variable=self.merge_existing_var).grid(row=2, column=2, columnspan=2, padx=5, pady=2, sticky=tk.W)
+        
+        self.export_tables_var = tk.BooleanVar(value=self.config.get("export_tables", False))
+        ttk.Checkbutton(names_frame, text="Export message tables (Parquet, needs pyarrow)", variable=self.export_tables_var).grid(row=3, column=2, columnspan=2, padx=5, pady=2, sticky=tk.W)
+        
         # Action buttons
         buttons_frame = ttk.Frame(frame)
         buttons_frame.pack(fill=tk.X, pady=10)
@@ -282,6 +1603,191 @@ class ChatInsightsApp:
         
         return "unknown"
     
+    def iter_export_conversations(self, file_path):
+        """Stream conversations from a conversations.json file or straight out of an export zip"""
+        if zipfile.is_zipfile(file_path):
+            with zipfile.ZipFile(file_path) as zf:
+                member = self.find_conversations_member(zf)
+                if not member:
+                    raise ValueError("No conversations.json found in the export archive")
+                with zf.open(member) as raw:
+                    yield from iter_json_array(io.TextIOWrapper(raw, encoding='utf-8'))
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                yield from iter_json_array(f)
+    
+    def read_export_extras(self, file_path, data_dir, platform=None):
+        """Pick up account/project metadata and (optionally) attachments from an export zip.
+        
+        Attachments keep their relative path inside the archive under data/attachments, so
+        same-named files from different folders don't overwrite each other; members with
+        ".." or absolute paths are skipped. Metadata is stored per export file name in
+        export_metadata.json, next to what earlier exports recorded.
+        """
+        metadata = {}
+        attachments = 0
+        skipped = 0
+        attachments_dir = os.path.join(data_dir, "attachments")
+        
+        with zipfile.ZipFile(file_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                name = os.path.basename(info.filename)
+                lower = name.lower()
+                
+                if lower in EXPORT_METADATA_FILES:
+                    try:
+                        with zf.open(info) as raw:
+                            metadata[lower[:-5]] = json.load(io.TextIOWrapper(raw, encoding='utf-8'))
+                    except Exception as e:
+                        self.log(f"Skipping unreadable {name}: {e}")
+                elif self.config.get("import_attachments") and not lower.endswith(('.json', '.html')):
+                    parts = self.attachment_path_parts(info.filename)
+                    if parts is None:
+                        skipped += 1
+                        continue
+                    # Stream each attachment straight to its destination - no temp extraction
+                    target = os.path.join(attachments_dir, *parts)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with zf.open(info) as src, open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    attachments += 1
+        
+        if metadata:
+            metadata_file = os.path.join(data_dir, "export_metadata.json")
+            try:
+                with open(metadata_file, 'r', encoding='utf-8') as f:
+                    exports = json.load(f)
+            except (OSError, ValueError):
+                exports = {}
+            if not isinstance(exports, dict) or set(exports) <= {name[:-5] for name in EXPORT_METADATA_FILES}:
+                # Nothing saved yet, or a single-export file from before metadata was kept per export
+                exports = {}
+            exports[os.path.basename(file_path)] = dict(metadata, platform=platform) if platform else metadata
+            with open(metadata_file, 'w', encoding='utf-8') as f:
+                json.dump(exports, f, ensure_ascii=False, indent=4)
+            self.log(f"Saved export metadata ({', '.join(sorted(metadata))}) to export_metadata.json")
+        if attachments:
+            self.log(f"Copied {attachments} attachments to {attachments_dir}")
+        if skipped:
+            self.log(f"Skipped {skipped} attachments with unsafe paths")
+        
+        return metadata
+    
+    def attachment_path_parts(self, member_name):
+        """Sanitised path components of a zip member, or None if it would leave the attachments folder"""
+        name = member_name.replace("\\", "/")
+        if name.startswith("/") or re.match(r"^[A-Za-z]:", name):
+            return None
+        parts = [part for part in name.split("/") if part not in ("", ".")]
+        if not parts or ".." in parts:
+            return None
+        return [re.sub(r'[<>:"|?*\x00-\x1f]', "_", part) for part in parts]
+    
+    def find_conversations_member(self, zip_file):
+        """Return the conversations.json member of an export zip, or None"""
+        candidates = [name for name in zip_file.namelist()
+                      if os.path.basename(name).lower() == "conversations.json"]
+        # Prefer the shallowest match in case the archive nests older exports
+        candidates.sort(key=lambda name: name.count('/'))
+        return candidates[0] if candidates else None
+    
+    def describe_schema(self, platform, item):
+        """Name the export schema variant from a single conversation object"""
+        if platform == "chatgpt":
+            return "conversation_id" if 'conversation_id' in item else "mapping"
+        if platform == "deepseek":
+            return "fragments"
+        if platform == "claude":
+            for msg in item.get('chat_messages', []) or []:
+                if isinstance(msg, dict) and isinstance(msg.get('content'), list):
+                    return "content blocks"
+            return "text"
+        return ""
+    
+    def sniff_export(self, file_path):
+        """Identify an export's platform, schema and size from its first few conversations.
+        
+        Reads only the start of conversations.json (or of the conversations member
+        inside an export zip), so large exports are identified without a full json.load.
+        """
+        info = {
+            "platform": "unknown",
+            "schema": "",
+            "estimated_conversations": 0,
+            "file_size": os.path.getsize(file_path),
+            "archive": zipfile.is_zipfile(file_path),
+            "member": None,
+        }
+        
+        if info["archive"]:
+            with zipfile.ZipFile(file_path) as zf:
+                member = self.find_conversations_member(zf)
+                if not member:
+                    return info
+                info["member"] = member
+                info["file_size"] = zf.getinfo(member).file_size
+                names = {os.path.basename(name).lower() for name in zf.namelist()}
+                with zf.open(member) as raw:
+                    self._sniff_stream(io.TextIOWrapper(raw, encoding='utf-8'), info)
+                
+                # Fall back on the other files each platform ships in its archive
+                if info["platform"] == "unknown":
+                    for platform, hints in ZIP_PLATFORM_HINTS.items():
+                        if any(hint in names for hint in hints):
+                            info["platform"] = platform
+                            break
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                self._sniff_stream(f, info)
+        
+        return info
+    
+    def _sniff_stream(self, stream, info):
+        """Decode the first conversations from a stream and fill in sniff results"""
+        consumed = [0]
+        
+        class _CountingReader:
+            # Stops the decoder at SNIFF_MAX_BYTES so a huge first conversation can't stall the UI
+            def read(self, size=-1):
+                if consumed[0] >= SNIFF_MAX_BYTES:
+                    return ''
+                remaining = SNIFF_MAX_BYTES - consumed[0]
+                chunk = stream.read(remaining if size is None or size < 0 else min(size, remaining))
+                consumed[0] += len(chunk)
+                return chunk
+        
+        items = []
+        try:
+            for item in iter_json_array(_CountingReader(), chunk_size=8 * 1024):
+                items.append(item)
+                if consumed[0] >= SNIFF_SAMPLE_BYTES:
+                    break
+        except ValueError:
+            # Truncated at SNIFF_MAX_BYTES - use whatever was decoded
+            pass
+        
+        if not items:
+            return
+        
+        info["platform"] = self.detect_platform(items)
+        if isinstance(items[0], dict):
+            info["schema"] = self.describe_schema(info["platform"], items[0])
+        
+        if consumed[0] < SNIFF_SAMPLE_BYTES:
+            # The whole file fit in the sample, so the count is exact
+            info["estimated_conversations"] = len(items)
+        else:
+            info["estimated_conversations"] = max(len(items), int(info["file_size"] * len(items) / consumed[0]))
+    
+    def format_size(self, num_bytes):
+        """Human readable file size"""
+        for unit in ["B", "KB", "MB", "GB"]:
+            if num_bytes < 1024 or unit == "GB":
+                return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+            num_bytes /= 1024
+    
     def create_concepts_tab(self):
         """Create concept tracking tab"""
         frame = ttk.Frame(self.concepts_tab)
@@ -315,20 +1821,7 @@ Once you've processed your AI export, you can run the concept tracker to:
         self.concepts_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         # Add default concepts
-        default_concepts = """
-AI: \\bAI\\b|Artificial Intelligence|GPT|Claude|LLM|Language Model|Deepseek
-Claude: \\bClaude\\b|Anthropic
-ChatGPT: \\bChatGPT\\b|\\bGPT\\b|OpenAI
-Deepseek: \\bDeepseek\\b|\\bDeepSeek\\b
-Programming: Python|JavaScript|Code|Programming|Script|Function|API
-Framework: Framework|Library|Architecture|Structure|System
-Data: Data|Database|CSV|JSON|Analysis|Dataset
-Machine Learning: Machine Learning|ML|Training|Model|Neural|Deep Learning
-Development: Development|Software|Application|Project|Build
-Security: Security|Privacy|Encryption|Authentication|Safety
-Cloud: Cloud|AWS|Azure|Google Cloud|Deployment
-        """
-        self.concepts_text.insert(tk.END, default_concepts.strip())
+        self.concepts_text.insert(tk.END, DEFAULT_CONCEPTS.strip())
         
         # Run tracker button
         buttons_frame = ttk.Frame(frame)
@@ -337,6 +1830,32 @@ Cloud: Cloud|AWS|Azure|Google Cloud|Deployment
         self.run_tracker_btn = ttk.Button(buttons_frame, text="Run Concept Tracker", command=self.run_concept_tracker)
         self.run_tracker_btn.pack(side=tk.LEFT, padx=5)
         
+        self.validate_patterns_btn = ttk.Button(buttons_frame, text="Validate & Benchmark Patterns", command=self.validate_concept_patterns)
+        self.validate_patterns_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.mine_bodies_var = tk.BooleanVar(value=self.config.get("mine_message_bodies", False))
+        ttk.Checkbutton(buttons_frame, text="Mine recurring terms from message text", variable=self.mine_bodies_var).pack(side=tk.LEFT, padx=10)
+        
+        self.auto_concepts_var = tk.BooleanVar(value=self.config.get("auto_concepts", False))
+        ttk.Checkbutton(buttons_frame, text="Discover concepts automatically", variable=self.auto_concepts_var).pack(side=tk.LEFT, padx=10)
+        
+        # Semantic similarity search over a local embedding model
+        semantic_frame = ttk.LabelFrame(frame, text="Similar Conversations (local embedding model)")
+        semantic_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(semantic_frame, text="Model folder:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        self.embedding_model_var = tk.StringVar(value=self.config.get("embedding_model", ""))
+        ttk.Entry(semantic_frame, textvariable=self.embedding_model_var, width=50).grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
+        ttk.Button(semantic_frame, text="Browse...", command=self.browse_embedding_model).grid(row=0, column=2, padx=5, pady=5)
+        self.build_embeddings_btn = ttk.Button(semantic_frame, text="Build Embedding Index", command=self.run_embedding_index)
+        self.build_embeddings_btn.grid(row=0, column=3, padx=5, pady=5)
+        
+        ttk.Label(semantic_frame, text="Find conversations about:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.similar_query_var = tk.StringVar()
+        ttk.Entry(semantic_frame, textvariable=self.similar_query_var, width=50).grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        self.search_similar_btn = ttk.Button(semantic_frame, text="Search", command=self.run_similarity_search)
+        self.search_similar_btn.grid(row=1, column=2, padx=5, pady=5)
+        
         # Stats frame
         self.stats_frame = ttk.LabelFrame(frame, text="Concept Statistics")
         self.stats_frame.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -381,10 +1900,13 @@ You can use this data to:
         min_len_frame = ttk.Frame(options_frame)
         min_len_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        ttk.Label(min_len_frame, text="Minimum instruction length (characters):").pack(side=tk.LEFT, padx=5)
+        ttk.Label(min_len_frame, text="Minimum instruction length:").pack(side=tk.LEFT, padx=5)
         
         self.min_length_var = tk.IntVar(value=10)
         ttk.Spinbox(min_len_frame, from_=1, to=100, textvariable=self.min_length_var, width=5).pack(side=tk.LEFT, padx=5)
+        self.min_length_unit_var = tk.StringVar(value=self.config.get("min_length_unit", "chars"))
+        ttk.Combobox(min_len_frame, textvariable=self.min_length_unit_var, values=["chars", "tokens"], width=7,
+                     state="readonly").pack(side=tk.LEFT, padx=5)
         
         # Format selection
         format_frame = ttk.Frame(options_frame)
@@ -396,6 +1918,65 @@ You can use this data to:
         ttk.Radiobutton(format_frame, text="JSONL (for fine-tuning)", variable=self.format_var, value="jsonl").pack(side=tk.LEFT, padx=5)
         ttk.Radiobutton(format_frame, text="CSV", variable=self.format_var, value="csv").pack(side=tk.LEFT, padx=5)
         
+        # Sample formats
+        samples_frame = ttk.Frame(options_frame)
+        samples_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        ttk.Label(samples_frame, text="Samples:").pack(side=tk.LEFT, padx=5)
+        
+        formats = self.config.get("training_formats", ["pairs"])
+        self.training_format_vars = {}
+        for sample_format, label in (("pairs", "Single-turn pairs"), ("chat", "Multi-turn chat"), ("reasoning", "Reasoning traces")):
+            self.training_format_vars[sample_format] = tk.BooleanVar(value=sample_format in formats)
+            ttk.Checkbutton(samples_frame, text=label, variable=self.training_format_vars[sample_format]).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(samples_frame, text="Chat token budget:").pack(side=tk.LEFT, padx=5)
+        self.chat_budget_var = tk.IntVar(value=self.config.get("chat_token_budget", 2048))
+        ttk.Spinbox(samples_frame, from_=256, to=131072, increment=256, textvariable=self.chat_budget_var, width=7).pack(side=tk.LEFT, padx=5)
+        
+        # Deduplication
+        dedup_frame = ttk.Frame(options_frame)
+        dedup_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        ttk.Label(dedup_frame, text="Deduplicate:").pack(side=tk.LEFT, padx=5)
+        
+        self.dedup_mode_var = tk.StringVar(value=self.config.get("dedup_mode", "off"))
+        ttk.Radiobutton(dedup_frame, text="Off", variable=self.dedup_mode_var, value="off").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(dedup_frame, text="Exact", variable=self.dedup_mode_var, value="exact").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(dedup_frame, text="Near-duplicates", variable=self.dedup_mode_var, value="near").pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(dedup_frame, text="Similarity threshold:").pack(side=tk.LEFT, padx=5)
+        self.dedup_threshold_var = tk.DoubleVar(value=self.config.get("dedup_threshold", 0.8))
+        ttk.Spinbox(dedup_frame, from_=0.5, to=1.0, increment=0.05, textvariable=self.dedup_threshold_var, width=5).pack(side=tk.LEFT, padx=5)
+        
+        # Sharded output
+        shards_frame = ttk.Frame(options_frame)
+        shards_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        self.shard_output_var = tk.BooleanVar(value=self.config.get("shard_output", False))
+        ttk.Checkbutton(shards_frame, text="Sharded output, max MB per shard:", variable=self.shard_output_var).pack(side=tk.LEFT, padx=5)
+        self.shard_max_mb_var = tk.IntVar(value=self.config.get("shard_max_mb", 256))
+        ttk.Spinbox(shards_frame, from_=1, to=16384, textvariable=self.shard_max_mb_var, width=6).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(shards_frame, text="Validation %:").pack(side=tk.LEFT, padx=5)
+        self.validation_percent_var = tk.DoubleVar(value=round(self.config.get("validation_fraction", 0.0) * 100, 1))
+        ttk.Spinbox(shards_frame, from_=0, to=50, increment=1, textvariable=self.validation_percent_var, width=5).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(shards_frame, text="Shuffle seed:").pack(side=tk.LEFT, padx=5)
+        self.shuffle_seed_var = tk.IntVar(value=self.config.get("shuffle_seed", 42))
+        ttk.Entry(shards_frame, textvariable=self.shuffle_seed_var, width=8).pack(side=tk.LEFT, padx=5)
+        
+        # Pre-tokenised output
+        tokens_frame = ttk.Frame(options_frame)
+        tokens_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        self.pretokenize_var = tk.BooleanVar(value=self.config.get("pretokenize_training", False))
+        ttk.Checkbutton(tokens_frame, text="Also write token IDs (.npy) with tokenizer:", variable=self.pretokenize_var).pack(side=tk.LEFT, padx=5)
+        
+        self.tokenizer_path_var = tk.StringVar(value=self.config.get("tokenizer_path", ""))
+        ttk.Entry(tokens_frame, textvariable=self.tokenizer_path_var, width=40).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        ttk.Button(tokens_frame, text="Browse", command=self.browse_tokenizer).pack(side=tk.RIGHT, padx=5)
+        
         # Action buttons
         buttons_frame = ttk.Frame(frame)
         buttons_frame.pack(fill=tk.X, pady=10)
@@ -434,6 +2015,19 @@ You can use this data to:
         
         ttk.Button(path_frame, text="Browse", command=lambda: self.browse_dir(default_output_var)).grid(row=0, column=2, padx=5, pady=5)
         
+        # Output compression
+        compression_frame = ttk.LabelFrame(frame, text="Output Compression")
+        compression_frame.pack(fill=tk.X, pady=10)
+        
+        self.compression_var = tk.StringVar(value=self.config.get("output_compression", "none"))
+        ttk.Radiobutton(compression_frame, text="None", variable=self.compression_var, value="none").pack(side=tk.LEFT, padx=10, pady=10)
+        ttk.Radiobutton(compression_frame, text="gzip", variable=self.compression_var, value="gzip").pack(side=tk.LEFT, padx=10, pady=10)
+        ttk.Radiobutton(compression_frame, text="zstd" if zstandard else "zstd (pip install zstandard)",
+                        variable=self.compression_var, value="zstd").pack(side=tk.LEFT, padx=10, pady=10)
+        
+        self.compress_transcripts_var = tk.BooleanVar(value=self.config.get("compress_transcripts", False))
+        ttk.Checkbutton(compression_frame, text="Also compress conversation .txt files", variable=self.compress_transcripts_var).pack(side=tk.LEFT, padx=10, pady=10)
+        
         # Action buttons
         buttons_frame = ttk.Frame(frame)
         buttons_frame.pack(fill=tk.X, pady=20)
@@ -473,29 +2067,56 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         about_label.pack(padx=10, pady=10)
 
     def browse_file(self):
-        """Open file dialog to select conversations.json"""
-        filename = filedialog.askopenfilename(
-            title="Select AI Export File (ChatGPT or Claude)",
-            filetypes=(("JSON files", "*.json"), ("All files", "*.*"))
+        """Open file dialog to select one or more conversations.json files or export zips"""
+        filenames = filedialog.askopenfilenames(
+            title="Select AI Export File(s) (ChatGPT, Claude or Deepseek)",
+            filetypes=(("AI exports", "*.json *.zip"), ("JSON files", "*.json"), ("Export archives", "*.zip"), ("All files", "*.*"))
         )
-        if filename:
+        if filenames:
+            filename = EXPORT_PATH_SEPARATOR.join(filenames)
             self.file_path_var.set(filename)
             self.config["last_import_file"] = filename
             self.save_config()
             
-            # Try to auto-detect platform
+            # Try to auto-detect platform from the start of each file
             try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                platform = self.detect_platform(data)
-                if platform != "unknown":
-                    self.platform_var.set(platform)
-                    self.platform_info.config(text=f"Detected: {platform.upper()}")
+                infos = [self.sniff_export(path) for path in filenames]
+                platforms = sorted({info["platform"] for info in infos if info["platform"] != "unknown"})
+                if platforms:
+                    if len(platforms) == 1:
+                        self.platform_var.set(platforms[0])
+                    else:
+                        self.platform_var.set("auto")
+                    details = [f"Detected: {', '.join(p.upper() for p in platforms)}"]
+                    if len(infos) == 1 and infos[0]["schema"]:
+                        details[0] += f" ({infos[0]['schema']})"
+                    if len(infos) > 1:
+                        details.append(f"{len(infos)} exports")
+                    estimated = sum(info["estimated_conversations"] for info in infos)
+                    if estimated:
+                        details.append(f"~{estimated:,} conversations")
+                    details.append(self.format_size(sum(info["file_size"] for info in infos)))
+                    self.platform_info.config(text=" · ".join(details))
                 else:
                     self.platform_info.config(text="Unable to auto-detect, please select manually")
             except Exception as e:
                 self.platform_info.config(text="Error reading file")
     
+    def browse_tokenizer(self):
+        """Browse for a local tokenizer file"""
+        file_path = filedialog.askopenfilename(
+            title="Select Tokenizer",
+            filetypes=[("Tokenizer files", "*.model *.json *.tiktoken"), ("All files", "*.*")]
+        )
+        if file_path:
+            self.tokenizer_path_var.set(file_path)
+    
+    def browse_embedding_model(self):
+        """Browse for a local embedding model folder"""
+        directory = filedialog.askdirectory(title="Select Embedding Model Folder")
+        if directory:
+            self.embedding_model_var.set(directory)
+    
     def browse_output_dir(self):
         """Open directory dialog to select output location"""
         directory = filedialog.askdirectory(title="Select Output Directory")
@@ -512,19 +2133,28 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
     
     def log(self, message):
         """Add message to log and scroll to end"""
+        if self.root is None:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+            return
         self.log_text.insert(tk.END, f"{message}\n")
         self.log_text.see(tk.END)
         self.root.update_idletasks()
     
     def update_status(self, message):
         """Update status bar"""
+        if self.root is None:
+            return
         self.status_var.set(message)
         self.root.update_idletasks()
     
+    def get_selected_exports(self):
+        """Export paths from the file entry (several are separated by ';')"""
+        return [path.strip() for path in self.file_path_var.get().split(EXPORT_PATH_SEPARATOR) if path.strip()]
+    
     def process_export(self):
         """Process the AI export file"""
-        file_path = self.file_path_var.get()
-        if not file_path or not os.path.exists(file_path):
+        file_paths = self.get_selected_exports()
+        if not file_paths or not all(os.path.exists(path) for path in file_paths):
             messagebox.showerror("Error", "Please select a valid AI export file")
             return
         
@@ -534,20 +2164,23 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         self.config["assistant_name"] = self.assistant_name_var.get()
         self.config["system_name"] = self.system_name_var.get()
         self.config["last_platform"] = self.platform_var.get()
+        self.config["import_attachments"] = self.import_attachments_var.get()
+        self.config["merge_into_existing"] = self.merge_existing_var.get()
+        self.config["export_tables"] = self.export_tables_var.get()
         self.save_config()
         
         # Run in a separate thread to keep UI responsive
         self.process_btn.config(state=tk.DISABLED)
         self.analyze_btn.config(state=tk.DISABLED)
         
-        processing_thread = threading.Thread(target=self._process_export_thread, args=(file_path,))
+        processing_thread = threading.Thread(target=self._process_export_thread, args=(file_paths,))
         processing_thread.daemon = True
         processing_thread.start()
     
     def process_and_analyze(self):
         """Process export and then run concept tracker"""
-        file_path = self.file_path_var.get()
-        if not file_path or not os.path.exists(file_path):
+        file_paths = self.get_selected_exports()
+        if not file_paths or not all(os.path.exists(path) for path in file_paths):
             messagebox.showerror("Error", "Please select a valid AI export file")
             return
         
@@ -557,69 +2190,41 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         self.config["assistant_name"] = self.assistant_name_var.get()
         self.config["system_name"] = self.system_name_var.get()
         self.config["last_platform"] = self.platform_var.get()
+        self.config["import_attachments"] = self.import_attachments_var.get()
+        self.config["merge_into_existing"] = self.merge_existing_var.get()
+        self.config["export_tables"] = self.export_tables_var.get()
         self.save_config()
         
         # Run in a separate thread to keep UI responsive
         self.process_btn.config(state=tk.DISABLED)
         self.analyze_btn.config(state=tk.DISABLED)
         
-        processing_thread = threading.Thread(target=self._process_and_analyze_thread, args=(file_path,))
+        processing_thread = threading.Thread(target=self._process_and_analyze_thread, args=(file_paths,))
         processing_thread.daemon = True
         processing_thread.start()
     
-    def _process_export_thread(self, file_path):
-        """Background thread for processing exports"""
+    def _process_export_thread(self, file_paths, analyze=False):
+        """Background thread for processing one or more exports (then the concept tracker, with analyze)"""
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
         try:
             self.update_status("Processing AI export...")
-            self.log("Starting to process AI export file...")
+            custom_concepts = self.read_concept_settings() if analyze else None
+            summary = self.run_import_pipeline(file_paths, self.platform_var.get(), self.config.get("merge_into_existing", False),
+                                               analyze, custom_concepts)
+            created_dirs = summary["created_dirs"]
+            training_pair_count = summary["training_pair_count"]
+            platform = ", ".join(summary["platforms"])
             
-            output_dir = self.config["output_dir"]
-            data_dir = os.path.join(output_dir, "data")
-            os.makedirs(data_dir, exist_ok=True)
-            
-            # Load the export
-            with open(file_path, 'r', encoding='utf-8') as f:
-                conversations_data = json.load(f)
-            
-            # Detect platform
-            platform = self.platform_var.get()
-            if platform == "auto":
-                platform = self.detect_platform(conversations_data)
-                self.log(f"Auto-detected platform: {platform}")
-            
-            if platform == "unknown":
-                self.log("Unable to detect platform. Please select manually.")
-                messagebox.showerror("Error", "Unable to detect export format. Please select the platform manually.")
-                self.process_btn.config(state=tk.NORMAL)
-                self.analyze_btn.config(state=tk.NORMAL)
-                return
-            
-            # Process conversations based on platform
-            self.log(f"Processing {platform.upper()} export with {len(conversations_data) if isinstance(conversations_data, list) else 'unknown number of'} conversations...")
-            
-            if platform == "chatgpt":
-                created_dirs, pruned_data = self.process_chatgpt_conversations(conversations_data, data_dir)
-            elif platform == "deepseek":
-                created_dirs, pruned_data = self.process_deepseek_conversations(conversations_data, data_dir)
-            else:  # claude
-                created_dirs, pruned_data = self.process_claude_conversations(conversations_data, data_dir)
-            
-            # Create training pairs
-            self.log("Generating training data pairs...")
-            training_pairs = self.create_training_pairs(pruned_data, os.path.join(data_dir, "training_data.jsonl"))
-            
-            # Generate conversation titles file for concept tracker
-            self.log("Generating conversation titles file for concept tracker...")
-            titles_file = self.generate_conversation_titles(data_dir)
-            
-            self.log("Processing complete!")
-            self.log(f"Processed {len(created_dirs)} conversations")
-            self.log(f"Created files in {len(set([info['directory'] for info in created_dirs]))} directories")
-            self.log(f"Generated {len(training_pairs)} training data pairs")
+            if analyze:
+                if "concepts" in summary["results"]:
+                    self.show_concept_results(summary["results"]["concepts"])
+                elif "concepts" in summary["errors"]:
+                    messagebox.showerror("Error", f"An error occurred in concept tracker: {summary['errors']['concepts']}")
             
             # Update result
             self.result_text.config(text=f"Successfully processed {len(created_dirs)} {platform.upper()} conversations. " +
-                                      f"Generated {len(training_pairs)} training pairs and prepared data for concept tracking.")
+                                      f"Generated {training_pair_count} training pairs and prepared data for concept tracking.")
             
             # Enable buttons
             self.open_output_btn.config(state=tk.NORMAL)
@@ -628,25 +2233,374 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             self.run_tracker_btn.config(state=tk.NORMAL)
             self.generate_btn.config(state=tk.NORMAL)
             
-            self.update_status("Processing complete")
+            self.update_status("Processing and concept tracking complete" if analyze else "Processing complete")
+            
+        except Exception as e:
+            self.log(f"Error: {str(e)}")
+            messagebox.showerror("Error", f"An error occurred while processing: {str(e)}")
+            self.process_btn.config(state=tk.NORMAL)
+            self.analyze_btn.config(state=tk.NORMAL)
+            self.update_status("Processing failed")
+    
+    def run_import_pipeline(self, file_paths, platform="auto", merge_existing=False, analyze=False, custom_concepts=None):
+        """Import exports and run every stage after the merge; no UI, so watch mode shares it.
+        
+        With analyze, the concept tracker (and vault copy) runs as a stage with
+        custom_concepts. Raises ValueError when no export format is recognised, and the
+        training or titles stage's error if either fails. Returns created_dirs, platforms,
+        training_pair_count and the stage results and errors.
+        """
+        self.log("Starting to process AI export file...")
+        output_dir = self.config["output_dir"]
+        data_dir = os.path.join(output_dir, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        
+        # Detect platforms from the start of each export
+        detected = []
+        archives = []
+        for file_path in file_paths:
+            export_info = self.sniff_export(file_path)
+            export_platform = platform if platform != "auto" else export_info["platform"]
+            if platform == "auto":
+                self.log(f"Auto-detected platform for {os.path.basename(file_path)}: {export_platform}")
+            
+            if export_info["archive"]:
+                if not export_info["member"]:
+                    raise ValueError(f"No conversations.json found in {os.path.basename(file_path)}")
+                self.log(f"Reading {export_info['member']} directly from the export archive")
+            
+            if export_platform != "unknown":
+                detected.append(export_platform)
+                self.log(f"Found {export_platform.upper()} export with ~{export_info['estimated_conversations']} conversations")
+                if export_info["archive"]:
+                    archives.append((file_path, export_platform))
+        
+        if not detected:
+            self.log("Unable to detect platform. Please select manually.")
+            raise ValueError("Unable to detect export format. Please select the platform manually.")
+        
+        # Metadata and attachments only come from exports that were recognised
+        for file_path, export_platform in archives:
+            self.read_export_extras(file_path, data_dir, export_platform)
+        
+        # Merge and deduplicate all exports into one corpus, processing each winner once
+        created_dirs, pruned_data, merge_stats = self.merge_exports(file_paths, data_dir, platform, merge_existing)
+        self.log(f"Merged {len(file_paths)} export(s): {merge_stats['seen']} conversations read, "
+                 f"{merge_stats['duplicates']} duplicates and {merge_stats['superseded']} older versions skipped, "
+                 f"{merge_stats['unchanged']} already up to date")
+        
+        # Everything after the merge reads the finished corpus, so independent stages overlap
+        stages = {
+            "training": (lambda results: self.create_training_pairs(
+                pruned_data, os.path.join(data_dir, "training_data.jsonl"))["pairs"]["count"], ()),
+            "titles": (lambda results: self.generate_conversation_titles(data_dir), ()),
+        }
+        if self.config.get("export_tables", False):
+            stages["tables"] = (lambda results: self.export_message_tables(pruned_data, data_dir), ())
+        if self.config.get("usage_analytics", True):
+            stages["usage"] = (lambda results: self.write_usage_analytics(
+                self.compute_usage_analytics(pruned_data), data_dir, os.path.join(output_dir, "Obsidian", "Concepts")), ())
+        if self.config.get("build_embeddings") and self.config.get("embedding_model"):
+            stages["embeddings"] = (lambda results: self.build_embedding_stage(data_dir), ())
+        if analyze:
+            # Concept discovery may read the embedding index, so it waits for it
+            stages["concepts"] = (lambda results: self.track_concepts(results["titles"], custom_concepts),
+                                  ("titles", "embeddings"))
+        
+        results, errors = self.run_stages(stages)
+        for name in ("training", "titles"):
+            if name in errors:
+                raise errors[name]
+        training_pair_count = results["training"]
+        if "usage" in results:
+            self.log(f"Usage for {results['usage']['models']} models across {results['usage']['months']} months "
+                     f"written to {results['usage']['csv']}")
+        
+        self.log("Processing complete!")
+        self.log(f"Processed {len(created_dirs)} conversations")
+        self.log(f"Created files in {len(set([info['directory'] for info in created_dirs]))} directories")
+        self.log(f"Generated {training_pair_count} training data pairs")
+        return {"created_dirs": created_dirs, "platforms": merge_stats["platforms"], "training_pair_count": training_pair_count,
+                "results": results, "errors": errors}
+    
+    def watch_exports(self, folder, once=False):
+        """Headless watch mode: import exports dropped into folder as they arrive.
+        
+        Changes are picked up through inotify on Linux, with a rescan every
+        watch_poll_seconds (the only trigger elsewhere). A file is imported once its size
+        and modification time have stayed the same for watch_settle_seconds and it reads
+        as an export, so half-copied files are left alone. Each batch is merged into the
+        existing corpus and runs the incremental pipeline. The app stays alive between
+        batches, so compiled concept patterns, the token counter cache and the embedding
+        index stay in memory. Imported files are remembered by size and mtime in
+        cache/watch_state.json. With once, returns when nothing is left to import.
+        """
+        folder = os.path.abspath(folder)
+        if not os.path.isdir(folder):
+            raise ValueError(f"Watch folder not found: {folder}")
+        state_file = os.path.join(self.config["output_dir"], CACHE_DIR_NAME, WATCH_STATE_FILE)
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                imported = {path: tuple(signature) for path, signature in json.load(f).items()}
+        except (OSError, ValueError):
+            imported = {}
+        
+        poll = max(1, self.config.get("watch_poll_seconds", 30))
+        settle = max(0, self.config.get("watch_settle_seconds", 10))
+        analyze = self.config.get("watch_analyze", True)
+        fd = open_inotify(folder)
+        self.log(f"Watching {folder} for exports ({'inotify' if fd is not None else f'polling every {poll}s'})")
+        
+        pending = {}  # path -> (signature, time it was first seen with that signature)
+        try:
+            while True:
+                now = time.monotonic()
+                ready = []
+                for entry in os.scandir(folder):
+                    if entry.name.startswith(".") or not entry.name.lower().endswith(WATCH_EXTENSIONS) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                    if imported.get(entry.path) == signature:
+                        continue
+                    if pending.get(entry.path, (None,))[0] != signature:
+                        pending[entry.path] = (signature, now)
+                    elif now - pending[entry.path][1] >= settle:
+                        ready.append(entry.path)
+                
+                exports = []
+                for path in sorted(ready):
+                    signature = pending.pop(path)[0]
+                    imported[path] = signature
+                    try:
+                        if self.sniff_export(path)["platform"] != "unknown":
+                            exports.append(path)
+                            continue
+                    except Exception as e:
+                        self.log(f"Could not read {os.path.basename(path)}: {e}")
+                    self.log(f"Skipping {os.path.basename(path)}: not a recognised export")
+                
+                if exports:
+                    self.log(f"Importing {', '.join(os.path.basename(path) for path in exports)}")
+                    start = time.perf_counter()
+                    try:
+                        custom_concepts = self.read_watch_concepts() if analyze else None
+                        self.run_import_pipeline(exports, "auto", True, analyze, custom_concepts)
+                        self.log(f"Watched import finished in {time.perf_counter() - start:.1f}s")
+                    except Exception as e:
+                        # Not retried until the file changes again
+                        self.log(f"Error importing {', '.join(os.path.basename(path) for path in exports)}: {e}")
+                if ready:
+                    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+                    with open(state_file, 'w', encoding='utf-8') as f:
+                        json.dump(imported, f, indent=2)
+                
+                if once and not pending:
+                    return
+                # Come back in time to import files that are settling, even without new events
+                timeout = min(poll, settle) if pending else poll
+                wait_for_change(fd, max(0.5, timeout))
+        except KeyboardInterrupt:
+            self.log("Stopped watching")
+        finally:
+            if fd is not None:
+                os.close(fd)
+    
+    def start_query_service(self, host=None, port=None):
+        """Bind the local query service over data/corpus.db (not yet serving); port 0 picks a free one.
+        
+        GET endpoints, all JSON except the export:
+          /health                      corpus counts plus cache and pool statistics
+          /search?q=&limit=&platform=  conversations containing q, title and summary matches first
+          /search?q=&mode=similar      nearest conversations from the embedding index instead
+          /conversation/<key or id>    one conversation with its messages and concepts
+          /concepts                    concepts by number of conversations
+          /concepts/<name>?limit=      monthly timeline and latest conversations for one concept
+          /export?format=&min_length=&limit=  training samples as chunked JSONL
+        """
+        data_dir = os.path.join(self.config["output_dir"], "data")
+        db_path = os.path.join(data_dir, CORPUS_DB_FILE)
+        if not os.path.exists(db_path):
+            raise ValueError(f"No corpus database found in {data_dir}. Please process an export first.")
+        host = host or self.config.get("serve_host", "127.0.0.1")
+        port = self.config.get("serve_port", 8765) if port is None else port
+        
+        server = ThreadingHTTPServer((host, port), CorpusRequestHandler)
+        server.daemon_threads = True
+        server.app = self
+        server.data_dir = data_dir
+        server.pool = CorpusConnectionPool(db_path, max(1, self.config.get("serve_pool_size", 4)))
+        server.cache = ResponseCache(int(self.config.get("serve_cache_mb", 64) * 1024 * 1024))
+        server.embed_lock = threading.Lock()
+        # The first read can create the WAL files, so do it before any response is cached
+        with server.pool.connection() as db:
+            db.execute("SELECT COUNT(*) FROM conversations").fetchone()
+        return server
+    
+    def serve_corpus(self, host=None, port=None):
+        """Run the query service until interrupted"""
+        server = self.start_query_service(host, port)
+        host, port = server.server_address[:2]
+        self.log(f"Serving {server.pool.path} on http://{host}:{port}/ (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.log("Stopped serving")
+        finally:
+            server.server_close()
+            server.pool.close()
+    
+    def answer_query(self, db, route, params, server):
+        """Payload for one JSON endpoint of the query service; LookupError means 404, ValueError 400"""
+        limit = int_param(params, "limit", 20, 1, SERVE_MAX_RESULTS)
+        if not route or route == ["health"]:
+            return {
+                "database": server.pool.path,
+                "conversations": db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+                "messages": db.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+                "concepts": db.execute("SELECT COUNT(DISTINCT concept) FROM concept_matches").fetchone()[0],
+                "pool": server.pool.size,
+                "cache": server.cache.stats(),
+            }
+        if route == ["search"]:
+            query = params.get("q", "").strip()
+            if not query:
+                raise ValueError("Missing search text (q)")
+            if params.get("mode", "text") == "similar":
+                if not os.path.exists(os.path.join(server.data_dir, EMBEDDING_DIR, "index.json")):
+                    raise ValueError("No embedding index found. Please build the embedding index first.")
+                # The query embedder and the cached index are shared, so one search at a time
+                with server.embed_lock:
+                    results = self.search_similar_conversations(query, limit, server.data_dir)
+                return {"query": query, "mode": "similar", "results": results}
+            return {"query": query, "mode": "text", "results": self.search_corpus(db, query, limit, params.get("platform"))}
+        if route[0] == "conversation" and len(route) == 2:
+            return self.fetch_conversation(db, route[1])
+        if route == ["concepts"]:
+            return {"concepts": [{"concept": concept, "conversations": count} for concept, count in db.execute(
+                "SELECT concept, COUNT(*) FROM concept_matches GROUP BY concept ORDER BY COUNT(*) DESC, concept")]}
+        if route[0] == "concepts" and len(route) == 2:
+            return self.concept_timeline(db, route[1], limit)
+        raise LookupError(f"Unknown endpoint /{'/'.join(route)}")
+    
+    def search_corpus(self, db, query, limit=20, platform=None):
+        """Conversations whose title, summary or messages contain query; title matches first, then by matching messages"""
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = db.execute(
+            "SELECT * FROM (SELECT c.key, c.conversation_id, c.platform, c.title, c.month, c.updated, m.name, "
+            "(c.title LIKE ?1 ESCAPE '\\' OR c.summary LIKE ?1 ESCAPE '\\') AS in_title, "
+            "(SELECT COUNT(*) FROM messages WHERE conversation = c.id AND text LIKE ?1 ESCAPE '\\') AS hits "
+            "FROM conversations c LEFT JOIN models m ON m.id = c.model_id WHERE ?2 IS NULL OR c.platform = ?2) "
+            "WHERE in_title OR hits ORDER BY in_title DESC, hits DESC, updated DESC LIMIT ?3",
+            (pattern, platform, limit)
+        )
+        return [{"key": key, "id": conversation_id, "platform": platform, "title": title, "month": month, "updated": updated,
+                 "model": model, "title_match": bool(in_title), "matching_messages": hits}
+                for key, conversation_id, platform, title, month, updated, model, in_title, hits in rows]
+    
+    def fetch_conversation(self, db, identifier):
+        """One conversation by key (platform:id) or bare conversation id, with its messages and matched concepts"""
+        row = db.execute(
+            "SELECT c.id, c.key, c.conversation_id, c.platform, c.title, c.summary, m.name, c.month, c.created, c.updated, "
+            "c.tokens, c.token_counter FROM conversations c LEFT JOIN models m ON m.id = c.model_id "
+            "WHERE c.key = ?1 OR c.conversation_id = ?1 ORDER BY c.key = ?1 DESC LIMIT 1", (identifier,)
+        ).fetchone()
+        if row is None:
+            raise LookupError(f"No conversation {identifier}")
+        row_id, key, conversation_id, platform, title, summary, model, month, created, updated, tokens, token_counter = row
+        messages = [{"author": author, "role": role, "block_type": block_type, "text": text, "model": message_model,
+                     "tokens": message_tokens}
+                    for author, role, block_type, text, message_model, message_tokens in db.execute(
+                        "SELECT msg.author, msg.role, msg.block_type, msg.text, mm.name, msg.tokens FROM messages msg "
+                        "LEFT JOIN models mm ON mm.id = msg.model_id WHERE msg.conversation = ? ORDER BY msg.position", (row_id,))]
+        concepts = [concept for concept, in db.execute(
+            "SELECT concept FROM concept_matches WHERE conversation = ? ORDER BY concept", (row_id,))]
+        return {"key": key, "id": conversation_id, "platform": platform, "title": title, "summary": summary, "model": model,
+                "month": month, "created": created, "updated": updated, "tokens": tokens, "token_counter": token_counter,
+                "concepts": concepts, "messages": messages}
+    
+    def concept_timeline(self, db, concept, limit=20):
+        """Conversations per month for one concept, oldest month first, plus the latest matching conversations"""
+        months = db.execute(
+            "SELECT c.month, COUNT(*) FROM concept_matches cm JOIN conversations c ON c.id = cm.conversation "
+            "WHERE cm.concept = ? GROUP BY c.month", (concept,)
+        ).fetchall()
+        if not months:
+            raise LookupError(f"No conversations match concept {concept}")
+        
+        def month_order(item):
+            try:
+                return datetime.strptime(item[0], '%B_%Y')
+            except (TypeError, ValueError):
+                return datetime.max
+        
+        latest = db.execute(
+            "SELECT c.key, c.title, c.month, c.updated FROM concept_matches cm JOIN conversations c ON c.id = cm.conversation "
+            "WHERE cm.concept = ? ORDER BY c.updated DESC LIMIT ?", (concept, limit)
+        )
+        return {"concept": concept, "conversations": sum(count for _, count in months),
+                "timeline": [{"month": month, "conversations": count} for month, count in sorted(months, key=month_order)],
+                "latest": [{"key": key, "title": title, "month": month, "updated": updated} for key, title, month, updated in latest]}
+    
+    def benchmark_query_service(self, requests=2000, concurrency=8):
+        """Serve the corpus on a free local port and replay a mix of queries against it.
+        
+        Searches use words from recent titles, fetches use real conversation keys and
+        timelines real concept names, so repeated paths exercise the response cache as
+        several people browsing the same corpus would. Logs and returns throughput and
+        latency percentiles (ms).
+        """
+        server = self.start_query_service(port=0)
+        host, port = server.server_address[:2]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with server.pool.connection() as db:
+                rows = db.execute("SELECT key, title FROM conversations ORDER BY updated DESC LIMIT 200").fetchall()
+                concepts = [concept for concept, in db.execute("SELECT DISTINCT concept FROM concept_matches LIMIT 20")]
+            if not rows:
+                raise ValueError("The corpus database has no conversations to query")
+            words = sorted({word.lower() for _, title in rows for word in re.findall(r"[A-Za-z]{5,}", title or "")})[:50]
+            paths = ["/health", "/concepts"]
+            paths += ["/search?" + urlencode({"q": word}) for word in words]
+            paths += ["/conversation/" + quote(key, safe="") for key, _ in rows[:100]]
+            paths += ["/concepts/" + quote(concept, safe="") for concept in concepts]
+            random.Random(0).shuffle(paths)
             
-        except Exception as e:
-            self.log(f"Error: {str(e)}")
-            messagebox.showerror("Error", f"An error occurred while processing: {str(e)}")
-            self.process_btn.config(state=tk.NORMAL)
-            self.analyze_btn.config(state=tk.NORMAL)
-            self.update_status("Processing failed")
+            self.log(f"Benchmarking http://{host}:{port}/ with {requests} requests over {concurrency} connections "
+                     f"({len(paths)} distinct paths)")
+            latencies, errors, elapsed = run_load_test(host, port, paths, requests, concurrency)
+            stats = length_stats([round(latency, 2) for latency in latencies])
+            stats.update(errors=errors, seconds=round(elapsed, 2), per_second=round(len(latencies) / elapsed, 1),
+                         cache=server.cache.stats())
+            self.log(f"{stats['per_second']} requests/s, latency p50 {stats['p50']} ms, p90 {stats['p90']} ms, "
+                     f"p99 {stats['p99']} ms, max {stats['max']} ms, {errors} errors; cache {stats['cache']['hits']} hits, "
+                     f"{stats['cache']['misses']} misses, {stats['cache']['evictions']} evictions")
+            return stats
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.pool.close()
+    
+    def read_watch_concepts(self):
+        """Concept patterns for watch mode, from watch_concepts_file or the defaults ({} = discovery only)"""
+        concepts_file = self.config.get("watch_concepts_file", "")
+        content = DEFAULT_CONCEPTS
+        if concepts_file:
+            with open(concepts_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+        custom_concepts = self.load_concept_patterns(content.strip())
+        if not custom_concepts and not self.config.get("auto_concepts", False):
+            self.log("No valid concepts found. Using default concepts.")
+            return None
+        return custom_concepts
     
-    def _process_and_analyze_thread(self, file_path):
+    def _process_and_analyze_thread(self, file_paths):
         """Background thread for processing exports and running concept tracker"""
         try:
-            # First process the export
-            self._process_export_thread(file_path)
-            
-            # Then run the concept tracker
+            # The concept tracker runs as a pipeline stage once the titles are written
             self.notebook.select(1)  # Switch to concept tracker tab
-            self.run_concept_tracker()
-            
+            self._process_export_thread(file_paths, analyze=True)
+        
         except Exception as e:
             self.log(f"Error: {str(e)}")
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
@@ -654,9 +2608,68 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             self.analyze_btn.config(state=tk.NORMAL)
             self.update_status("Processing failed")
     
-    def parse_concept_regex(self, content):
-        """Parse the Concept-regex.md format into concept patterns"""
-        concepts = {}
+    def run_stages(self, stages, workers=None):
+        """Run a graph of pipeline stages, each as soon as the stages it depends on have finished.
+        
+        stages maps a name to (function, dependencies); functions are called with the
+        results of the finished stages, and dependencies that are not in the graph are
+        ignored. Independent stages overlap on up to pipeline_workers threads (the heavy
+        ones spread their own work over process pools). A failed stage is logged and the
+        stages depending on it are skipped. Returns ({name: result}, {name: exception}).
+        """
+        workers = workers or self.config.get("pipeline_workers") or min(4, os.cpu_count() or 1)
+        pending = {name: (function, [dependency for dependency in dependencies if dependency in stages])
+                   for name, (function, dependencies) in stages.items()}
+        results = {}
+        errors = {}
+        running = {}
+        start = time.perf_counter()
+        self.log(f"Running {', '.join(stages)}...")
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                for name, (function, dependencies) in list(pending.items()):
+                    failed = [dependency for dependency in dependencies if dependency in errors]
+                    if failed:
+                        errors[name] = RuntimeError(f"skipped because {', '.join(failed)} failed")
+                        self.log(f"Skipping {name}: {', '.join(failed)} failed")
+                        del pending[name]
+                    elif all(dependency in results for dependency in dependencies):
+                        running[executor.submit(function, results)] = (name, time.perf_counter())
+                        del pending[name]
+                if not running:
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, started = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        self.debug_log(f"Stage {name} finished in {time.perf_counter() - started:.1f}s", key="stage")
+                    except Exception as e:
+                        errors[name] = e
+                        self.log(f"Error in {name}: {e}")
+        
+        self.log(f"Ran {len(stages)} stages on {workers} threads in {time.perf_counter() - start:.1f}s")
+        return results, errors
+    
+    def build_embedding_stage(self, data_dir):
+        """Pipeline stage: build the embedding index, logging (not raising) failures"""
+        self.log("Embedding conversations for similarity search...")
+        try:
+            return self.build_embedding_index(data_dir=data_dir)
+        except Exception as embed_e:
+            self.log(f"Error building embedding index: {embed_e}")
+    
+    def build_concept_pattern_set(self, content):
+        """Parse, validate and optimise the Concept-regex.md format.
+        
+        Returns a dict with the final pattern source for each concept and a list of
+        validation errors. Plain single-word terms are merged into one
+        \\b(?:a|b|c)\\b alternation so each title is scanned once per concept.
+        """
+        patterns = {}
+        errors = []
         lines = content.strip().split('\n')
         
         for line in lines:
@@ -665,47 +2678,289 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 continue
                 
             if ':' in line:
-                concept_name, patterns = line.split(':', 1)
+                concept_name, pattern_text = line.split(':', 1)
                 concept_name = concept_name.strip()
-                pattern_text = patterns.strip()
+                pattern_text = pattern_text.strip()
                 
                 # Clean up the pattern - add word boundaries and handle pipes
+                literal_words = []
                 pattern_parts = []
+                seen = set()
                 for part in pattern_text.split('|'):
                     part = part.strip()
-                    if part and not part.startswith('\\b') and not part.endswith('\\b'):
-                        # Add word boundaries for standalone terms
+                    if not part or part.lower() in seen:
+                        continue
+                    seen.add(part.lower())
+                    
+                    bounded_word = re.fullmatch(r'\\b(\w+)\\b', part)
+                    if bounded_word:
+                        literal_words.append(bounded_word.group(1))
+                        continue
+                    
+                    if not part.startswith('\\b') and not part.endswith('\\b'):
                         if ' ' not in part:  # Single word
+                            if re.fullmatch(r'\w+', part):
+                                # Plain literal - merged into one alternation below
+                                literal_words.append(part)
+                                continue
                             part = f'\\b{part}\\b'
                         else:  # Multi-word phrase
                             part = part.replace(' ', '\\s+')
+                    
+                    # Validate each part on its own so one typo doesn't drop the concept
+                    try:
+                        re.compile(part)
+                    except re.error as e:
+                        errors.append({"concept": concept_name, "pattern": part, "error": str(e)})
+                        continue
                     pattern_parts.append(part)
                 
+                if literal_words:
+                    # Longest first so the alternation never stops on a shorter prefix
+                    literal_words.sort(key=len, reverse=True)
+                    pattern_parts.insert(0, f"\\b(?:{'|'.join(literal_words)})\\b")
+                
                 if pattern_parts:
-                    try:
-                        final_pattern = '|'.join(pattern_parts)
-                        concepts[concept_name] = re.compile(final_pattern, re.I)
-                    except re.error as e:
-                        self.log(f"Invalid regex for {concept_name}: {e}")
+                    patterns[concept_name] = '|'.join(pattern_parts)
+        
+        return {"patterns": patterns, "errors": errors}
+    
+    def parse_concept_regex(self, content):
+        """Parse the Concept-regex.md format into compiled concept patterns"""
+        pattern_set = self.build_concept_pattern_set(content)
+        for error in pattern_set["errors"]:
+            self.log(f"Invalid regex for {error['concept']} ({error['pattern']}): {error['error']}")
+        return {name: self.compile_concept_pattern(source) for name, source in pattern_set["patterns"].items()}
+    
+    def load_concept_patterns(self, content):
+        """Return compiled concept patterns, using the on-disk cache keyed by definition hash"""
+        definition_hash = hashlib.sha256(f"v{CONCEPT_CACHE_VERSION}\n{content.strip()}".encode('utf-8')).hexdigest()
+        
+        # In-memory cache first - repeated tracker runs in one session skip everything
+        cache = self._concept_pattern_cache
+        if definition_hash in cache:
+            return cache[definition_hash]
+        
+        cache_dir = os.path.join(self.config["output_dir"], CACHE_DIR_NAME)
+        cache_file = os.path.join(cache_dir, CONCEPT_CACHE_FILE)
+        disk_cache = {}
+        try:
+            if os.path.exists(cache_file):
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    disk_cache = json.load(f)
+        except Exception as e:
+            self.log(f"Ignoring unreadable concept cache: {e}")
+            disk_cache = {}
+        
+        pattern_set = disk_cache.get(definition_hash)
+        if pattern_set is None:
+            pattern_set = self.build_concept_pattern_set(content)
+            for error in pattern_set["errors"]:
+                self.log(f"Invalid regex for {error['concept']} ({error['pattern']}): {error['error']}")
+            pattern_set["created"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            disk_cache[definition_hash] = pattern_set
+            # Keep only the most recently built definitions so the file stays small
+            disk_cache = dict(sorted(disk_cache.items(), key=lambda item: item[1].get("created", ""))[-CONCEPT_CACHE_ENTRIES:])
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_file, 'w', encoding='utf-8') as f:
+                    json.dump(disk_cache, f, ensure_ascii=False, indent=4)
+            except Exception as e:
+                self.log(f"Could not write concept cache: {e}")
+        else:
+            self.log(f"Loaded {len(pattern_set['patterns'])} cached concept patterns")
         
+        concepts = {name: self.compile_concept_pattern(source) for name, source in pattern_set["patterns"].items()}
+        cache[definition_hash] = concepts
         return concepts
     
+    def compile_concept_pattern(self, source):
+        """Compile a concept pattern with the configured engine (RE2 when available)"""
+        engine = self.config.get("regex_engine", "auto")
+        if re2 is not None and engine in ("auto", "re2"):
+            try:
+                return re2.compile(f"(?i){source}")
+            except Exception:
+                # Backreferences and lookarounds aren't supported by RE2
+                if engine == "re2":
+                    self.log(f"RE2 cannot compile '{source}', falling back to Python re")
+        return re.compile(source, re.I)
+    
+    def find_risky_constructs(self, source):
+        """Statically flag regex constructs prone to catastrophic backtracking"""
+        return [label for check, label in RISKY_PATTERN_CHECKS if check.search(source)]
+    
+    def guard_concept_patterns(self, concepts):
+        """Quarantine concept patterns that blow their time budget on adversarial probes.
+        
+        Every Python re pattern is probed in a child process that is killed after
+        pattern_probe_timeout seconds, so a pathological pattern never reaches the tracker
+        thread; the static checks only label why a pattern is risky. The probes run side by
+        side. Patterns running on RE2 are linear-time and skip the probe.
+        Returns (safe_concepts, report).
+        """
+        timeout = float(self.config.get("pattern_probe_timeout", 2.0))
+        verdicts = self._pattern_guard_cache
+        
+        # Start every probe that has no verdict yet, then give each the same timeout
+        probes = {}
+        for pattern in concepts.values():
+            source = getattr(pattern, "pattern", "")
+            if isinstance(pattern, re.Pattern) and source not in verdicts and source not in probes:
+                probe = multiprocessing.Process(target=probe_pattern, args=(source, PATTERN_PROBES))
+                probe.daemon = True
+                probe.start()
+                probes[source] = (probe, time.perf_counter())
+        for source, (probe, start) in probes.items():
+            probe.join(max(0.0, start + timeout - time.perf_counter()))
+            timed_out = probe.is_alive()
+            if timed_out:
+                probe.terminate()
+                probe.join()
+            verdicts[source] = {"timed_out": timed_out, "probe_ms": (time.perf_counter() - start) * 1000}
+        
+        safe_concepts = {}
+        report = []
+        for concept, pattern in concepts.items():
+            source = getattr(pattern, "pattern", "")
+            risks = self.find_risky_constructs(source)
+            linear = not isinstance(pattern, re.Pattern)
+            
+            if not linear:
+                verdict = verdicts[source]
+                if risks or verdict["timed_out"]:
+                    report.append({"concept": concept, "risks": risks, "quarantined": verdict["timed_out"],
+                                   "probe_ms": verdict["probe_ms"]})
+                if verdict["timed_out"]:
+                    self.log(f"Quarantined concept '{concept}': pattern exceeded {timeout:.1f}s on probes"
+                             + (f" ({', '.join(risks)})" if risks else ""))
+                    continue
+                if risks:
+                    self.log(f"Warning: concept '{concept}' has {', '.join(risks)} but passed probes")
+            elif risks:
+                report.append({"concept": concept, "risks": risks, "quarantined": False, "probe_ms": 0.0})
+            
+            safe_concepts[concept] = pattern
+        
+        return safe_concepts, report
+    
+    def benchmark_concept_patterns(self, concepts, samples, repeat=3):
+        """Time every concept pattern against sample titles and adversarial probes.
+        
+        Returns one result per concept sorted slowest first, so catastrophic
+        backtracking shows up before it stalls a real tracker run.
+        """
+        # Long near-miss inputs are where nested quantifiers blow up
+        safe_concepts, guard_report = self.guard_concept_patterns(concepts)
+        quarantined = {entry["concept"]: entry for entry in guard_report if entry["quarantined"]}
+        risks = {entry["concept"]: entry["risks"] for entry in guard_report}
+        results = []
+        
+        for concept, pattern in concepts.items():
+            if concept in quarantined:
+                results.append({
+                    "concept": concept,
+                    "pattern": pattern.pattern,
+                    "matches": 0,
+                    "avg_us": 0.0,
+                    "probe_ms": quarantined[concept]["probe_ms"],
+                    "risks": risks[concept],
+                    "quarantined": True,
+                })
+                continue
+            
+            start = time.perf_counter()
+            matches = 0
+            for _ in range(repeat):
+                for sample in samples:
+                    if pattern.search(sample):
+                        matches += 1
+            sample_time = time.perf_counter() - start
+            
+            probe_start = time.perf_counter()
+            for probe in PATTERN_PROBES:
+                pattern.search(probe)
+            probe_time = time.perf_counter() - probe_start
+            
+            runs = max(len(samples) * repeat, 1)
+            results.append({
+                "concept": concept,
+                "pattern": pattern.pattern,
+                "matches": matches // repeat,
+                "avg_us": sample_time / runs * 1e6,
+                "probe_ms": probe_time * 1000,
+                "risks": risks.get(concept, []),
+                "quarantined": False,
+            })
+        
+        results.sort(key=lambda x: (x["quarantined"], x["avg_us"] + x["probe_ms"] * 1000), reverse=True)
+        return results
+    
+    def validate_concept_patterns(self):
+        """Validate and benchmark the concept definitions without running the tracker"""
+        concepts_text = self.concepts_text.get("1.0", tk.END).strip()
+        
+        self.validate_patterns_btn.config(state=tk.DISABLED)
+        
+        benchmark_thread = threading.Thread(target=self._pattern_benchmark_thread, args=(concepts_text,))
+        benchmark_thread.daemon = True
+        benchmark_thread.start()
+    
+    def _pattern_benchmark_thread(self, concepts_text):
+        """Background thread for pattern validation and benchmarking"""
+        try:
+            self.update_status("Benchmarking concept patterns...")
+            pattern_set = self.build_concept_pattern_set(concepts_text)
+            concepts = self.load_concept_patterns(concepts_text)
+            
+            # Benchmark against real titles when available
+            samples = []
+            titles_file = os.path.join(self.config["output_dir"], "data", "conversation_titles.txt")
+            if os.path.exists(titles_file):
+                tracker = self.ConceptTracker(concepts)
+                samples = [conv['title'] for conv in tracker.process_conversation_file(titles_file)]
+            if not samples:
+                samples = ["Python script for data analysis", "Claude API integration", "Untitled"]
+            
+            results = self.benchmark_concept_patterns(concepts, samples)
+            
+            self.stats_text.delete("1.0", tk.END)
+            self.stats_text.insert(tk.END, f"Validated {len(concepts)} concepts against {len(samples)} titles\n\n")
+            
+            if pattern_set["errors"]:
+                self.stats_text.insert(tk.END, "Invalid patterns (skipped):\n")
+                for error in pattern_set["errors"]:
+                    self.stats_text.insert(tk.END, f"- {error['concept']}: {error['pattern']} ({error['error']})\n")
+                self.stats_text.insert(tk.END, "\n")
+            
+            self.stats_text.insert(tk.END, "Per-pattern match cost (slowest first):\n")
+            for result in results:
+                warning = "  <-- SLOW" if result["probe_ms"] > 50 else ""
+                if result["quarantined"]:
+                    warning = "  <-- QUARANTINED (timed out on probes)"
+                elif result["risks"]:
+                    warning += f"  ({', '.join(result['risks'])})"
+                self.stats_text.insert(tk.END, f"- {result['concept']}: {result['avg_us']:.1f} µs/title, "
+                                               f"probes {result['probe_ms']:.1f} ms, {result['matches']} matches{warning}\n")
+            
+            self.update_status("Pattern validation complete")
+        except Exception as e:
+            self.log(f"Error validating concept patterns: {str(e)}")
+            messagebox.showerror("Error", f"An error occurred while validating patterns: {str(e)}")
+            self.update_status("Pattern validation failed")
+        finally:
+            self.validate_patterns_btn.config(state=tk.NORMAL)
+    
     def run_concept_tracker(self):
         """Run the concept tracker on processed data"""
         data_dir = os.path.join(self.config["output_dir"], "data")
         titles_file = os.path.join(data_dir, "conversation_titles.txt")
         
-        if not os.path.exists(titles_file):
+        if not os.path.exists(titles_file) and not self.get_corpus_db(data_dir):
             messagebox.showerror("Error", "Conversation titles file not found. Please process the AI export first.")
             return
         
-        # Get custom concepts from UI using the new parser
-        concepts_text = self.concepts_text.get("1.0", tk.END).strip()
-        custom_concepts = self.parse_concept_regex(concepts_text)
-        
-        if not custom_concepts:
-            messagebox.showwarning("Warning", "No valid concepts found. Using default concepts.")
-            custom_concepts = None
+        custom_concepts = self.read_concept_settings()
         
         # Run in a separate thread
         self.run_tracker_btn.config(state=tk.DISABLED)
@@ -714,52 +2969,193 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         tracking_thread.daemon = True
         tracking_thread.start()
     
+    def read_concept_settings(self):
+        """Concept patterns and tracker options from the Concepts tab (None = default concepts)"""
+        # Get custom concepts from UI using the new parser
+        concepts_text = self.concepts_text.get("1.0", tk.END).strip()
+        custom_concepts = self.load_concept_patterns(concepts_text)
+        self.config["mine_message_bodies"] = self.mine_bodies_var.get()
+        self.config["auto_concepts"] = self.auto_concepts_var.get()
+        
+        if not custom_concepts and self.config["auto_concepts"]:
+            # Discovered concepts replace the built-in defaults
+            custom_concepts = {}
+        elif not custom_concepts:
+            messagebox.showwarning("Warning", "No valid concepts found. Using default concepts.")
+            custom_concepts = None
+        return custom_concepts
+    
     def _concept_tracker_thread(self, titles_file, custom_concepts):
         """Background thread for concept tracking"""
         try:
             self.update_status("Running concept tracker...")
-            self.log("Starting concept tracking analysis...")
-            
-            obsidian_dir = os.path.join(self.config["output_dir"], "Obsidian", "Concepts")
-            os.makedirs(obsidian_dir, exist_ok=True)
-            
-            # Create and run tracker
-            tracker = self.ConceptTracker(custom_concepts)
-            results = tracker.process(titles_file, obsidian_dir)
-            
-            # Display results
-            self.stats_text.delete("1.0", tk.END)
-            self.stats_text.insert(tk.END, f"Processed {results['conversations']} conversations\n")
-            self.stats_text.insert(tk.END, f"Orphaned conversations: {results['orphaned']}\n\n")
-            self.stats_text.insert(tk.END, "Concept mentions:\n")
-            
-            for concept, count in sorted(results['concepts'].items(), key=lambda x: x[1], reverse=True):
-                if count > 0:
-                    self.stats_text.insert(tk.END, f"- {concept}: {count} mentions\n")
-            
-            self.stats_text.insert(tk.END, "\nAdditional terms found:\n")
-            for term, count in sorted(results['additional_terms'].items(), key=lambda x: x[1], reverse=True)[:15]:
-                self.stats_text.insert(tk.END, f"- {term}: {count} occurrences\n")
-            
-            self.log("Concept tracking complete!")
-            self.open_obsidian_btn.config(state=tk.NORMAL)
-            self.run_tracker_btn.config(state=tk.NORMAL)
-
-            # Copy conversations to Obsidian
-            try:
-                data_dir_for_copy = os.path.join(self.config["output_dir"], "data")
-                self.copy_conversations_to_obsidian(data_dir_for_copy, obsidian_dir)
-                self.update_status("Concept tracking and conversation copy complete")
-            except Exception as copy_e:
-                self.log(f"Error copying conversations to Obsidian: {copy_e}")
-                self.update_status("Concept tracking complete, but conversation copy failed")
+            results = self.track_concepts(titles_file, custom_concepts)
+            self.show_concept_results(results)
             
         except Exception as e:
             self.log(f"Error in concept tracker: {str(e)}")
             messagebox.showerror("Error", f"An error occurred in concept tracker: {str(e)}")
             self.run_tracker_btn.config(state=tk.NORMAL)
             self.update_status("Concept tracking failed")
+    
+    def track_concepts(self, titles_file, custom_concepts):
+        """Run the concept tracker into the Obsidian vault, then copy the conversations there.
+        
+        Returns the tracker results plus guard_report (quarantined patterns) and
+        vault_copied (False when the conversation copy failed).
+        """
+        self.log("Starting concept tracking analysis...")
+        
+        obsidian_dir = os.path.join(self.config["output_dir"], "Obsidian", "Concepts")
+        os.makedirs(obsidian_dir, exist_ok=True)
+        
+        # Quarantine patterns that would hang the tracker before running it
+        guard_report = []
+        if custom_concepts:
+            custom_concepts, guard_report = self.guard_concept_patterns(custom_concepts)
+        
+        # Local embeddings for concept discovery, when asked for (or "auto" and an index exists)
+        embeddings = None
+        data_dir = os.path.join(self.config["output_dir"], "data")
+        source = self.config.get("auto_concept_source", "auto")
+        if self.config.get("auto_concepts") and source != "tfidf":
+            if os.path.exists(os.path.join(data_dir, EMBEDDING_DIR, "index.json")):
+                index = self.load_embedding_index(data_dir)
+                embeddings = (index["vectors"], {row[2]: position for position, row in enumerate(index["meta"]["rows"]) if row[2]},
+                              index["meta"]["model"])
+            elif source == "embeddings":
+                self.log("No embedding index found - clustering TF-IDF vectors instead")
+        
+        # Create and run tracker
+        tracker = self.ConceptTracker(custom_concepts,
+                                      time_budget=self.config.get("pattern_time_budget"),
+                                      stopwords=self.config.get("term_stopwords"),
+                                      max_ngram=self.config.get("term_max_ngram", 3),
+                                      auto_concepts=self.config.get("auto_concepts", False),
+                                      cluster_count=self.config.get("auto_concept_count", 0),
+                                      cluster_state=os.path.join(self.config["output_dir"], CACHE_DIR_NAME, CLUSTER_STATE_FILE),
+                                      embeddings=embeddings,
+                                      state_file=os.path.join(self.config["output_dir"], CACHE_DIR_NAME, TRACKER_STATE_FILE)
+                                      if self.config.get("incremental_tracker", True) else None)
+        corpus_db = self.get_corpus_db()
+        pruned_file = None
+        if self.config.get("mine_message_bodies"):
+            pruned_file = corpus_db or find_output_file(os.path.join(self.config["output_dir"], "data", "pruned.json"))
+        results = tracker.process(titles_file, obsidian_dir, pruned_file, corpus_db)
+        self.log(f"Concept tracker: {results['new_conversations']} new or changed and {results['removed_conversations']} removed "
+                 f"conversations, {results['notes_written']} concept notes rewritten")
+        if tracker.cluster_action:
+            self.log(f"Concept discovery ({tracker.cluster_mode}): {tracker.cluster_action}")
+        for concept, stats in results['pattern_report'].items():
+            if stats['exceeded_budget']:
+                self.log(f"Concept '{concept}' exceeded its time budget; mentions are partial")
+        results['guard_report'] = guard_report
+        self.log("Concept tracking complete!")
+        
+        # Copy conversations to Obsidian
+        try:
+            self.copy_conversations_to_obsidian(data_dir, obsidian_dir)
+            results['vault_copied'] = True
+        except Exception as copy_e:
+            self.log(f"Error copying conversations to Obsidian: {copy_e}")
+            results['vault_copied'] = False
+        return results
+    
+    def show_concept_results(self, results):
+        """Show track_concepts results on the Concept Tracker tab"""
+        # Display results
+        self.stats_text.delete("1.0", tk.END)
+        self.stats_text.insert(tk.END, f"Processed {results['conversations']} conversations\n")
+        self.stats_text.insert(tk.END, f"Orphaned conversations: {results['orphaned']}\n\n")
+        self.stats_text.insert(tk.END, "Concept mentions:\n")
+        
+        for concept, count in sorted(results['concepts'].items(), key=lambda x: x[1], reverse=True):
+            if count > 0:
+                self.stats_text.insert(tk.END, f"- {concept}: {count} mentions\n")
+        
+        over_budget = [concept for concept, stats in results['pattern_report'].items() if stats['exceeded_budget']]
+        quarantined = [entry['concept'] for entry in results['guard_report'] if entry['quarantined']]
+        if over_budget or quarantined:
+            self.stats_text.insert(tk.END, "\nPatterns stopped by the regex guard:\n")
+            for concept in quarantined:
+                self.stats_text.insert(tk.END, f"- {concept}: quarantined (timed out on probes)\n")
+            for concept in over_budget:
+                self.stats_text.insert(tk.END, f"- {concept}: exceeded {self.config.get('pattern_time_budget')}s budget, results partial\n")
+        
+        if results.get('clusters'):
+            self.stats_text.insert(tk.END, f"\nDiscovered concepts ({results['cluster_mode']}):\n")
+            for cluster in results['clusters']:
+                self.stats_text.insert(tk.END, f"- {cluster['label']}: {cluster['size']} conversations ({', '.join(cluster['terms'])})\n")
+        
+        self.stats_text.insert(tk.END, "\nAdditional terms found:\n")
+        for term, count in sorted(results['additional_terms'].items(), key=lambda x: x[1], reverse=True)[:15]:
+            self.stats_text.insert(tk.END, f"- {term}: {count} occurrences\n")
+        
+        self.open_obsidian_btn.config(state=tk.NORMAL)
+        self.run_tracker_btn.config(state=tk.NORMAL)
+        if results['vault_copied']:
+            self.update_status("Concept tracking and conversation copy complete")
+        else:
+            self.update_status("Concept tracking complete, but conversation copy failed")
 
+    def run_embedding_index(self):
+        """Build the embedding index for processed conversations"""
+        data_dir = os.path.join(self.config["output_dir"], "data")
+        if not self.get_corpus_db(data_dir) and not os.path.exists(find_output_file(os.path.join(data_dir, "pruned.json"))):
+            messagebox.showerror("Error", "Processed conversation data not found. Please process the AI export first.")
+            return
+        self.config["embedding_model"] = self.embedding_model_var.get().strip()
+        if not self.config["embedding_model"]:
+            messagebox.showerror("Error", "Please select a local embedding model folder.")
+            return
+        
+        self.build_embeddings_btn.config(state=tk.DISABLED)
+        embedding_thread = threading.Thread(target=self._embedding_index_thread, args=(data_dir,))
+        embedding_thread.daemon = True
+        embedding_thread.start()
+    
+    def _embedding_index_thread(self, data_dir):
+        """Background thread for building the embedding index"""
+        try:
+            self.update_status("Embedding conversations...")
+            meta = self.build_embedding_index(data_dir=data_dir)
+            self.update_status(f"Embedding index ready ({meta['count']} conversations, {meta['index']})")
+        except Exception as e:
+            self.log(f"Error building embedding index: {str(e)}")
+            messagebox.showerror("Error", f"An error occurred while embedding conversations: {str(e)}")
+            self.update_status("Embedding failed")
+        finally:
+            self.build_embeddings_btn.config(state=tk.NORMAL)
+    
+    def run_similarity_search(self):
+        """Search the embedding index for conversations similar to the query text"""
+        query = self.similar_query_var.get().strip()
+        if not query:
+            return
+        data_dir = os.path.join(self.config["output_dir"], "data")
+        if not os.path.exists(os.path.join(data_dir, EMBEDDING_DIR, "index.json")):
+            messagebox.showerror("Error", "No embedding index found. Please build the embedding index first.")
+            return
+        self.config["embedding_model"] = self.embedding_model_var.get().strip() or self.config.get("embedding_model", "")
+        
+        def search():
+            try:
+                self.update_status("Searching similar conversations...")
+                results = self.search_similar_conversations(query, data_dir=data_dir)
+                self.stats_text.delete("1.0", tk.END)
+                self.stats_text.insert(tk.END, f"Conversations similar to \"{query}\":\n")
+                for result in results:
+                    self.stats_text.insert(tk.END, f"- {result['title']} ({result['score']:.2f}) - {result['note']}\n")
+                self.update_status(f"Found {len(results)} similar conversations")
+            except Exception as e:
+                self.log(f"Error in similarity search: {str(e)}")
+                messagebox.showerror("Error", f"An error occurred while searching: {str(e)}")
+                self.update_status("Search failed")
+        
+        search_thread = threading.Thread(target=search)
+        search_thread.daemon = True
+        search_thread.start()
+    
     def copy_conversations_to_obsidian(self, data_dir, obsidian_dir):
         """Copy .txt conversation files to Obsidian vault as .md files"""
         self.log("Copying conversation logs to Obsidian vault...")
@@ -769,26 +3165,55 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         
         copied_count = 0
         skipped_count = 0
-        for root, _, files in os.walk(source_data_dir):
+        similar_links = {}
+        if self.config.get("similar_links", 5) and os.path.exists(os.path.join(data_dir, EMBEDDING_DIR, "index.json")):
+            try:
+                similar_links = self.similar_conversation_links(data_dir)
+            except Exception as e:
+                self.log(f"Skipping similar conversation links: {e}")
+        corpus_db = self.get_corpus_db(data_dir)
+        if corpus_db:
+            # The database knows every transcript, so no directory walk or filename filtering
+            with closing(open_corpus_db(corpus_db)) as db:
+                files = [row[0] for row in db.execute("SELECT file FROM conversations WHERE file IS NOT NULL ORDER BY id")]
+            walk = defaultdict(list)
+            for path in files:
+                if os.path.exists(path):
+                    walk[os.path.dirname(path)].append(os.path.basename(path))
+            walk = [(root, None, names) for root, names in walk.items()]
+        else:
+            walk = os.walk(source_data_dir)
+        for root, _, files in walk:
             # Skip the cleanup directory
             if "_empty_untitled_cleanup" in root:
                 continue
             for file in files:
-                if file.endswith(".txt") and file not in ["conversation_titles.txt", "training_data.txt"]:
+                name = strip_compression_suffix(file)
+                if name.endswith(".txt") and name not in ["conversation_titles.txt", "training_data.txt"]:
                     # Skip empty untitled files
                     src_path = os.path.join(root, file)
-                    if 'untitled' in file.lower() and os.path.getsize(src_path) == 0:
+                    if 'untitled' in file.lower() and is_empty_output(src_path):
                         continue
                     
                     relative_path = os.path.relpath(root, source_data_dir)
                     target_subdir = os.path.join(target_obsidian_convos_dir, relative_path)
                     os.makedirs(target_subdir, exist_ok=True)
                     
-                    dest_filename = file[:-4] + ".md"
+                    dest_filename = name[:-4] + ".md"
                     dest_path = os.path.join(target_subdir, dest_filename)
                     
                     try:
-                        shutil.copy2(src_path, dest_path) 
+                        if name != file:
+                            # Obsidian needs plain text, so compressed transcripts are expanded
+                            with open_input(src_path, 'rb') as src, open(dest_path, 'wb') as dst:
+                                shutil.copyfileobj(src, dst)
+                        else:
+                            shutil.copy2(src_path, dest_path) 
+                        if name[:-4] in similar_links:
+                            with open(dest_path, 'a', encoding='utf-8') as f:
+                                f.write("\n## Similar Conversations\n")
+                                for note, score in similar_links[name[:-4]]:
+                                    f.write(f"- [[{note}]] ({score:.2f})\n")
                         copied_count += 1
                     except Exception as e:
                         self.log(f"Error copying {file}: {e}")
@@ -798,15 +3223,307 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         if skipped_count > 0:
              self.log(f"Skipped {skipped_count} files due to errors.")
 
+    def conversation_embedding_text(self, conversation):
+        """Title, summary and opening user/assistant text of a conversation, cut to EMBED_TEXT_CHARS"""
+        parts = [conversation.get("title", "") or "", conversation.get("summary", "") or ""]
+        size = sum(len(part) for part in parts)
+        for message in conversation.get("messages", []):
+            if size >= EMBED_TEXT_CHARS:
+                break
+            role, block_type = self.classify_author(message.get("author", ""))
+            if block_type == "text" and role in ("user", "assistant"):
+                parts.append(message.get("text", ""))
+                size += len(parts[-1])
+        return "\n".join(part for part in parts if part)[:EMBED_TEXT_CHARS]
+    
+    def build_embedding_index(self, source=None, data_dir=None, model_path=None, workers=None):
+        """Embed every conversation and build the nearest-neighbour index under data/embeddings.
+        
+        Vectors go to a memory-mapped float16 matrix (vectors.npy); conversations whose text
+        is unchanged since the last build with the same model reuse their old vector instead
+        of being embedded again. Batches are embedded across a process pool, with at most
+        two batches per worker in flight. The search index is HNSW when hnswlib is installed,
+        otherwise IVF lists (or exact search for small corpora); see the ann_index setting.
+        """
+        import numpy as np
+        data_dir = data_dir or os.path.join(self.config["output_dir"], "data")
+        if source is None:
+            source = self.get_corpus_db(data_dir)
+        if source is None:
+            with open_input(find_output_file(os.path.join(data_dir, "pruned.json"))) as f:
+                source = json.load(f)
+        model_path = model_path or self.config.get("embedding_model", "")
+        model_name = os.path.basename(os.path.normpath(model_path))
+        index_dir = os.path.join(data_dir, EMBEDDING_DIR)
+        os.makedirs(index_dir, exist_ok=True)
+        meta_file = os.path.join(index_dir, "index.json")
+        vectors_file = os.path.join(index_dir, "vectors.npy")
+        self._embedding_index = None  # Release the mapped vectors before they are replaced
+        start = time.perf_counter()
+        
+        if isinstance(source, dict):
+            count = sum(len(conversations) for conversations in source.values())
+        else:
+            with closing(open_corpus_db(source)) as db:
+                count = db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        if not count:
+            raise ValueError("No conversations to embed")
+        
+        # Vectors from the previous build, keyed by a hash of the embedded text
+        previous = {}
+        old_vectors = None
+        if os.path.exists(meta_file) and os.path.exists(vectors_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                old_meta = json.load(f)
+            if old_meta.get("model") == model_name:
+                old_vectors = np.load(vectors_file, mmap_mode='r')
+                previous = {row[3]: position for position, row in enumerate(old_meta["rows"])}
+        
+        notes = {}
+        index_path = os.path.join(data_dir, CORPUS_INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for key, entry in json.load(f).items():
+                    if entry.get("file"):
+                        notes[key] = strip_compression_suffix(os.path.basename(entry["file"]))[:-4]
+        
+        rows = []
+        reused = []  # (new row, old row)
+        
+        def iter_batches():
+            batch = []
+            for _, conversation in self.iter_corpus(source):
+                text = self.conversation_embedding_text(conversation)
+                text_hash = hashlib.blake2b(f"{model_name}\n{text}".encode("utf-8"), digest_size=8).hexdigest()
+                key = f"{conversation.get('platform', '')}:{conversation.get('id')}"
+                rows.append([key, conversation.get("title", "") or "", notes.get(key, ""), text_hash])
+                if text_hash in previous:
+                    reused.append((len(rows) - 1, previous[text_hash]))
+                    continue
+                batch.append((len(rows) - 1, text))
+                if len(batch) == EMBED_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        
+        # Only start worker processes when there is more than one batch to embed
+        batches = iter_batches()
+        first_batches = [batch for _, batch in zip(range(2), batches)]
+        workers = workers or self.config.get("embed_workers") or min(EMBED_MAX_WORKERS, os.cpu_count() or 1)
+        if len(first_batches) < 2:
+            workers = 1
+        threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
+        embedder = load_embedder(model_path) if workers == 1 and first_batches else None
+        
+        temp_file = vectors_file + ".tmp"
+        vectors = None
+        embedded = 0
+        
+        def store(batch, block):
+            nonlocal vectors, embedded
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(temp_file, mode="w+", dtype=np.float16, shape=(count, block.shape[1]))
+            vectors[[position for position, _ in batch]] = block
+            embedded += len(batch)
+        
+        pool = multiprocessing.Pool(workers, initializer=init_embed_worker, initargs=(model_path, threads)) if workers > 1 else None
+        pending = deque()
+        try:
+            for batch in (batch for chunk in (first_batches, batches) for batch in chunk):
+                texts = [text for _, text in batch]
+                if pool is None:
+                    store(batch, embed_batch(texts, embedder))
+                    continue
+                pending.append((batch, pool.apply_async(embed_batch, (texts,))))
+                if len(pending) >= workers * 2:
+                    batch, result = pending.popleft()
+                    store(batch, result.get())
+            while pending:
+                batch, result = pending.popleft()
+                store(batch, result.get())
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(temp_file, mode="w+", dtype=np.float16, shape=(count, old_vectors.shape[1]))
+        for i in range(0, len(reused), 8192):
+            chunk = reused[i:i + 8192]
+            vectors[[new for new, _ in chunk]] = old_vectors[[old for _, old in chunk]]
+        vectors.flush()
+        del vectors, old_vectors
+        os.replace(temp_file, vectors_file)
+        vectors = np.load(vectors_file, mmap_mode='r')
+        
+        # Approximate nearest-neighbour index
+        kind = self.config.get("ann_index", "auto")
+        try:
+            import hnswlib
+        except ImportError:
+            hnswlib = None
+            if kind == "hnsw":
+                self.log("hnswlib is not installed (pip install hnswlib) - using IVF lists instead")
+                kind = "ivf"
+        if kind == "auto":
+            kind = "hnsw" if hnswlib else ("ivf" if count >= IVF_MIN_ROWS else "exact")
+        for stale in ("hnsw.bin", "ivf.npz"):
+            if os.path.exists(os.path.join(index_dir, stale)):
+                os.remove(os.path.join(index_dir, stale))
+        if kind == "hnsw":
+            graph = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            graph.init_index(max_elements=count, ef_construction=200, M=16)
+            for i in range(0, count, 8192):
+                graph.add_items(np.asarray(vectors[i:i + 8192], dtype=np.float32), np.arange(i, min(i + 8192, count)))
+            graph.save_index(os.path.join(index_dir, "hnsw.bin"))
+        elif kind == "ivf":
+            centroids, order, offsets = build_ivf_index(vectors, max(1, min(int(math.sqrt(count)), count // 39)))
+            np.savez(os.path.join(index_dir, "ivf.npz"), centroids=centroids, order=order, offsets=offsets)
+        
+        meta = {"model": model_name, "dim": int(vectors.shape[1]), "count": count, "index": kind, "rows": rows}
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        
+        self.log(f"Embedded {embedded} conversations ({len(reused)} unchanged, reused) with {model_name} using "
+                 f"{workers} worker(s); {kind} index over {count} vectors in {time.perf_counter() - start:.1f}s")
+        return {key: value for key, value in meta.items() if key != "rows"}
+    
+    def load_embedding_index(self, data_dir=None):
+        """Open the embedding index, reusing the copy already in memory while it is current"""
+        import numpy as np
+        data_dir = data_dir or os.path.join(self.config["output_dir"], "data")
+        index_dir = os.path.join(data_dir, EMBEDDING_DIR)
+        meta_file = os.path.join(index_dir, "index.json")
+        stamp = (meta_file, os.path.getmtime(meta_file))
+        cached = self._embedding_index
+        if cached and cached["stamp"] == stamp:
+            return cached
+        
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = {"stamp": stamp, "meta": meta, "vectors": np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode='r')}
+        if meta["index"] == "hnsw":
+            import hnswlib
+            graph = hnswlib.Index(space="ip", dim=meta["dim"])
+            graph.load_index(os.path.join(index_dir, "hnsw.bin"), max_elements=meta["count"])
+            index["hnsw"] = graph
+        elif meta["index"] == "ivf":
+            with np.load(os.path.join(index_dir, "ivf.npz")) as lists:
+                index.update(centroids=lists["centroids"], order=lists["order"], offsets=lists["offsets"])
+        self._embedding_index = index
+        return index
+    
+    def query_embedding_index(self, index, queries, k):
+        """Top-k (row numbers, scores) for each query vector, best first"""
+        import numpy as np
+        vectors = index["vectors"]
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(vectors))
+        if k == 0:
+            return [([], []) for _ in queries]
+        
+        if "hnsw" in index:
+            index["hnsw"].set_ef(max(50, k * 4))
+            labels, distances = index["hnsw"].knn_query(queries, k=k)
+            return [(list(row), list(1 - distance)) for row, distance in zip(labels, distances)]
+        
+        if "centroids" not in index:
+            # Exact: score every block of vectors against all queries at once, converting each
+            # block to float32 once, and keep a running top-k per query
+            best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), k), dtype=np.int64)
+            block_rows = max(1024, EXACT_SCORE_CELLS // max(1, len(queries)))
+            for start in range(0, len(vectors), block_rows):
+                scores = queries @ np.asarray(vectors[start:start + block_rows], dtype=np.float32).T
+                if scores.shape[1] > k:
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                else:
+                    top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+                merged_scores = np.concatenate([best_scores, scores], axis=1)
+                merged_rows = np.concatenate([best_rows, top + start], axis=1)
+                keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+                best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            best_rows = np.take_along_axis(best_rows, order, axis=1)
+            return [(list(rows), list(scores)) for rows, scores in zip(best_rows, best_scores)]
+        
+        results = []
+        for query in queries:
+            probe = np.argsort(index["centroids"] @ query)[::-1][:self.config.get("ivf_probe", 8)]
+            candidates = np.sort(np.concatenate([index["order"][index["offsets"][i]:index["offsets"][i + 1]] for i in probe]))
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+            top = np.argsort(-scores)[:k]
+            results.append((list(candidates[top]), list(scores[top])))
+        return results
+    
+    def search_similar_conversations(self, query, k=10, data_dir=None):
+        """Conversations closest in meaning to a free-text query"""
+        index = self.load_embedding_index(data_dir)
+        model_path = self.config.get("embedding_model", "")
+        embedder = self._query_embedder
+        if embedder is None or embedder["path"] != model_path:
+            embedder = self._query_embedder = dict(load_embedder(model_path), path=model_path)
+        if embedder["name"] != index["meta"]["model"]:
+            raise ValueError(f"The index was built with {index['meta']['model']}, not {embedder['name']}")
+        
+        rows, scores = self.query_embedding_index(index, embedder["encode"]([query]), k)[0]
+        return [{"key": index["meta"]["rows"][row][0], "title": index["meta"]["rows"][row][1],
+                 "note": index["meta"]["rows"][row][2], "score": float(score)} for row, score in zip(rows, scores)]
+    
+    def similar_conversation_links(self, data_dir=None, k=None):
+        """Map each conversation note name to its k nearest (note name, score) neighbours.
+        
+        The links only change with the index, so they are kept per index stamp and every
+        vault copy after the first reuses them.
+        """
+        index = self.load_embedding_index(data_dir)
+        k = k or self.config.get("similar_links", 5)
+        if self._similar_links and self._similar_links[:2] == (index["stamp"], k):
+            return self._similar_links[2]
+        
+        rows = index["meta"]["rows"]
+        links = {}
+        for i in range(0, len(rows), LINK_QUERY_BLOCK):
+            neighbours_block = self.query_embedding_index(index, index["vectors"][i:i + LINK_QUERY_BLOCK], k + 1)
+            for position, (neighbours, scores) in enumerate(neighbours_block, i):
+                note = rows[position][2]
+                if note:
+                    links[note] = [(rows[row][2], float(score)) for row, score in zip(neighbours, scores)
+                                   if row != position and rows[row][2]][:k]
+        self._similar_links = (index["stamp"], k, links)
+        return links
+    
     def generate_training_data(self):
         """Generate training data from processed conversations"""
         data_dir = os.path.join(self.config["output_dir"], "data")
-        pruned_file = os.path.join(data_dir, "pruned.json")
+        pruned_file = self.get_corpus_db(data_dir) or find_output_file(os.path.join(data_dir, "pruned.json"))
         
         if not os.path.exists(pruned_file):
             messagebox.showerror("Error", "Processed conversation data not found. Please process the AI export first.")
             return
         
+        self.config["training_formats"] = [name for name in TRAINING_FORMATS if self.training_format_vars[name].get()]
+        if not self.config["training_formats"]:
+            messagebox.showerror("Error", "Please select at least one sample format.")
+            return
+        self.config["chat_token_budget"] = self.chat_budget_var.get()
+        self.config["dedup_mode"] = self.dedup_mode_var.get()
+        self.config["dedup_threshold"] = self.dedup_threshold_var.get()
+        self.config["shard_output"] = self.shard_output_var.get()
+        self.config["shard_max_mb"] = self.shard_max_mb_var.get()
+        self.config["validation_fraction"] = self.validation_percent_var.get() / 100
+        self.config["shuffle_seed"] = self.shuffle_seed_var.get()
+        self.config["pretokenize_training"] = self.pretokenize_var.get()
+        self.config["tokenizer_path"] = self.tokenizer_path_var.get().strip()
+        if self.config["pretokenize_training"] and not self.config["tokenizer_path"]:
+            messagebox.showerror("Error", "Please select a tokenizer for the token ID output.")
+            return
+        self.save_config()
+        
         # Run in a separate thread
         self.generate_btn.config(state=tk.DISABLED)
         
@@ -820,32 +3537,74 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             self.update_status("Generating training data...")
             self.log("Starting training data generation...")
             
-            # Load pruned data
-            with open(pruned_file, 'r', encoding='utf-8') as f:
-                pruned_data = json.load(f)
+            # Query the corpus database, or load pruned data (compressed or not)
+            if pruned_file.endswith(CORPUS_DB_FILE):
+                pruned_data = pruned_file
+            else:
+                with open_input(pruned_file) as f:
+                    pruned_data = json.load(f)
             
             # Generate training data with options from UI
             min_length = self.min_length_var.get()
+            self.config["min_length_unit"] = self.min_length_unit_var.get()
             format_type = self.format_var.get()
             
             output_file = os.path.join(self.config["output_dir"], f"training_data.{format_type}")
-            training_pairs = self.create_training_pairs(pruned_data, output_file, min_length)
+            formats = self.config.get("training_formats", ["pairs"])
+            pretokenize = self.config.get("pretokenize_training") and "pairs" in formats
+            if self.config.get("pretokenize_training") and not pretokenize:
+                self.log("Token IDs are written for instruction/response pairs - add \"pairs\" to training_formats")
+            
+            # Pairs are spooled while they are written, so tokenizing doesn't build (and dedup) them again
+            with (tempfile.TemporaryFile('w+', encoding='utf-8') if pretokenize else nullcontext()) as spool:
+                results = self.create_training_pairs(pruned_data, output_file, min_length, formats, spool)
+                total_samples = sum(result["count"] for result in results.values())
+                
+                token_stats = None
+                if pretokenize and results["pairs"]["count"]:
+                    self.update_status("Tokenizing training data...")
+                    spool.seek(0)
+                    pairs = (json.loads(line) for line in spool)
+                    token_stats = self.write_token_dataset(pairs, os.path.join(self.config["output_dir"], "training_tokens"))
             
             # Show preview
             self.preview_text.delete("1.0", tk.END)
             
-            if training_pairs:
-                self.preview_text.insert(tk.END, f"Generated {len(training_pairs)} training pairs\n\n")
-                self.preview_text.insert(tk.END, "Sample training pairs:\n\n")
+            if total_samples:
+                for sample_format, result in results.items():
+                    self.preview_text.insert(tk.END, f"Generated {result['count']} {sample_format} samples -> {os.path.basename(result['file'])}\n")
+                    if result.get("dedup"):
+                        dedup = result["dedup"]
+                        self.preview_text.insert(tk.END, f"  dedup: {dedup['input']} in, {dedup['exact']} exact and {dedup['near']} near duplicates "
+                                                         f"({dedup['ratio']:.1%})\n")
+                    if result.get("splits"):
+                        splits = ", ".join(f"{split} {info['rows']} rows / {len(info['shards'])} shards" for split, info in result["splits"].items())
+                        self.preview_text.insert(tk.END, f"  shards: {splits}\n")
+                self.preview_text.insert(tk.END, "\n")
+                if token_stats:
+                    total = token_stats["lengths"]["total"]
+                    self.preview_text.insert(tk.END, f"Token IDs ({token_stats['tokenizer']}): {total['total']} tokens, "
+                                                     f"mean {total['mean']} / p99 {total['p99']} / max {total['max']} per pair\n\n")
                 
-                for i, pair in enumerate(training_pairs[:5]):
-                    self.preview_text.insert(tk.END, f"--- Pair {i+1} ---\n")
-                    self.preview_text.insert(tk.END, f"Instruction: {pair['instruction'][:100]}...\n")
-                    self.preview_text.insert(tk.END, f"Response: {pair['response'][:100]}...\n\n")
+                for sample_format, result in results.items():
+                    if not result["preview"]:
+                        continue
+                    self.preview_text.insert(tk.END, f"Sample {sample_format}:\n\n")
+                    for i, sample in enumerate(result["preview"]):
+                        self.preview_text.insert(tk.END, f"--- Sample {i+1} ---\n")
+                        if "messages" in sample:
+                            for message in sample["messages"][:4]:
+                                self.preview_text.insert(tk.END, f"{message['role'].title()}: {message['content'][:100]}...\n")
+                            self.preview_text.insert(tk.END, f"({len(sample['messages'])} messages)\n\n")
+                            continue
+                        self.preview_text.insert(tk.END, f"Instruction: {sample['instruction'][:100]}...\n")
+                        if "reasoning" in sample:
+                            self.preview_text.insert(tk.END, f"Reasoning: {sample['reasoning'][:100]}...\n")
+                        self.preview_text.insert(tk.END, f"Response: {sample['response'][:100]}...\n\n")
             else:
-                self.preview_text.insert(tk.END, "No training pairs were generated. Check your conversations data.")
+                self.preview_text.insert(tk.END, "No training samples were generated. Check your conversations data.")
             
-            self.log(f"Training data generation complete! Created {len(training_pairs)} pairs.")
+            self.log(f"Training data generation complete! Created {total_samples} samples.")
             self.generate_btn.config(state=tk.NORMAL)
             self.update_status("Training data generation complete")
             
@@ -893,6 +3652,8 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         self.config["assistant_name"] = self.assistant_name_var.get()
         self.config["system_name"] = self.system_name_var.get()
         self.config["current_theme"] = self.theme_var.get()
+        self.config["output_compression"] = self.compression_var.get()
+        self.config["compress_transcripts"] = self.compress_transcripts_var.get()
         
         if self.save_config():
             messagebox.showinfo("Settings Saved", "Your settings have been saved successfully")
@@ -911,7 +3672,64 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                     "light": {"bg": "#f0f0f0", "fg": "#333333", "button": "#e0e0e0", "highlight": "#4a86e8"}
                 },
                 "current_theme": "light",
-                "last_platform": "auto"
+                "last_platform": "auto",
+                "regex_engine": "auto",
+                "pattern_time_budget": 2.0,
+                "pattern_probe_timeout": 2.0,
+                "term_stopwords": [],
+                "term_max_ngram": 3,
+                "mine_message_bodies": False,
+                "auto_concepts": False,
+                "auto_concept_count": 0,
+                "auto_concept_source": "auto",
+                "incremental_tracker": True,
+                "usage_analytics": True,
+                "pipeline_workers": 0,
+                "watch_poll_seconds": 30,
+                "watch_settle_seconds": 10,
+                "watch_analyze": True,
+                "watch_concepts_file": "",
+                "serve_host": "127.0.0.1",
+                "serve_port": 8765,
+                "serve_pool_size": 4,
+                "serve_cache_mb": 64,
+                "import_attachments": False,
+                "merge_into_existing": False,
+                "debug_logging": False,
+                "deepseek_export_branches": False,
+                "pretokenize_training": False,
+                "tokenizer_path": "",
+                "tokenize_workers": 0,
+                "token_count_mode": "approx",
+                "chars_per_token": 4.0,
+                "min_length_unit": "chars",
+                "training_formats": ["pairs"],
+                "chat_token_budget": 2048,
+                "chat_window_overlap": 1,
+                "dedup_mode": "off",
+                "dedup_threshold": 0.8,
+                "dedup_action": "drop",
+                "dedup_workers": 0,
+                "shard_output": False,
+                "shard_max_mb": 256,
+                "shard_max_rows": 0,
+                "shard_count": 0,
+                "shuffle_training": True,
+                "shuffle_seed": 42,
+                "validation_fraction": 0.0,
+                "shard_workers": 0,
+                "output_compression": "none",
+                "compression_level": 0,
+                "compress_transcripts": False,
+                "export_tables": False,
+                "table_format": "parquet",
+                "corpus_db": True,
+                "build_embeddings": False,
+                "embedding_model": "",
+                "embed_workers": 0,
+                "ann_index": "auto",
+                "ivf_probe": 8,
+                "similar_links": 5
             }
             
             self.output_dir_var.set(self.config["output_dir"])
@@ -919,63 +3737,131 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             self.assistant_name_var.set(self.config["assistant_name"])
             self.system_name_var.set(self.config["system_name"])
             self.theme_var.set(self.config["current_theme"])
+            self.compression_var.set(self.config["output_compression"])
+            self.compress_transcripts_var.set(self.config["compress_transcripts"])
             
             self.save_config()
             messagebox.showinfo("Settings Reset", "Settings have been reset to defaults")
     
+    # Author role resolution shared by all platforms
+    def get_role_table(self):
+        """Return the (platform, raw role, block type) -> author label table.
+        
+        Built once from the configured names and rebuilt only when they change, so the
+        extractors do one dict lookup per block instead of string tests and f-strings.
+        Labels are interned, so every message shares the same few string objects.
+        """
+        names = (self.config["user_name"], self.config["assistant_name"], self.config["system_name"])
+        if self._role_table_names == names:
+            return self._role_table
+        
+        user, assistant, system = (sys.intern(name) for name in names)
+        thinking = sys.intern(f"{assistant} (Thinking)")
+        tool_use = sys.intern(f"{assistant} (Tool Use)")
+        
+        table = {
+            ("chatgpt", "user", "text"): user,
+            ("chatgpt", "assistant", "text"): assistant,
+            ("chatgpt", "system", "text"): system,
+            # DeepSeek has no role, the fragment type says who wrote it
+            ("deepseek", "", "REQUEST"): user,
+            ("deepseek", "", "RESPONSE"): assistant,
+            ("deepseek", "", "THINK"): thinking,
+        }
+        for sender in ("human", "user", "Human", "User"):
+            table[("claude", sender, "text")] = user
+        for sender in ("assistant", "claude", "Assistant", "Claude"):
+            table[("claude", sender, "text")] = assistant
+            table[("claude", sender, "thinking")] = thinking
+            table[("claude", sender, "tool_use")] = tool_use
+        
+        self._role_table = table
+        self._role_table_names = names
+        return table
+    
+    def resolve_author(self, platform, raw_role, block_type="text"):
+        """Author label for a block, computing and caching labels for unusual roles"""
+        table = self.get_role_table()
+        key = (platform, raw_role, block_type)
+        label = table.get(key)
+        if label is not None:
+            return label
+        
+        if platform == "deepseek":
+            # Unknown fragment type, treat as user
+            label = self.config["user_name"]
+        else:
+            role = raw_role.lower()
+            suffix = {"thinking": "Thinking", "tool_use": "Tool Use"}.get(block_type)
+            if role in ('assistant', 'claude'):
+                label = self.config["assistant_name"]
+            elif role in ('human', 'user') and not suffix:
+                label = self.config["user_name"]
+            elif platform == "chatgpt" and role == "system":
+                label = self.config["system_name"]
+            else:
+                label = raw_role
+            if suffix:
+                label = f"{label} ({suffix})"
+        
+        label = sys.intern(label)
+        table[key] = label
+        return label
+    
     # ChatGPT processing functions
-    def get_chatgpt_messages(self, conversation):
-        """Get messages from a ChatGPT conversation"""
+    def extract_chatgpt_conversation(self, conversation):
+        """Extract messages and models from a ChatGPT conversation in a single walk of the active branch.
+        
+        Assistant messages carry the model_slug they were generated with, so a chat that
+        switched models keeps that history. Returns messages, the per-conversation model
+        histogram (assistant messages per model, in order of first use) and the main model:
+        the most used one (ties go to the later model), else default_model_slug, else "ChatGPT".
+        """
         messages = []
         current_node = conversation.get("current_node")
         mapping = conversation.get("mapping", {})
+        roles = self.get_role_table()
         
         while current_node:
             node = mapping.get(current_node, {})
-            message = node.get("message") if node else None
+            message = node.get("message") if isinstance(node, dict) else None
             content = message.get("content") if message else None
             author = message.get("author", {}).get("role", "") if message else ""
+            metadata = (message.get("metadata") or {}) if message else {}
             
             if content and content.get("content_type") == "text":
                 parts = content.get("parts", [])
                 if parts and isinstance(parts[0], str) and parts[0].strip():
-                    if author != "system" or (message.get("metadata", {}) if message else {}).get("is_user_system_message"):
-                        if author == "assistant":
-                            author = self.config["assistant_name"]
-                        elif author == "system":
-                            author = self.config["system_name"]
-                        elif author == "user":
-                            author = self.config["user_name"]
-                        messages.append({"author": author, "text": parts[0]})
+                    if author != "system" or metadata.get("is_user_system_message"):
+                        label = roles.get(("chatgpt", author, "text")) or self.resolve_author("chatgpt", author)
+                        entry = {"author": label, "text": parts[0]}
+                        if author == "assistant" and metadata.get("model_slug"):
+                            entry["model"] = metadata["model_slug"]
+                        messages.append(entry)
             
-            current_node = mapping.get(current_node, {}).get("parent")
+            current_node = node.get("parent") if isinstance(node, dict) else None
+        
+        messages.reverse()
+        models = Counter(message["model"] for message in messages if "model" in message)
+        if models:
+            # Counter keeps first-use order, so the last maximum is the latest of the most used models
+            top = max(models.values())
+            model_slug = [model for model, count in models.items() if count == top][-1]
+        else:
+            model_slug = conversation.get("default_model_slug") or "ChatGPT"  # Default fallback
         
-        return messages[::-1]
+        return {"messages": messages, "model": model_slug, "models": dict(models)}
     
-    def get_chatgpt_model_slug(self, conversation):
-        """Extract model_slug from ChatGPT conversation metadata"""
-        mapping = conversation.get("mapping", {})
-        
-        # Look through all messages to find the model_slug
-        for node_id, node in mapping.items():
-            if not isinstance(node, dict):
-                continue
-            message = node.get("message")
-            if not message or not isinstance(message, dict):
-                continue
-            
-            metadata = message.get("metadata", {})
-            if metadata and isinstance(metadata, dict):
-                model_slug = metadata.get("model_slug")
-                if model_slug:
-                    return model_slug
-        
-        return "ChatGPT"  # Default fallback
+    def get_chatgpt_messages(self, conversation):
+        """Get messages from a ChatGPT conversation"""
+        return self.extract_chatgpt_conversation(conversation)["messages"]
     
     def process_chatgpt_conversations(self, conversations_data, data_dir):
         """Process ChatGPT conversations with model headers"""
         created_directories_info = []
         pruned_data = {}
+        transcript_compression = self.get_compression("transcripts")
+        transcript_level = self.config.get("compression_level", 0)
         
         for conversation in conversations_data:
             updated = conversation.get('update_time')
@@ -990,17 +3876,21 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             
             title = conversation.get('title', 'Untitled')
             
-            # NEW: Extract model_slug from conversation
-            model_slug = self.get_chatgpt_model_slug(conversation)
+            # One walk gives the messages, each assistant message's model and the model histogram
+            extracted = self.extract_chatgpt_conversation(conversation)
+            model_slug = extracted["model"]
+            messages = extracted["messages"]
+            tokens, token_counter = self.count_message_tokens(messages)
             
             sanitized_title = re.sub(r"[^a-zA-Z0-9_]", "_", title)[:120]
-            file_name = os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt")
-            
-            messages = self.get_chatgpt_messages(conversation)
+            file_name = compressed_path(os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt"), transcript_compression)
             
-            with open(file_name, 'w', encoding="utf-8") as file:
+            with open_output(file_name, 'w', transcript_compression, transcript_level) as file:
                 # NEW: Write model header at the top
                 file.write(f"# Model: {model_slug}\n")
+                if len(extracted["models"]) > 1:
+                    file.write(f"# Models: {', '.join(f'{model} ({count})' for model, count in extracted['models'].items())}\n")
+                file.write(f"# Tokens: {tokens}\n")
                 file.write(f"# Title: {title}\n")
                 file.write(f"# Date: {updated_date.strftime('%Y-%m-%d %H:%M:%S')}\n")
                 file.write(f"\n{'='*60}\n\n")
@@ -1012,175 +3902,166 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             if directory_name not in pruned_data:
                 pruned_data[directory_name] = []
             
+            conversation_id = self.get_conversation_id("chatgpt", conversation)
             pruned_data[directory_name].append({
+                "id": conversation_id,
+                "platform": "chatgpt",
                 "title": title,
                 "create_time": datetime.fromtimestamp(conversation.get('create_time')).strftime('%Y-%m-%d %H:%M:%S'),
                 "update_time": updated_date.strftime('%Y-%m-%d %H:%M:%S'),
                 "model": model_slug,
+                "models": extracted["models"],
+                "tokens": tokens,
+                "token_counter": token_counter,
                 "messages": messages
             })
             
             created_directories_info.append({
+                "id": conversation_id,
                 "directory": directory_path,
                 "file": file_name
             })
         
-        pruned_json_path = os.path.join(data_dir, "pruned.json")
-        with open(pruned_json_path, 'w', encoding='utf-8') as json_file:
-            json.dump(pruned_data, json_file, ensure_ascii=False, indent=4)
-        
         return created_directories_info, pruned_data
     
-    def get_claude_messages(self, conversation):
-        """Get messages from a Claude conversation, including thinking blocks"""
+    def debug_log(self, message, key=None):
+        """Log a debug line - every time with debug_logging on, otherwise only the first few per key"""
+        if self.config.get("debug_logging"):
+            self.log(f"Debug - {message}")
+            return
+        counts = self._debug_log_counts
+        key = key or message
+        counts[key] += 1
+        if counts[key] <= DEBUG_LOG_SAMPLE:
+            self.log(f"Debug - {message}")
+    
+    def extract_claude_conversation(self, conversation):
+        """Extract everything needed from a Claude conversation in a single pass.
+        
+        Returns a dict with messages (including thinking and tool-use blocks), the
+        derived title, summary, model, per-block-type counts and any structural
+        warnings. Has no side effects, so callers decide what (if anything) to log.
+        """
         messages = []
+        block_stats = Counter()
+        warnings = []
+        roles = self.get_role_table()
         
-        # Debug: Check what fields are available
-        if 'chat_messages' in conversation:
-            chat_messages = conversation['chat_messages']
-            
-            # If it's a list, process each message
-            if isinstance(chat_messages, list):
-                for i, msg in enumerate(chat_messages):
-                    # Debug: log the structure of the first message
-                    if i == 0 and isinstance(msg, dict):
-                        self.log(f"Debug - First message keys: {list(msg.keys())}")
-                    
-                    # Handle different possible message structures
-                    sender = None
-                    
-                    # Check if message has direct text/content
-                    if isinstance(msg, dict):
-                        sender = msg.get('sender', '') or msg.get('role', '') or msg.get('author', '')
-                        
-                        # NEW: Check for 'content' array with typed content blocks (thinking, text, etc.)
-                        content_array = msg.get('content', [])
-                        if isinstance(content_array, list) and content_array:
-                            # Process each content block in the array
-                            for content_block in content_array:
-                                if isinstance(content_block, dict):
-                                    block_type = content_block.get('type', 'text')
-                                    
-                                    # Handle thinking blocks
-                                    if block_type == 'thinking':
-                                        thinking_text = content_block.get('thinking', '')
-                                        if thinking_text and thinking_text.strip():
-                                            # Map sender types to our naming convention with (Thinking) suffix
-                                            if sender.lower() in ['assistant', 'claude']:
-                                                author = f"{self.config['assistant_name']} (Thinking)"
-                                            else:
-                                                author = f"{sender} (Thinking)"
-                                            messages.append({"author": author, "text": str(thinking_text)})
-                                    
-                                    # Handle regular text blocks
-                                    elif block_type == 'text':
-                                        text_content = content_block.get('text', '')
-                                        if text_content and text_content.strip():
-                                            # Map sender types to our naming convention
-                                            if sender.lower() in ['human', 'user']:
-                                                author = self.config["user_name"]
-                                            elif sender.lower() in ['assistant', 'claude']:
-                                                author = self.config["assistant_name"]
-                                            else:
-                                                author = sender
-                                            messages.append({"author": author, "text": str(text_content)})
-                                    
-                                    # Handle tool_use blocks (log but typically skip content)
-                                    elif block_type == 'tool_use':
-                                        tool_name = content_block.get('name', 'unknown_tool')
-                                        tool_input = content_block.get('input', {})
-                                        # Optionally log tool usage
-                                        if sender.lower() in ['assistant', 'claude']:
-                                            author = f"{self.config['assistant_name']} (Tool Use)"
-                                        else:
-                                            author = f"{sender} (Tool Use)"
-                                        tool_text = f"[Using tool: {tool_name}]"
-                                        messages.append({"author": author, "text": tool_text})
-                                    
-                                    # Handle tool_result blocks
-                                    elif block_type == 'tool_result':
-                                        # Tool results are typically system-level, skip or minimal log
-                                        pass
-                            
-                            # If we processed content array, continue to next message
-                            if content_array:
-                                continue
+        def author_for(sender, block_type="text"):
+            return roles.get(("claude", sender, block_type)) or self.resolve_author("claude", sender, block_type)
+        
+        chat_messages = conversation.get('chat_messages')
+        if chat_messages is None:
+            warnings.append(f"No 'chat_messages' found. Available keys: {list(conversation.keys())}")
+            # Try alternative field names
+            for field in ('messages', 'message_history', 'history', 'chat'):
+                if field in conversation:
+                    warnings.append(f"Found '{field}' field, attempting to parse...")
+                    chat_messages = conversation[field]
+                    break
+        
+        if isinstance(chat_messages, list):
+            for msg in chat_messages:
+                if isinstance(msg, str):
+                    # Sometimes messages might be strings directly
+                    messages.append({"author": 'unknown', "text": msg})
+                    block_stats['text'] += 1
+                    continue
+                if not isinstance(msg, dict):
+                    continue
+                
+                sender = msg.get('sender', '') or msg.get('role', '') or msg.get('author', '')
+                content_array = msg.get('content', [])
+                
+                # Typed content blocks (thinking, text, tool_use, tool_result)
+                if isinstance(content_array, list) and content_array:
+                    for content_block in content_array:
+                        if not isinstance(content_block, dict):
+                            continue
+                        block_type = content_block.get('type', 'text')
+                        block_stats[block_type] += 1
                         
-                        # Fallback: Try direct text field
-                        content = msg.get('text', '') or msg.get('message', '')
+                        if block_type == 'thinking':
+                            thinking_text = content_block.get('thinking', '')
+                            if thinking_text and thinking_text.strip():
+                                messages.append({"author": author_for(sender, "thinking"), "text": str(thinking_text)})
                         
-                        # Handle string content field
-                        if not content and isinstance(content_array, str):
-                            content = content_array
+                        elif block_type == 'text':
+                            text_content = content_block.get('text', '')
+                            if text_content and text_content.strip():
+                                messages.append({"author": author_for(sender), "text": str(text_content)})
                         
-                        if content and sender:
-                            # Map sender types to our naming convention
-                            if sender.lower() in ['human', 'user']:
-                                author = self.config["user_name"]
-                            elif sender.lower() in ['assistant', 'claude']:
-                                author = self.config["assistant_name"]
-                            else:
-                                author = sender
-                            
-                            messages.append({"author": author, "text": str(content)})
-                    
-                    elif isinstance(msg, str):
-                        # Sometimes messages might be strings directly
-                        content = msg
-                        sender = 'unknown'
-                        messages.append({"author": sender, "text": str(content)})
-                    
-            elif isinstance(chat_messages, dict):
-                # Sometimes chat_messages might be a dict with indexed keys
-                self.log(f"Debug - chat_messages is a dict with keys: {list(chat_messages.keys())}")
-                # Try to process as indexed dict
-                for key in sorted(chat_messages.keys()):
-                    msg = chat_messages[key]
-                    if isinstance(msg, dict):
-                        content = msg.get('text', '') or msg.get('content', '') or msg.get('message', '')
-                        sender = msg.get('sender', '') or msg.get('role', '') or msg.get('author', '')
+                        elif block_type == 'tool_use':
+                            tool_name = content_block.get('name', 'unknown_tool')
+                            messages.append({"author": author_for(sender, "tool_use"), "text": f"[Using tool: {tool_name}]"})
                         
-                        if content and sender:
-                            if sender.lower() in ['human', 'user']:
-                                author = self.config["user_name"]
-                            elif sender.lower() in ['assistant', 'claude']:
-                                author = self.config["assistant_name"]
-                            else:
-                                author = sender
-                            
-                            messages.append({"author": author, "text": str(content)})
-        else:
-            # Log available fields if chat_messages not found
-            self.log(f"Debug - No 'chat_messages' found. Available keys: {list(conversation.keys())}")
-            
-            # Try alternative field names
-            for field in ['messages', 'message_history', 'history', 'chat']:
-                if field in conversation:
-                    self.log(f"Debug - Found '{field}' field, attempting to parse...")
-                    # Recursively call with modified conversation object
-                    mod_conv = {'chat_messages': conversation[field]}
-                    return self.get_claude_messages(mod_conv)
+                        # tool_result blocks are system-level and skipped
+                    continue
+                
+                # Fallback: direct text field, or string content field
+                content = msg.get('text', '') or msg.get('message', '')
+                if not content and isinstance(content_array, str):
+                    content = content_array
+                
+                if content and sender:
+                    messages.append({"author": author_for(sender), "text": str(content)})
+                    block_stats['text'] += 1
+        
+        elif isinstance(chat_messages, dict):
+            # Sometimes chat_messages might be a dict with indexed keys
+            warnings.append(f"chat_messages is a dict with keys: {list(chat_messages.keys())}")
+            for key in sorted(chat_messages.keys()):
+                msg = chat_messages[key]
+                if isinstance(msg, dict):
+                    content = msg.get('text', '') or msg.get('content', '') or msg.get('message', '')
+                    sender = msg.get('sender', '') or msg.get('role', '') or msg.get('author', '')
+                    if content and sender:
+                        messages.append({"author": author_for(sender), "text": str(content)})
+                        block_stats['text'] += 1
+        
+        if not messages and chat_messages is not None:
+            warnings.append(f"chat_messages found but no messages extracted. Type: {type(chat_messages)}")
+        
+        # Title from the 'name' field, else the first message
+        title = conversation.get('name', '')
+        if not title:
+            if messages:
+                first_text = messages[0]['text']
+                title = first_text[:50] + "..." if len(first_text) > 50 else first_text
+            else:
+                title = 'Untitled'
         
-        if not messages and 'chat_messages' in conversation:
-            self.log(f"Debug - chat_messages found but no messages extracted. Type: {type(conversation['chat_messages'])}")
+        # Claude doesn't typically include a model slug, but use one if present
+        model_slug = conversation.get('model', 'Claude') if 'model' in conversation else "Claude"
         
-        return messages
+        return {
+            "messages": messages,
+            "title": title,
+            "summary": conversation.get('summary', ''),
+            "model": model_slug,
+            "block_stats": dict(block_stats),
+            "warnings": warnings,
+        }
+    
+    def get_claude_messages(self, conversation):
+        """Get messages from a Claude conversation, including thinking blocks"""
+        return self.extract_claude_conversation(conversation)["messages"]
     
     def process_claude_conversations(self, conversations_data, data_dir):
         """Process Claude conversations with thinking blocks and summaries"""
         created_directories_info = []
         pruned_data = {}
+        transcript_compression = self.get_compression("transcripts")
+        transcript_level = self.config.get("compression_level", 0)
+        block_totals = Counter()
         
         # Handle if conversations_data is wrapped or is directly a list
         if isinstance(conversations_data, dict) and 'conversations' in conversations_data:
             conversations_data = conversations_data['conversations']
         
-        self.log(f"Debug - Processing {len(conversations_data)} Claude conversations")
-        
         for idx, conversation in enumerate(conversations_data):
-            # Debug first conversation structure
             if idx == 0:
-                self.log(f"Debug - First conversation keys: {list(conversation.keys())}")
+                self.debug_log(f"First conversation keys: {list(conversation.keys())}", key="claude-keys")
             
             # Claude uses ISO timestamp format
             created_at = conversation.get('created_at', '')
@@ -1201,36 +4082,26 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             
             os.makedirs(directory_path, exist_ok=True)
             
-            # Get title from conversation - Claude uses 'name' field
-            title = conversation.get('name', '')
-            if not title or title == '':
-                # Try to extract title from first message
-                messages = self.get_claude_messages(conversation)
-                if messages and len(messages) > 0:
-                    title = messages[0]['text'][:50] + "..." if len(messages[0]['text']) > 50 else messages[0]['text']
-                else:
-                    title = 'Untitled'
-            
-            # NEW: Extract conversation summary if available
-            conversation_summary = conversation.get('summary', '')
-            
-            # NEW: Try to detect model from messages or metadata
-            model_slug = "Claude"  # Default
-            # Claude doesn't typically include model slug in the same way as ChatGPT
-            # But we can check for model indicators in the data
-            if 'model' in conversation:
-                model_slug = conversation.get('model', 'Claude')
+            # One pass gives messages, title, summary, model and block counts
+            extracted = self.extract_claude_conversation(conversation)
+            messages = extracted["messages"]
+            title = extracted["title"]
+            conversation_summary = extracted["summary"]
+            model_slug = extracted["model"]
+            block_totals.update(extracted["block_stats"])
+            for warning in extracted["warnings"]:
+                self.debug_log(warning, key=warning[:24])
             
             sanitized_title = re.sub(r"[^a-zA-Z0-9_]", "_", title)[:120]
-            file_name = os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt")
-            
-            messages = self.get_claude_messages(conversation)
+            file_name = compressed_path(os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt"), transcript_compression)
             
             # Only write file if there are messages
             if messages:
-                with open(file_name, 'w', encoding="utf-8") as file:
+                tokens, token_counter = self.count_message_tokens(messages)
+                with open_output(file_name, 'w', transcript_compression, transcript_level) as file:
                     # NEW: Write model header at the top
                     file.write(f"# Model: {model_slug}\n")
+                    file.write(f"# Tokens: {tokens}\n")
                     file.write(f"# Title: {title}\n")
                     file.write(f"# Date: {updated_date.strftime('%Y-%m-%d %H:%M:%S')}\n")
                     
@@ -1248,29 +4119,32 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 if directory_name not in pruned_data:
                     pruned_data[directory_name] = []
                 
+                conversation_id = self.get_conversation_id("claude", conversation)
                 pruned_data[directory_name].append({
+                    "id": conversation_id,
+                    "platform": "claude",
                     "title": title,
                     "create_time": created_at,
                     "update_time": updated_at,
                     "model": model_slug,
                     "summary": conversation_summary,
+                    "block_stats": extracted["block_stats"],
+                    "tokens": tokens,
+                    "token_counter": token_counter,
                     "messages": messages
                 })
                 
                 created_directories_info.append({
+                    "id": conversation_id,
                     "directory": directory_path,
                     "file": file_name
                 })
             else:
-                if idx < 5:  # Log first few conversations without messages
-                    self.log(f"Debug - Conversation '{title}' has no messages")
-        
-        self.log(f"Debug - Created {len(created_directories_info)} files with messages")
-        
-        pruned_json_path = os.path.join(data_dir, "pruned.json")
-        with open(pruned_json_path, 'w', encoding='utf-8') as json_file:
-            json.dump(pruned_data, json_file, ensure_ascii=False, indent=4)
+                self.debug_log(f"Conversation '{title}' has no messages", key="claude-empty")
         
+        self.debug_log(f"Created {len(created_directories_info)} files with messages")
+        if block_totals:
+            self.log("Claude content blocks: " + ", ".join(f"{count} {block_type}" for block_type, count in block_totals.most_common()))
         
         # Cleanup empty untitled files
         self.log("\nChecking for empty untitled files...")
@@ -1279,71 +4153,131 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             self.log(f"Cleanup completed: {cleanup_results['count']} empty untitled files moved")
         
         return created_directories_info, pruned_data
+
+    def parse_deepseek_time(self, value):
+        """Parse a DeepSeek ISO timestamp to a Unix time (0 if missing or malformed)"""
+        if not value:
+            return 0.0
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except (ValueError, AttributeError):
+            return 0.0
     
-    def get_deepseek_messages(self, conversation):
-        """Get messages from a Deepseek conversation"""
-        messages = []
-        
-        # Deepseek uses same structure as ChatGPT but with 'fragments' instead of 'content'
-        # mapping contains nodes with: id, parent, children, message
-        # message contains: model, inserted_at, fragments (list of {type, content})
-        # Fragment types: REQUEST (user), RESPONSE (assistant), THINK (reasoning)
-        
+    def extract_deepseek_branches(self, conversation, include_alternates=False):
+        """Walk a DeepSeek conversation tree along its active branch.
+        
+        Deepseek uses same structure as ChatGPT but with 'fragments' instead of 'content'.
+        mapping contains nodes with: id, parent, children, message; message contains
+        model, inserted_at and fragments (list of {type, content}) where the types are
+        REQUEST (user), RESPONSE (assistant) and THINK (reasoning).
+        
+        The parent->children tree is built once. The active branch ends at current_node
+        when the export has one, otherwise each step takes the most recently inserted
+        child (a regeneration replaces its older siblings). With include_alternates, the
+        abandoned siblings along the way are returned as their own transcripts.
+        """
+        result = {"messages": [], "branches": []}
         mapping = conversation.get('mapping', {})
         if not mapping:
-            return messages
+            return result
+        roles = self.get_role_table()
         
-        # Collect all message nodes with their data
-        message_nodes = []
+        # Build the tree once - fall back on parent links when children lists are missing
+        children = defaultdict(list)
+        roots = []
         for key, node in mapping.items():
-            if not isinstance(node, dict) or 'message' not in node:
-                continue
-            msg_data = node.get('message')
-            if not msg_data or not isinstance(msg_data, dict):
+            if not isinstance(node, dict):
                 continue
-            
-            fragments = msg_data.get('fragments', [])
-            inserted_at = msg_data.get('inserted_at', '')
-            
-            if fragments:
-                message_nodes.append({
-                    'id': node.get('id', key),
-                    'parent': node.get('parent'),
-                    'inserted_at': inserted_at,
-                    'fragments': fragments
-                })
-        
-        # Sort by inserted_at timestamp
-        message_nodes.sort(key=lambda x: x.get('inserted_at', ''))
+            parent = node.get('parent')
+            if parent is not None and parent in mapping:
+                children[parent].append(key)
+            else:
+                roots.append(key)
+        for key, node in mapping.items():
+            if isinstance(node, dict) and node.get('children'):
+                children[key] = [child for child in node['children'] if child in mapping]
+        
+        def inserted(key):
+            message = mapping[key].get('message')
+            return self.parse_deepseek_time(message.get('inserted_at')) if isinstance(message, dict) else 0.0
+        
+        def latest_child(key):
+            # Newest insert wins; later position breaks ties
+            options = children.get(key, [])
+            if not options:
+                return None
+            return max(enumerate(options), key=lambda item: (inserted(item[1]), item[0]))[1]
+        
+        def descend(key, seen):
+            # Follow latest children down to a leaf
+            path = []
+            while key is not None and key not in seen:
+                seen.add(key)
+                path.append(key)
+                key = latest_child(key)
+            return path
+        
+        current = conversation.get('current_node')
+        if current in mapping:
+            # Walk up from the leaf the user last saw, like ChatGPT
+            path = []
+            seen = set()
+            while current is not None and current in mapping and current not in seen:
+                seen.add(current)
+                path.append(current)
+                current = mapping[current].get('parent')
+            path.reverse()
+        else:
+            path = descend(roots[0], set()) if roots else []
         
-        # Process each message node
-        for node in message_nodes:
-            fragments = node.get('fragments', [])
-            
-            for fragment in fragments:
-                if not isinstance(fragment, dict):
-                    continue
-                
-                frag_type = fragment.get('type', '')
-                content = fragment.get('content', '')
-                
-                if not content or not content.strip():
-                    continue
-                
-                # Determine author based on fragment type
-                if frag_type == 'REQUEST':
-                    author = self.config["user_name"]
-                elif frag_type == 'THINK':
-                    author = f"{self.config['assistant_name']} (Thinking)"
-                elif frag_type == 'RESPONSE':
-                    author = self.config["assistant_name"]
-                else:
-                    # Unknown type, skip or treat as user
-                    author = self.config["user_name"]
-                
-                messages.append({"author": author, "text": content})
+        def render(keys):
+            messages = []
+            for key in keys:
+                message = mapping[key].get('message')
+                if not isinstance(message, dict):
+                    continue
+                for fragment in message.get('fragments') or []:
+                    if not isinstance(fragment, dict):
+                        continue
+                    
+                    frag_type = fragment.get('type', '')
+                    content = fragment.get('content', '')
+                    
+                    if not content or not content.strip():
+                        continue
+                    
+                    # Determine author based on fragment type
+                    author = roles.get(("deepseek", "", frag_type)) or self.resolve_author("deepseek", "", frag_type)
+                    messages.append({"author": author, "text": content})
+            return messages
         
-        return messages
+        # Message count after each node on the path, to locate branch points
+        prefix_counts = []
+        for key in path:
+            result["messages"].extend(render([key]))
+            prefix_counts.append(len(result["messages"]))
+        
+        if include_alternates:
+            # One visited set for every branch: each node is walked at most once, even if a
+            # malformed mapping links branches together
+            seen = set(path)
+            for depth, key in enumerate(path):
+                for child in children.get(key, []):
+                    if child in seen:
+                        continue
+                    branch_keys = descend(child, seen)
+                    branch_messages = render(branch_keys)
+                    if branch_messages:
+                        result["branches"].append({
+                            "branch_point": prefix_counts[depth],
+                            "messages": branch_messages,
+                        })
+        
+        return result
+    
+    def get_deepseek_messages(self, conversation):
+        """Get messages along the active branch of a Deepseek conversation"""
+        return self.extract_deepseek_branches(conversation)["messages"]
     
     def get_deepseek_model(self, conversation):
         """Extract model from Deepseek conversation"""
@@ -1366,6 +4300,10 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         """Process Deepseek conversations with model headers"""
         created_directories_info = []
         pruned_data = {}
+        transcript_compression = self.get_compression("transcripts")
+        transcript_level = self.config.get("compression_level", 0)
+        
+        include_alternates = self.config.get("deepseek_export_branches", False)
         
         # Deepseek uses same top-level format as ChatGPT (list of conversations)
         if isinstance(conversations_data, dict):
@@ -1374,11 +4312,10 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             else:
                 conversations_data = [conversations_data]
         
-        self.log(f"Debug - Processing {len(conversations_data)} Deepseek conversations")
         
         for idx, conversation in enumerate(conversations_data):
             if idx == 0:
-                self.log(f"Debug - First conversation keys: {list(conversation.keys())}")
+                self.debug_log(f"First conversation keys: {list(conversation.keys())}", key="deepseek-keys")
             
             # Get timestamps - Deepseek uses 'updated_at' and 'inserted_at' at conversation level
             updated_at = conversation.get('updated_at', '') or conversation.get('inserted_at', '')
@@ -1394,8 +4331,7 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                     ts = ts[:ts.rfind('+')]
                 updated_date = datetime.fromisoformat(ts[:19])
             except Exception as e:
-                if idx < 3:
-                    self.log(f"Debug - Failed to parse timestamp '{updated_at}': {e}")
+                self.debug_log(f"Failed to parse timestamp '{updated_at}': {e}", key="deepseek-timestamp")
                 continue
             
             directory_name = updated_date.strftime('%B_%Y')
@@ -1404,7 +4340,8 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             
             # Get title from conversation or first user message
             title = conversation.get('title', '')
-            messages = self.get_deepseek_messages(conversation)
+            extracted = self.extract_deepseek_branches(conversation, include_alternates)
+            messages = extracted["messages"]
             
             if not title:
                 for msg in messages:
@@ -1421,12 +4358,14 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             model_slug = self.get_deepseek_model(conversation)
             
             sanitized_title = re.sub(r"[^a-zA-Z0-9_]", "_", title)[:120]
-            file_name = os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt")
+            file_name = compressed_path(os.path.join(directory_path, f"{sanitized_title}_{updated_date.strftime('%d_%m_%Y_%H_%M_%S')}.txt"), transcript_compression)
             
             if messages:
-                with open(file_name, 'w', encoding="utf-8") as file:
+                tokens, token_counter = self.count_message_tokens(messages)
+                with open_output(file_name, 'w', transcript_compression, transcript_level) as file:
                     # NEW: Write model header at the top
                     file.write(f"# Model: {model_slug}\n")
+                    file.write(f"# Tokens: {tokens}\n")
                     file.write(f"# Title: {title}\n")
                     file.write(f"# Date: {updated_date.strftime('%Y-%m-%d %H:%M:%S')}\n")
                     file.write(f"\n{'='*60}\n\n")
@@ -1434,78 +4373,1243 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                     for message in messages:
                         file.write(f"{message['author']}\n")
                         file.write(f"{message['text']}\n\n")
+                    
+                    for number, branch in enumerate(extracted["branches"], 1):
+                        file.write(f"\n{'-'*60}\n")
+                        file.write(f"## Alternate Branch {number} (after message {branch['branch_point']})\n\n")
+                        for message in branch["messages"]:
+                            file.write(f"{message['author']}\n")
+                            file.write(f"{message['text']}\n\n")
                 
                 if directory_name not in pruned_data:
                     pruned_data[directory_name] = []
                 
+                conversation_id = self.get_conversation_id("deepseek", conversation)
                 pruned_data[directory_name].append({
+                    "id": conversation_id,
+                    "platform": "deepseek",
                     "title": title,
                     "create_time": conversation.get('inserted_at', updated_at),
                     "update_time": updated_at,
                     "model": model_slug,
+                    "tokens": tokens,
+                    "token_counter": token_counter,
                     "messages": messages
                 })
+                if extracted["branches"]:
+                    pruned_data[directory_name][-1]["branches"] = extracted["branches"]
                 
                 created_directories_info.append({
+                    "id": conversation_id,
                     "directory": directory_path,
                     "file": file_name
                 })
             else:
-                if idx < 5:
-                    self.log(f"Debug - Conversation '{title}' has no messages")
+                self.debug_log(f"Conversation '{title}' has no messages", key="deepseek-empty")
+        
+        self.debug_log(f"Created {len(created_directories_info)} files with messages")
+        
+        return created_directories_info, pruned_data
+    
+    def get_conversation_id(self, platform, conversation):
+        """Stable conversation id for a platform's export format"""
+        if platform == "chatgpt":
+            conversation_id = conversation.get('conversation_id') or conversation.get('id')
+        elif platform == "claude":
+            conversation_id = conversation.get('uuid')
+        else:
+            conversation_id = conversation.get('id')
+        
+        if not conversation_id:
+            # Very old exports without ids - fall back on title + creation time
+            created = conversation.get('create_time') or conversation.get('created_at') or conversation.get('inserted_at')
+            title = conversation.get('title') or conversation.get('name') or ''
+            conversation_id = hashlib.sha1(f"{title}|{created}".encode('utf-8')).hexdigest()[:16]
+        return str(conversation_id)
+    
+    def get_conversation_timestamp(self, platform, conversation):
+        """Last-update time of a raw conversation as a Unix timestamp (0 if unknown)"""
+        if platform == "chatgpt":
+            return float(conversation.get('update_time') or conversation.get('create_time') or 0)
         
-        self.log(f"Debug - Created {len(created_directories_info)} files with messages")
+        value = conversation.get('updated_at') or conversation.get('created_at') or conversation.get('inserted_at') or ''
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except (ValueError, AttributeError):
+            return 0.0
+    
+    def hash_conversation(self, conversation):
+        """Content hash of a raw conversation, independent of key order"""
+        encoded = json.dumps(conversation, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def get_compression(self, kind="data"):
+        """Compression for an output kind ("data" or "transcripts"), or None.
         
-        pruned_json_path = os.path.join(data_dir, "pruned.json")
-        with open(pruned_json_path, 'w', encoding='utf-8') as json_file:
+        Falls back to gzip when zstd is selected but zstandard is not installed.
+        """
+        compression = self.config.get("output_compression", "none")
+        if compression not in COMPRESSION_SUFFIXES:
+            return None
+        if kind == "transcripts" and not self.config.get("compress_transcripts", False):
+            return None
+        if compression == "zstd" and zstandard is None:
+            if not self._zstd_fallback_logged:
+                self.log("zstandard is not installed, writing gzip instead of zstd (pip install zstandard)")
+                self._zstd_fallback_logged = True
+            return "gzip"
+        return compression
+    
+    def open_output_file(self, path, kind="data", newline=None):
+        """Open an output file with the configured compression. Returns (actual path, file)."""
+        compression = self.get_compression(kind)
+        path = compressed_path(path, compression)
+        return path, open_output(path, 'w', compression, self.config.get("compression_level", 0), threads=-1, newline=newline)
+    
+    def write_pruned_data(self, pruned_data, data_dir):
+        """Write the unified pruned store (pruned.json, compressed as configured)"""
+        pruned_json_path, json_file = self.open_output_file(os.path.join(data_dir, "pruned.json"))
+        with json_file:
             json.dump(pruned_data, json_file, ensure_ascii=False, indent=4)
+        remove_other_variants(pruned_json_path)
+        return pruned_json_path
+    
+    def merge_exports(self, file_paths, data_dir, platform="auto", merge_existing=False):
+        """Ingest one or more exports (snapshots and/or platforms) into one deduplicated corpus.
+        
+        Pass 1 streams every export and keeps, per platform:id key, only the newest
+        version in a hash index; identical content is skipped. Pass 2 streams the exports
+        again and processes just the winning conversations, so merging N exports is linear.
+        With merge_existing, the corpus index from earlier runs takes part in the
+        comparison and superseded conversations are replaced in pruned.json.
+        """
+        index_path = os.path.join(data_dir, CORPUS_INDEX_FILE)
+        corpus_index = {}
+        pruned_data = {}
+        if merge_existing and os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                corpus_index = json.load(f)
+            pruned_path = find_output_file(os.path.join(data_dir, "pruned.json"))
+            if os.path.exists(pruned_path):
+                with open_input(pruned_path) as f:
+                    pruned_data = json.load(f)
+        
+        stats = {"exports": 0, "seen": 0, "duplicates": 0, "superseded": 0, "unchanged": 0, "platforms": []}
+        self._debug_log_counts = Counter()
+        exports = []
+        winners = {}
+        
+        # Pass 1: build the winner index
+        for export_idx, file_path in enumerate(file_paths):
+            export_platform = platform
+            if export_platform == "auto":
+                export_platform = self.sniff_export(file_path)["platform"]
+            if export_platform == "unknown":
+                self.log(f"Skipping {os.path.basename(file_path)}: unable to detect platform")
+                continue
+            
+            exports.append((export_idx, file_path, export_platform))
+            if export_platform not in stats["platforms"]:
+                stats["platforms"].append(export_platform)
+            self.log(f"Indexing {os.path.basename(file_path)} ({export_platform.upper()})...")
+            
+            for position, conversation in enumerate(self.iter_export_conversations(file_path)):
+                if not isinstance(conversation, dict):
+                    continue
+                stats["seen"] += 1
+                key = f"{export_platform}:{self.get_conversation_id(export_platform, conversation)}"
+                timestamp = self.get_conversation_timestamp(export_platform, conversation)
+                content_hash = self.hash_conversation(conversation)
+                
+                current = winners.get(key)
+                if current is None:
+                    existing = corpus_index.get(key)
+                    if existing and (existing["content_hash"] == content_hash or existing["update_ts"] > timestamp):
+                        stats["unchanged"] += 1
+                        continue
+                    winners[key] = (timestamp, content_hash, export_idx, position)
+                elif current[1] == content_hash:
+                    stats["duplicates"] += 1
+                elif timestamp >= current[0]:
+                    # Later snapshot wins ties
+                    winners[key] = (timestamp, content_hash, export_idx, position)
+                    stats["superseded"] += 1
+                else:
+                    stats["superseded"] += 1
+        
+        # Drop older versions of conversations that are about to be replaced
+        replaced = {key for key in winners if key in corpus_index}
+        if replaced:
+            for month in list(pruned_data):
+                pruned_data[month] = [conv for conv in pruned_data[month]
+                                      if f"{conv.get('platform')}:{conv.get('id')}" not in replaced]
+                if not pruned_data[month]:
+                    del pruned_data[month]
+            for key in replaced:
+                old_file = corpus_index.pop(key).get("file")
+                if old_file and os.path.exists(old_file):
+                    os.remove(old_file)
+            self.log(f"Replacing {len(replaced)} conversations with newer versions")
+        
+        # Pass 2: process only the winning conversations of each export
+        selected = defaultdict(set)
+        for key, (timestamp, content_hash, export_idx, position) in winners.items():
+            selected[export_idx].add(position)
+        
+        created_dirs = []
+        new_keys = set()
+        processors = {
+            "chatgpt": self.process_chatgpt_conversations,
+            "claude": self.process_claude_conversations,
+            "deepseek": self.process_deepseek_conversations,
+        }
+        for export_idx, file_path, export_platform in exports:
+            positions = selected.get(export_idx)
+            if not positions:
+                continue
+            stats["exports"] += 1
+            stream = prefetch((conversation for position, conversation in enumerate(self.iter_export_conversations(file_path))
+                               if position in positions), EXPORT_PREFETCH)
+            export_dirs, export_pruned = processors[export_platform](stream, data_dir)
+            
+            for month, conversations in export_pruned.items():
+                pruned_data.setdefault(month, []).extend(conversations)
+                new_keys.update(f"{conversation.get('platform', export_platform)}:{conversation.get('id')}" for conversation in conversations)
+            for info in export_dirs:
+                key = f"{export_platform}:{info['id']}"
+                timestamp, content_hash = winners[key][:2]
+                corpus_index[key] = {
+                    "update_ts": timestamp,
+                    "content_hash": content_hash,
+                    "month": os.path.basename(info["directory"]),
+                    "file": info["file"],
+                }
+            created_dirs.extend(export_dirs)
         
-        return created_directories_info, pruned_data
+        # Conversations kept from earlier runs may have been counted with other settings
+        recounted = self.annotate_token_counts(pruned_data)
+        if recounted:
+            self.log(f"Counted tokens again for {recounted} conversations ({self.get_token_counter()['name']})")
+        
+        self.write_pruned_data(pruned_data, data_dir)
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(corpus_index, f, ensure_ascii=False)
+        
+        if self.config.get("corpus_db", True):
+            self.update_corpus_db(data_dir, pruned_data, corpus_index, replaced, new_keys, rebuild=not merge_existing)
+        
+        return created_dirs, pruned_data, stats
     
-    def create_training_pairs(self, pruned_data, output_file=None, min_length=10):
-        """Convert conversation data to instruction-response pairs for fine-tuning."""
-        if output_file is None:
-            output_file = os.path.join(self.config["output_dir"], "data", "training_data.jsonl")
+    def update_corpus_db(self, data_dir, pruned_data, corpus_index, removed_keys=(), new_keys=None, rebuild=True):
+        """Bring data/corpus.db in line with the merged corpus in one transaction.
         
-        training_pairs = []
+        With rebuild (or when the database does not exist yet) every conversation is
+        reinserted; otherwise removed_keys are deleted and only new_keys are (re)inserted.
+        Messages, block counts and the model table are written with bulk executemany calls.
+        """
+        db_path = os.path.join(data_dir, CORPUS_DB_FILE)
+        rebuild = rebuild or new_keys is None or not os.path.exists(db_path)
+        inserted = 0
+        start = time.perf_counter()
+        
+        with closing(open_corpus_db(db_path)) as db:
+            with db:
+                if rebuild:
+                    for table in ("concept_matches", "blocks", "messages", "conversations", "models"):
+                        db.execute(f"DELETE FROM {table}")
+                else:
+                    db.executemany("DELETE FROM conversations WHERE key = ?", [(key,) for key in set(removed_keys) | set(new_keys)])
+                
+                model_ids = dict(db.execute("SELECT name, id FROM models"))
+                for month, conversation in self.iter_corpus(pruned_data):
+                    key = f"{conversation.get('platform', '')}:{conversation.get('id')}"
+                    if not rebuild and key not in new_keys:
+                        continue
+                    
+                    model = str(conversation.get("model") or "")
+                    for name in [model, *(conversation.get("models") or ())]:
+                        if name not in model_ids:
+                            model_ids[name] = db.execute("INSERT INTO models (name) VALUES (?)", (name,)).lastrowid
+                    created = self.parse_pruned_time(conversation.get("create_time"))
+                    updated = self.parse_pruned_time(conversation.get("update_time"))
+                    index_entry = corpus_index.get(key, {})
+                    row_id = db.execute(
+                        "INSERT OR REPLACE INTO conversations (key, platform, conversation_id, title, summary, model_id, month, "
+                        "created, updated, file, content_hash, tokens, token_counter) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, conversation.get("platform", ""), str(conversation.get("id", "")), conversation.get("title", ""),
+                         conversation.get("summary", "") or "", model_ids[model], month,
+                         created.isoformat() if created else None, updated.isoformat() if updated else None,
+                         index_entry.get("file"), index_entry.get("content_hash"),
+                         conversation.get("tokens"), conversation.get("token_counter"))
+                    ).lastrowid
+                    
+                    db.executemany(
+                        "INSERT INTO messages (conversation, position, author, role, block_type, text, model_id, tokens) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(row_id, position, message.get("author", ""), *self.classify_author(message.get("author", "")), message.get("text", ""),
+                          model_ids.get(message.get("model")), message.get("tokens"))
+                         for position, message in enumerate(conversation.get("messages", []))]
+                    )
+                    if conversation.get("block_stats"):
+                        db.executemany("INSERT INTO blocks (conversation, block_type, count) VALUES (?, ?, ?)",
+                                       [(row_id, block_type, count) for block_type, count in conversation["block_stats"].items()])
+                    inserted += 1
+        
+        self.log(f"Corpus database: {'rebuilt with' if rebuild else 'updated'} {inserted} conversations in "
+                 f"{time.perf_counter() - start:.1f}s ({db_path})")
+        return db_path
+    
+    def get_corpus_db(self, data_dir=None):
+        """Path of the corpus database if it exists and is enabled, else None"""
+        data_dir = data_dir or os.path.join(self.config["output_dir"], "data")
+        db_path = os.path.join(data_dir, CORPUS_DB_FILE)
+        return db_path if self.config.get("corpus_db", True) and os.path.exists(db_path) else None
+    
+    def iter_corpus(self, source):
+        """Yield (month, conversation) from a pruned_data dict or from a corpus database path.
+        
+        Database conversations are rebuilt in the pruned.json shape (id, platform, title,
+        create/update time, model, summary, token counts, messages with their own model
+        where known, and the models histogram) from one indexed, ordered join, so stages
+        can consume either source without loading the whole corpus. An open connection
+        (such as one lent by the query service pool) is read as is and left open.
+        """
+        if isinstance(source, dict):
+            for month, conversations in source.items():
+                for conversation in conversations:
+                    yield month, conversation
+            return
         
-        for month, conversations in pruned_data.items():
-            for conversation in conversations:
-                messages = conversation["messages"]
+        db = source if isinstance(source, sqlite3.Connection) else open_corpus_db(source)
+        try:
+            rows = db.execute(
+                "SELECT c.id, c.month, c.platform, c.conversation_id, c.title, c.summary, c.created, c.updated, m.name, "
+                "c.tokens, c.token_counter, msg.author, msg.text, mm.name, msg.tokens "
+                "FROM conversations c LEFT JOIN models m ON m.id = c.model_id "
+                "LEFT JOIN messages msg ON msg.conversation = c.id LEFT JOIN models mm ON mm.id = msg.model_id "
+                "ORDER BY c.id, msg.position"
+            )
+            current = None
+            for (row_id, month, platform, conversation_id, title, summary, created, updated, model, tokens, token_counter,
+                 author, text, message_model, message_tokens) in rows:
+                if current is None or current[0] != row_id:
+                    if current is not None:
+                        yield current[1], current[2]
+                    current = (row_id, month, {
+                        "id": conversation_id, "platform": platform, "title": title, "create_time": created,
+                        "update_time": updated, "model": model, "summary": summary, "messages": []
+                    })
+                    if token_counter is not None:
+                        current[2]["tokens"] = tokens
+                        current[2]["token_counter"] = token_counter
+                if author is not None:
+                    message = {"author": author, "text": text}
+                    if message_tokens is not None:
+                        message["tokens"] = message_tokens
+                    if message_model is not None:
+                        message["model"] = message_model
+                        models = current[2].setdefault("models", {})
+                        models[message_model] = models.get(message_model, 0) + 1
+                    current[2]["messages"].append(message)
+            if current is not None:
+                yield current[1], current[2]
+        finally:
+            if db is not source:
+                db.close()
+    
+    def classify_author(self, author):
+        """(role, block type) for an author label: user/assistant/system/other and text/thinking/tool_use"""
+        assistant = self.config["assistant_name"]
+        kinds = {
+            self.config["user_name"]: ("user", "text"),
+            assistant: ("assistant", "text"),
+            self.config["system_name"]: ("system", "text"),
+            f"{assistant} (Thinking)": ("assistant", "thinking"),
+            f"{assistant} (Tool Use)": ("assistant", "tool_use"),
+        }
+        if author in kinds:
+            return kinds[author]
+        if author.endswith(" (Tool Use)"):
+            return "other", "tool_use"
+        if author.endswith(" (Thinking)"):
+            return "other", "thinking"
+        return "other", "text"
+    
+    def parse_pruned_time(self, value):
+        """A pruned.json timestamp (Unix time or ISO / 'YYYY-MM-DD HH:MM:SS' string) as an aware UTC datetime, or None"""
+        if value in (None, ""):
+            return None
+        try:
+            if isinstance(value, (int, float)):
+                return datetime.fromtimestamp(value, tz=timezone.utc)
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (ValueError, OverflowError, OSError):
+            return None
+        # Naive strings were written in local time
+        return parsed.astimezone(timezone.utc)
+    
+    def export_message_tables(self, pruned_data, output_dir, table_format=None):
+        """Write a normalised message table and a conversation table as Parquet or Arrow.
+        
+        messages: one row per message with conversation id, platform, model, month,
+        conversation timestamps, position, author label, role, block type, text and
+        char/token counts. conversations: one row per conversation with its counts.
+        Low-cardinality columns are dictionary-encoded and messages are written in row
+        groups of TABLE_ROW_GROUP_ROWS, so DuckDB/pandas can scan and filter them without
+        parsing JSON. Arrow output uses the IPC stream format (.arrows). Needs pyarrow.
+        Returns {"messages": path, "conversations": path, "rows": message count}.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Exporting message tables needs the pyarrow package (pip install pyarrow)")
+        table_format = table_format or self.config.get("table_format", "parquet")
+        extension = ".parquet" if table_format == "parquet" else ".arrows"
+        
+        def column_type(name, value_type):
+            return pa.dictionary(pa.int32(), value_type) if name in TABLE_DICTIONARY_COLUMNS else value_type
+        
+        timestamp = pa.timestamp("us", tz="UTC")
+        message_fields = [
+            ("conversation_id", pa.string()), ("platform", pa.string()), ("model", pa.string()), ("month", pa.string()),
+            ("conversation_created", timestamp), ("conversation_updated", timestamp), ("position", pa.int32()),
+            ("author", pa.string()), ("role", pa.string()), ("block_type", pa.string()), ("text", pa.large_string()),
+            ("chars", pa.int32()), ("tokens", pa.int32()),
+        ]
+        conversation_fields = [
+            ("conversation_id", pa.string()), ("platform", pa.string()), ("model", pa.string()), ("month", pa.string()),
+            ("title", pa.string()), ("summary", pa.large_string()), ("created", timestamp), ("updated", timestamp),
+            ("messages", pa.int32()), ("user_messages", pa.int32()), ("assistant_messages", pa.int32()),
+            ("thinking_blocks", pa.int32()), ("tool_use_blocks", pa.int32()), ("chars", pa.int64()), ("tokens", pa.int64()),
+        ]
+        message_schema = pa.schema([pa.field(name, column_type(name, value_type)) for name, value_type in message_fields])
+        conversation_schema = pa.schema([pa.field(name, column_type(name, value_type)) for name, value_type in conversation_fields])
+        
+        def to_table(columns, fields, schema):
+            arrays = []
+            for name, value_type in fields:
+                array_ = pa.array(columns[name], type=value_type)
+                arrays.append(array_.dictionary_encode() if name in TABLE_DICTIONARY_COLUMNS else array_)
+            return pa.Table.from_arrays(arrays, schema=schema)
+        
+        def open_writer(path, schema):
+            if table_format == "parquet":
+                import pyarrow.parquet as pq
+                return pq.ParquetWriter(path, schema, compression="zstd", use_dictionary=list(TABLE_DICTIONARY_COLUMNS))
+            return pa.ipc.new_stream(path, schema)
+        
+        messages_path = os.path.join(output_dir, f"messages{extension}")
+        conversations_path = os.path.join(output_dir, f"conversations{extension}")
+        message_columns = {name: [] for name, _ in message_fields}
+        conversation_columns = {name: [] for name, _ in conversation_fields}
+        rows = 0
+        
+        writer = open_writer(messages_path, message_schema)
+        try:
+            for month, conversation in self.iter_corpus(pruned_data):
+                conversation_id = str(conversation.get("id") or f"{conversation.get('title', '')}:{conversation.get('create_time', '')}")
+                platform = conversation.get("platform", "")
+                model = str(conversation.get("model") or "")
+                created = self.parse_pruned_time(conversation.get("create_time"))
+                updated = self.parse_pruned_time(conversation.get("update_time"))
+                counts = Counter()
                 
-                # Process message pairs (User -> Assistant)
-                for i in range(len(messages) - 1):
-                    # Find User->Assistant pairs
-                    if messages[i]["author"] == self.config["user_name"] and messages[i+1]["author"] == self.config["assistant_name"]:
-                        # Skip very short instructions
-                        if len(messages[i]["text"]) < min_length:
-                            continue
-                            
-                        # Create a training pair
-                        pair = {
-                            "instruction": messages[i]["text"],
-                            "response": messages[i+1]["text"]
-                        }
-                        training_pairs.append(pair)
+                for position, message in enumerate(conversation.get("messages", [])):
+                    text = message.get("text", "")
+                    role, block_type = self.classify_author(message.get("author", ""))
+                    tokens = message.get("tokens")
+                    if tokens is None:
+                        tokens = approx_token_count(text)
+                    for name, value in (("conversation_id", conversation_id), ("platform", platform), ("model", model),
+                                        ("month", month), ("conversation_created", created), ("conversation_updated", updated),
+                                        ("position", position), ("author", message.get("author", "")), ("role", role),
+                                        ("block_type", block_type), ("text", text), ("chars", len(text)), ("tokens", tokens)):
+                        message_columns[name].append(value)
+                    counts["messages"] += 1
+                    counts[f"{role}_messages"] += block_type == "text"
+                    counts[f"{block_type}_blocks"] += 1
+                    counts["chars"] += len(text)
+                    counts["tokens"] += tokens
+                    rows += 1
+                    
+                    if len(message_columns["text"]) >= TABLE_ROW_GROUP_ROWS:
+                        writer.write_table(to_table(message_columns, message_fields, message_schema))
+                        message_columns = {name: [] for name, _ in message_fields}
+                
+                for name, value in (("conversation_id", conversation_id), ("platform", platform), ("model", model),
+                                    ("month", month), ("title", conversation.get("title", "")),
+                                    ("summary", conversation.get("summary", "") or ""), ("created", created), ("updated", updated)):
+                    conversation_columns[name].append(value)
+                for name in ("messages", "user_messages", "assistant_messages", "thinking_blocks", "tool_use_blocks", "chars", "tokens"):
+                    conversation_columns[name].append(counts[name])
+            
+            if message_columns["text"] or not rows:
+                writer.write_table(to_table(message_columns, message_fields, message_schema))
+        finally:
+            writer.close()
+        
+        writer = open_writer(conversations_path, conversation_schema)
+        try:
+            writer.write_table(to_table(conversation_columns, conversation_fields, conversation_schema))
+        finally:
+            writer.close()
+        
+        self.log(f"Exported {rows} messages from {len(conversation_columns['conversation_id'])} conversations to {messages_path}")
+        return {"messages": messages_path, "conversations": conversations_path, "rows": rows}
+    
+    def compute_usage_analytics(self, source):
+        """Aggregate usage per (platform, model, month) in one streaming pass over the corpus.
+        
+        Counts conversations, messages by role, characters, tokens (as stored), thinking
+        blocks (and their characters), tool use blocks and assistant response characters,
+        from which the average response length follows. Conversations count towards their
+        main model; messages that name their own model count towards that one. source is
+        a pruned_data dict or a corpus database path. Returns {(platform, model, 'YYYY-MM'): Counter}.
+        """
+        usage = defaultdict(Counter)
+        kinds = {}
+        
+        for month, conversation in self.iter_corpus(source):
+            try:
+                month_key = datetime.strptime(month, '%B_%Y').strftime('%Y-%m')
+            except ValueError:
+                month_key = month
+            platform = conversation.get("platform", "")
+            model = str(conversation.get("model") or "unknown")
+            usage[(platform, model, month_key)]["conversations"] += 1
+            
+            for message in conversation.get("messages", []):
+                counts = usage[(platform, message.get("model") or model, month_key)]
+                text = message.get("text", "")
+                author = message.get("author", "")
+                if author not in kinds:
+                    kinds[author] = self.classify_author(author)
+                role, block_type = kinds[author]
+                tokens = message.get("tokens")
+                if tokens is None:
+                    tokens = approx_token_count(text)
+                counts["messages"] += 1
+                counts["chars"] += len(text)
+                counts["tokens"] += tokens
+                if block_type == "thinking":
+                    counts["thinking_blocks"] += 1
+                    counts["thinking_chars"] += len(text)
+                elif block_type == "tool_use":
+                    counts["tool_use_blocks"] += 1
+                elif role == "user":
+                    counts["user_messages"] += 1
+                elif role == "assistant":
+                    counts["assistant_messages"] += 1
+                    counts["response_chars"] += len(text)
+        
+        return usage
+    
+    def write_usage_analytics(self, usage, data_dir, obsidian_dir):
+        """Write compute_usage_analytics results as a CSV and an Obsidian dashboard note.
+        
+        The CSV has one row per platform, model and month. The note has tables per model,
+        per platform and per month. Returns the paths and the number of models and months.
+        """
+        import csv
+        
+        def average(counts):
+            return round(counts["response_chars"] / counts["assistant_messages"]) if counts["assistant_messages"] else 0
+        
+        csv_path, f = self.open_output_file(os.path.join(data_dir, USAGE_CSV_FILE), newline='')
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(["platform", "model", "month", *USAGE_COLUMNS, "avg_response_chars"])
+            for (platform, model, month), counts in sorted(usage.items()):
+                writer.writerow([platform, model, month, *(counts[column] for column in USAGE_COLUMNS), average(counts)])
+        remove_other_variants(csv_path)
+        
+        by_model = defaultdict(Counter)
+        by_platform = defaultdict(Counter)
+        by_month = defaultdict(Counter)
+        model_months = defaultdict(set)
+        month_models = defaultdict(Counter)
+        for (platform, model, month), counts in usage.items():
+            by_model[(model, platform)].update(counts)
+            by_platform[platform].update(counts)
+            by_month[month].update(counts)
+            model_months[(model, platform)].add(month)
+            month_models[month][model] += counts["conversations"]
+        
+        os.makedirs(obsidian_dir, exist_ok=True)
+        note_path = os.path.join(obsidian_dir, USAGE_NOTE_FILE)
+        with open(note_path, 'w', encoding='utf-8') as f:
+            f.write("---\ntags:\n  - dashboard\n  - models\n---\n\n")
+            f.write("# Model Usage Dashboard\n\n")
+            f.write(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')} from {sum(c['conversations'] for c in by_platform.values())} conversations. "
+                    f"Token counts come from the configured token counter; the full breakdown per month is in `{os.path.basename(csv_path)}`.\n\n")
+            
+            f.write("## By Model\n\n")
+            f.write("| Model | Platform | Conversations | Messages | Tokens | Thinking blocks | Avg response (chars) | Active |\n")
+            f.write("|---|---|---|---|---|---|---|---|\n")
+            for (model, platform), counts in sorted(by_model.items(), key=lambda x: x[1]["conversations"], reverse=True):
+                months = sorted(model_months[(model, platform)])
+                f.write(f"| {model} | {platform} | {counts['conversations']} | {counts['messages']} | {counts['tokens']} | "
+                        f"{counts['thinking_blocks']} | {average(counts)} | {months[0]} to {months[-1]} |\n")
+            
+            f.write("\n## By Platform\n\n")
+            f.write("| Platform | Conversations | Messages | Characters | Tokens | Thinking (chars) | Avg response (chars) |\n")
+            f.write("|---|---|---|---|---|---|---|\n")
+            for platform, counts in sorted(by_platform.items(), key=lambda x: x[1]["conversations"], reverse=True):
+                f.write(f"| {platform} | {counts['conversations']} | {counts['messages']} | {counts['chars']} | {counts['tokens']} | "
+                        f"{counts['thinking_chars']} | {average(counts)} |\n")
+            
+            f.write("\n## By Month\n\n")
+            f.write("| Month | Conversations | Messages | Tokens | Thinking blocks | Top models |\n")
+            f.write("|---|---|---|---|---|---|\n")
+            for month in sorted(by_month):
+                counts = by_month[month]
+                top = ", ".join(f"{model} ({count})" for model, count in month_models[month].most_common(3))
+                f.write(f"| {month} | {counts['conversations']} | {counts['messages']} | {counts['tokens']} | "
+                        f"{counts['thinking_blocks']} | {top} |\n")
+        
+        return {"csv": csv_path, "note": note_path, "models": len({model for model, _ in by_model}), "months": len(by_month)}
+    
+    def split_conversation_turns(self, messages):
+        """Group a conversation's messages into user turns in one pass.
+        
+        Each turn holds the user text plus every thinking and assistant text block up to
+        the next user message, so Thinking / Tool Use blocks between a question and its
+        answer no longer break the pair. Turns also carry user_tokens and tokens (user plus
+        assistant text) from the stored message counts. Returns (system_texts, turns).
+        """
+        user, assistant, system = self.config["user_name"], self.config["assistant_name"], self.config["system_name"]
+        kinds = {user: "user", assistant: "assistant", system: "system", f"{assistant} (Thinking)": "thinking"}
+        system_texts = []
+        turns = []
+        current = None
+        
+        for message in messages:
+            kind = kinds.get(message["author"])
+            text = message["text"]
+            tokens = message.get("tokens")
+            if tokens is None:
+                tokens = approx_token_count(text)
+            if kind == "user":
+                if current is not None and not current["assistant"] and not current["thinking"]:
+                    # Consecutive user messages form one instruction
+                    current["user"] = f"{current['user']}\n\n{text}"
+                    current["user_tokens"] += tokens
+                    current["tokens"] += tokens
+                    continue
+                current = {"user": text, "thinking": [], "assistant": [], "user_tokens": tokens, "tokens": tokens}
+                turns.append(current)
+            elif current is None:
+                if kind == "system":
+                    system_texts.append(text)
+            elif kind in ("assistant", "thinking"):
+                current[kind].append(text)
+                if kind == "assistant":
+                    current["tokens"] += tokens
+            # Tool use, tool output and other authors carry no training text
+        
+        return system_texts, [turn for turn in turns if turn["assistant"]]
+    
+    def iter_training_samples(self, pruned_data, sample_format="pairs", min_length=10, token_budget=None):
+        """Yield (conversation id, sample) for one sample format, one conversation at a time.
+        
+        pairs:     {"instruction", "response"} per user turn
+        reasoning: {"instruction", "reasoning", "response"} for turns with thinking blocks
+        chat:      {"messages": [...]} sliding windows of whole turns within token_budget,
+                   overlapping by chat_window_overlap turns
         
-        # Write to the appropriate format
-        if output_file.endswith('.jsonl'):
-            # Write to JSONL format (one JSON object per line)
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for pair in training_pairs:
-                    f.write(json.dumps(pair, ensure_ascii=False) + '\n')
+        min_length applies to the instruction in characters or, with min_length_unit
+        "tokens", in its stored token count.
+        """
+        if token_budget is None:
+            token_budget = self.config.get("chat_token_budget", 2048)
+        overlap = max(0, self.config.get("chat_window_overlap", 1))
+        min_length_tokens = self.config.get("min_length_unit", "chars") == "tokens"
+        
+        for month, conversation in self.iter_corpus(pruned_data):
+            conversation_id = conversation.get("id") or f"{conversation.get('title', '')}:{conversation.get('create_time', '')}"
+            system_texts, turns = self.split_conversation_turns(conversation["messages"])
+            
+            if sample_format == "chat":
+                header = [{"role": "system", "content": text} for text in system_texts]
+                header_cost = sum(self.count_tokens(system_texts))
+                costs = [turn["tokens"] for turn in turns]
+                start = 0
+                while start < len(turns):
+                    end = start
+                    used = header_cost
+                    while end < len(turns) and (end == start or used + costs[end] <= token_budget):
+                        used += costs[end]
+                        end += 1
+                    chat = list(header)
+                    for turn in turns[start:end]:
+                        chat.append({"role": "user", "content": turn["user"]})
+                        chat.append({"role": "assistant", "content": "\n\n".join(turn["assistant"])})
+                    yield conversation_id, {"messages": chat}
+                    if end >= len(turns):
+                        break
+                    start = max(end - overlap, start + 1)
+                continue
+            
+            for turn in turns:
+                # Skip very short instructions
+                if (turn["user_tokens"] if min_length_tokens else len(turn["user"])) < min_length:
+                    continue
+                if sample_format == "reasoning":
+                    if turn["thinking"]:
+                        yield conversation_id, {
+                            "instruction": turn["user"],
+                            "reasoning": "\n\n".join(turn["thinking"]),
+                            "response": "\n\n".join(turn["assistant"])
+                        }
+                else:
+                    yield conversation_id, {
+                        "instruction": turn["user"],
+                        "response": "\n\n".join(turn["assistant"])
+                    }
+    
+    def build_training_samples(self, pruned_data, sample_format="pairs", min_length=10, dedup_stats=None):
+        """Sample stream for one format, deduplicated according to dedup_mode"""
+        samples = self.iter_training_samples(pruned_data, sample_format, min_length)
+        if self.config.get("dedup_mode", "off") == "off":
+            return samples
+        return self.dedup_training_samples(samples, {} if dedup_stats is None else dedup_stats)
+    
+    def sample_text(self, sample):
+        """All the text of a training sample, for duplicate detection"""
+        if "messages" in sample:
+            return "\n".join(message["content"] for message in sample["messages"])
+        return "\n".join(str(value) for value in sample.values())
+    
+    def dedup_training_samples(self, samples, stats, mode=None, threshold=None, workers=None):
+        """Drop (or cluster) exact and near-duplicate samples from a (conversation id, sample) stream.
+        
+        Batches are hashed across a process pool into an exact key plus a MinHash signature.
+        LSH banding over the signatures finds candidate near duplicates, which are confirmed
+        against the threshold. Only hashes and signatures of kept samples are indexed, and the
+        index spills to disk past DEDUP_MEMORY_ROWS; at most two batches per worker are in
+        flight. The first occurrence is kept. Fills stats in place (input, kept, exact, near,
+        ratio, seconds, and clusters of positions - only collected with dedup_action cluster).
+        """
+        mode = mode or self.config.get("dedup_mode", "off")
+        threshold = threshold or self.config.get("dedup_threshold", 0.8)
+        keep_duplicates = self.config.get("dedup_action", "drop") == "cluster"
+        workers = workers or self.config.get("dedup_workers") or os.cpu_count() or 1
+        bands, rows = lsh_bands(MINHASH_PERMUTATIONS, threshold)
+        band_size = rows * array("I").itemsize
+        
+        index = DedupIndex(bands)
+        clusters = defaultdict(list) if keep_duplicates else None
+        stats.update(input=0, kept=0, exact=0, near=0, ratio=0.0, seconds=0.0, clusters=clusters)
+        start = time.perf_counter()
+        
+        def iter_batches():
+            batch = []
+            for item in samples:
+                batch.append(item)
+                if len(batch) == DEDUP_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        
+        def process(batch, hashed):
+            all_band_keys = [[hash(signature[i:i + band_size]) for i in range(0, bands * band_size, band_size)]
+                             for _, signature in hashed] if mode == "near" else None
+            index.prefetch([exact for exact, _ in hashed], all_band_keys or ())
+            for n, (item, (exact, signature)) in enumerate(zip(batch, hashed)):
+                position = stats["input"]
+                stats["input"] += 1
+                duplicate_of = index.find_exact(exact)
+                if duplicate_of is not None:
+                    stats["exact"] += 1
+                elif mode == "near":
+                    duplicate_of = index.find_near(all_band_keys[n], signature, threshold)
+                    if duplicate_of is not None:
+                        stats["near"] += 1
+                
+                if duplicate_of is None:
+                    if mode == "near":
+                        index.add(exact, position, signature, all_band_keys[n])
+                    else:
+                        index.add(exact, position)
+                    stats["kept"] += 1
+                    yield item
+                elif keep_duplicates:
+                    clusters[duplicate_of].append(position)
+                    yield item
+        
+        # Only start worker processes when there is more than one batch
+        batches = iter_batches()
+        first_batches = [batch for _, batch in zip(range(2), batches)]
+        pool = multiprocessing.Pool(workers) if workers > 1 and len(first_batches) > 1 else None
+        pending = deque()
+        try:
+            for batch in (batch for chunk in (first_batches, batches) for batch in chunk):
+                texts = [self.sample_text(sample) for _, sample in batch]
+                if pool is None:
+                    yield from process(batch, minhash_batch(texts))
+                    continue
+                pending.append((batch, pool.apply_async(minhash_batch, (texts,))))
+                if len(pending) >= workers * 2:
+                    batch, result = pending.popleft()
+                    yield from process(batch, result.get())
+            while pending:
+                batch, result = pending.popleft()
+                yield from process(batch, result.get())
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            index.close()
+        
+        stats["ratio"] = (stats["exact"] + stats["near"]) / stats["input"] if stats["input"] else 0.0
+        stats["seconds"] = round(time.perf_counter() - start, 2)
+    
+    def write_training_samples(self, samples, output_file):
+        """Stream (conversation id, sample) items to JSONL or CSV, keeping only a short preview"""
+        count = 0
+        preview = []
         
-        elif output_file.endswith('.csv'):
-            # Write to CSV format
+        if output_file.endswith('.csv'):
             import csv
-            with open(output_file, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(["instruction", "response"])
-                for pair in training_pairs:
-                    writer.writerow([pair["instruction"], pair["response"]])
+            output_file, f = self.open_output_file(output_file, newline='')
+            with f:
+                writer = None
+                for _, sample in samples:
+                    if writer is None:
+                        writer = csv.writer(f)
+                        columns = list(sample.keys())
+                        writer.writerow(columns)
+                    writer.writerow([sample[column] for column in columns])
+                    if count < TRAINING_PREVIEW_SIZE:
+                        preview.append(sample)
+                    count += 1
+        else:
+            # One JSON object per line
+            output_file, f = self.open_output_file(output_file)
+            with f:
+                for _, sample in samples:
+                    f.write(json.dumps(sample, ensure_ascii=False) + '\n')
+                    if count < TRAINING_PREVIEW_SIZE:
+                        preview.append(sample)
+                    count += 1
+        
+        remove_other_variants(output_file)
+        return {"count": count, "file": output_file, "preview": preview}
+    
+    def write_training_shards(self, samples, output_file, seed=None, workers=None):
+        """Stream (conversation id, sample) items into shuffled, size-bounded shards with a manifest.
+        
+        Samples are split into train/validation by a seeded hash of their conversation id, so
+        every sample of a conversation lands in the same split. They are then scattered at
+        random into spill buckets on disk. Worker processes shuffle groups of buckets and write
+        them as <name>-<split>-00000-of-0000N shards; <name>_manifest.json lists every shard
+        with its row count, size and sha256. The same seed always gives the same shards.
+        """
+        seed = self.config.get("shuffle_seed", 42) if seed is None else seed
+        shuffle = self.config.get("shuffle_training", True)
+        validation_fraction = self.config.get("validation_fraction", 0.0)
+        max_rows = self.config.get("shard_max_rows", 0)
+        max_bytes = int(self.config.get("shard_max_mb", 256) * 1024 * 1024)
+        shard_count = max(1, self.config.get("shard_count", 0))
+        workers = workers or self.config.get("shard_workers") or os.cpu_count() or 1
+        compression = self.get_compression()
+        level = self.config.get("compression_level", 0)
+        
+        output_dir = os.path.dirname(output_file) or "."
+        base, extension = os.path.splitext(output_file)
+        name = os.path.basename(base)
+        spill_dir = tempfile.mkdtemp(prefix=f".{name}-shards-", dir=output_dir)
+        rng = random.Random(seed)
+        
+        buckets = {}  # (split, bucket) -> open spill file
+        totals = defaultdict(lambda: [0, 0])  # split -> [rows, characters]
+        split_cache = (None, None)
+        columns = None
+        preview = []
+        
+        try:
+            for conversation_id, sample in samples:
+                split = "train"
+                if validation_fraction:
+                    if split_cache[0] != conversation_id:
+                        digest = hashlib.blake2b(f"{seed}:{conversation_id}".encode("utf-8"), digest_size=8).digest()
+                        held_out = int.from_bytes(digest, "little") / 2 ** 64 < validation_fraction
+                        split_cache = (conversation_id, "validation" if held_out else "train")
+                    split = split_cache[1]
+                
+                if shuffle:
+                    bucket = rng.randrange(SHARD_SCATTER_BUCKETS)
+                else:
+                    bucket = totals[split][0] // SHARD_SPILL_ROWS
+                    if bucket and (split, bucket - 1) in buckets:
+                        buckets.pop((split, bucket - 1)).close()
+                spill = buckets.get((split, bucket))
+                if spill is None:
+                    spill = buckets[(split, bucket)] = open(os.path.join(spill_dir, f"{split}-{bucket:06d}.jsonl"), 'a', encoding='utf-8')
+                
+                line = json.dumps(sample, ensure_ascii=False) + '\n'
+                spill.write(line)
+                totals[split][0] += 1
+                totals[split][1] += len(line.encode("utf-8"))
+                if columns is None and extension == ".csv":
+                    columns = list(sample.keys())
+                if len(preview) < TRAINING_PREVIEW_SIZE:
+                    preview.append(sample)
+            for spill in buckets.values():
+                spill.close()
+            
+            # Group spill buckets so each group becomes roughly one shard
+            tasks = []
+            for split, (rows, size) in sorted(totals.items()):
+                bucket_files = sorted(os.path.join(spill_dir, file_name) for file_name in os.listdir(spill_dir)
+                                      if file_name.startswith(f"{split}-"))
+                wanted = max(shard_count, math.ceil(rows / max_rows) if max_rows else 1,
+                             math.ceil(size / max_bytes) if max_bytes else 1)
+                if shuffle:
+                    groups = [bucket_files[i::wanted] for i in range(min(wanted, len(bucket_files)))]
+                else:
+                    per_group = math.ceil(len(bucket_files) / wanted)
+                    groups = [bucket_files[i:i + per_group] for i in range(0, len(bucket_files), per_group)]
+                min_parts = math.ceil(wanted / len(groups))
+                for index, group in enumerate(groups):
+                    tasks.append((split, (group, os.path.join(spill_dir, f"{split}-part{index:05d}"), f"{seed}:{split}:{index}",
+                                          shuffle, max_rows, max_bytes, min_parts, columns, compression, level)))
+            
+            workers = min(workers, len(tasks))
+            if workers > 1:
+                with multiprocessing.Pool(workers) as pool:
+                    written = pool.map(write_shard_group, [task for _, task in tasks])
+            else:
+                written = [write_shard_group(task) for _, task in tasks]
+            
+            # Replace any shards from a previous run, then give the new ones their final names
+            shard_pattern = re.compile(rf"^{re.escape(name)}-(train|validation)-\d{{5}}-of-\d{{5}}{re.escape(extension)}(\.gz|\.zst)?$")
+            for file_name in os.listdir(output_dir):
+                if shard_pattern.match(file_name):
+                    os.remove(os.path.join(output_dir, file_name))
+            
+            splits = {}
+            for split in sorted(totals):
+                parts = [shard for (task_split, _), shards in zip(tasks, written) if task_split == split for shard in shards]
+                entries = []
+                for index, shard in enumerate(parts):
+                    file_name = compressed_path(f"{name}-{split}-{index:05d}-of-{len(parts):05d}{extension}", compression)
+                    os.replace(shard["path"], os.path.join(output_dir, file_name))
+                    entries.append({"file": file_name, "rows": shard["rows"], "bytes": shard["bytes"], "sha256": shard["sha256"]})
+                splits[split] = {"rows": totals[split][0], "shards": entries}
+        finally:
+            for spill in buckets.values():
+                spill.close()
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        
+        manifest_file = f"{base}_manifest.json"
+        manifest = {
+            "format": extension.lstrip("."),
+            "compression": compression,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "seed": seed,
+            "shuffled": shuffle,
+            "validation_fraction": validation_fraction,
+            "rows": sum(info["rows"] for info in splits.values()),
+            "splits": splits,
+        }
+        with open(manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        
+        self.log(f"Wrote {sum(len(info['shards']) for info in splits.values())} shards with {workers} writer(s), manifest: {manifest_file}")
+        return {"count": manifest["rows"], "file": manifest_file, "preview": preview, "splits": splits}
+    
+    def create_training_pairs(self, pruned_data, output_file=None, min_length=10, formats=("pairs",), pairs_spool=None):
+        """Convert conversation data to training samples for fine-tuning.
+        
+        output_file names the pairs file (.jsonl or .csv); other formats are written next to
+        it (training_chat.jsonl, training_reasoning.*). Samples are streamed straight to disk.
+        pairs_spool (a text file) also receives every written pair as a JSON line, so later
+        stages can reread them without building and deduplicating them again.
+        Returns {format: {"count", "file", "preview"}}.
+        """
+        if output_file is None:
+            output_file = os.path.join(self.config["output_dir"], "data", "training_data.jsonl")
+        output_dir = os.path.dirname(output_file)
+        extension = os.path.splitext(output_file)[1] or ".jsonl"
+        
+        results = {}
+        for sample_format in formats:
+            if sample_format == "pairs":
+                format_file = output_file
+            else:
+                # Chat samples are nested message lists, so they are always JSONL
+                format_extension = ".jsonl" if sample_format == "chat" else extension
+                format_file = os.path.join(output_dir, TRAINING_FORMAT_FILES[sample_format] + format_extension)
+            
+            dedup_stats = {}
+            samples = self.build_training_samples(pruned_data, sample_format, min_length, dedup_stats)
+            if sample_format == "pairs" and pairs_spool is not None:
+                samples = spool_samples(samples, pairs_spool)
+            if self.config.get("shard_output", False):
+                results[sample_format] = self.write_training_shards(samples, format_file)
+            else:
+                results[sample_format] = self.write_training_samples(samples, format_file)
+            
+            if dedup_stats:
+                clusters = dedup_stats.pop("clusters")
+                results[sample_format]["dedup"] = dedup_stats
+                self.log(f"Dedup {sample_format}: {dedup_stats['input']} samples, {dedup_stats['exact']} exact and "
+                         f"{dedup_stats['near']} near duplicates ({dedup_stats['ratio']:.1%}) in {dedup_stats['seconds']:.1f}s")
+                if clusters and self.config.get("dedup_action", "drop") == "cluster":
+                    clusters_file = os.path.splitext(format_file)[0] + "_clusters.jsonl"
+                    with open(clusters_file, 'w', encoding='utf-8') as f:
+                        for representative, members in clusters.items():
+                            f.write(json.dumps({"representative": representative, "duplicates": members}) + '\n')
+            self.log(f"Created {results[sample_format]['count']} {sample_format} samples in {format_file}")
+        
+        return results
+    
+    def load_token_calibration(self):
+        """Calibrated chars-per-token ratios per tokenizer name ({name: {chars, tokens, chars_per_token}})"""
+        path = os.path.join(self.config["output_dir"], CACHE_DIR_NAME, TOKEN_CALIBRATION_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def record_token_calibration(self, name, chars, tokens):
+        """Add exactly counted text to a tokenizer's calibration, so approx mode can use its real ratio"""
+        if not tokens:
+            return
+        calibration = self.load_token_calibration()
+        entry = calibration.get(name, {"chars": 0, "tokens": 0})
+        entry["chars"] += chars
+        entry["tokens"] += tokens
+        entry["chars_per_token"] = round(entry["chars"] / entry["tokens"], 2)
+        calibration[name] = entry
+        cache_dir = os.path.join(self.config["output_dir"], CACHE_DIR_NAME)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, TOKEN_CALIBRATION_FILE), 'w', encoding='utf-8') as f:
+            json.dump(calibration, f, indent=2)
+        # An approximating counter picks the new ratio up on its next use
+        if self._token_counter and self._token_counter["mode"] != "exact":
+            self._token_counter = None
+    
+    def get_token_counter(self):
+        """The token counter for the current settings, created on first use.
+        
+        exact loads tokenizer_path once and keeps an LRU cache of counts keyed by text
+        hash. approx divides characters by the ratio calibrated for tokenizer_path (see
+        record_token_calibration) or by chars_per_token. Falls back to approx when the
+        tokenizer cannot be loaded. The name identifies which counter produced a count.
+        """
+        mode = self.config.get("token_count_mode", "approx")
+        spec = self.config.get("tokenizer_path", "").strip()
+        counter = self._token_counter
+        if counter and counter["settings"] == (mode, spec, self.config.get("chars_per_token", 4.0)):
+            return counter
+        
+        counter = {"settings": (mode, spec, self.config.get("chars_per_token", 4.0)), "mode": "approx", "spec": spec,
+                   "tokenizer": None, "cache": OrderedDict(), "chars": 0, "tokens": 0}
+        if mode == "exact":
+            try:
+                counter["tokenizer"] = load_tokenizer(spec)
+                counter["mode"] = "exact"
+                counter["name"] = counter["tokenizer"]["name"]
+            except (ImportError, ValueError, OSError) as e:
+                self.log(f"Exact token counts unavailable ({e}) - approximating instead")
+        if counter["mode"] != "exact":
+            calibrated = self.load_token_calibration().get(os.path.basename(spec)) if spec else None
+            counter["chars_per_token"] = calibrated["chars_per_token"] if calibrated else self.config.get("chars_per_token", 4.0)
+            counter["name"] = f"approx:{counter['chars_per_token']:g}"
+        self._token_counter = counter
+        return counter
+    
+    def count_tokens(self, texts, workers=None):
+        """Token counts for a list of texts with the configured counter.
+        
+        Exact counts are served from the LRU cache where possible; the remaining texts are
+        counted once each (duplicates share a count), across a process pool when there are
+        enough of them to be worth starting one.
+        """
+        counter = self.get_token_counter()
+        if counter["mode"] != "exact":
+            return [approx_token_count(text, counter["chars_per_token"]) for text in texts]
+        
+        cache = counter["cache"]
+        counts = [None] * len(texts)
+        missing = {}
+        for position, text in enumerate(texts):
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            if key in cache:
+                cache.move_to_end(key)
+                counts[position] = cache[key]
+            else:
+                missing.setdefault(key, []).append(position)
+        if not missing:
+            return counts
+        
+        pending = [texts[positions[0]] for positions in missing.values()]
+        workers = workers or self.config.get("tokenize_workers") or os.cpu_count() or 1
+        if workers > 1 and len(pending) >= 2 * TOKEN_COUNT_BATCH_SIZE:
+            batches = [pending[i:i + TOKEN_COUNT_BATCH_SIZE] for i in range(0, len(pending), TOKEN_COUNT_BATCH_SIZE)]
+            pool = multiprocessing.Pool(min(workers, len(batches)), initializer=init_tokenize_worker, initargs=(counter["spec"],))
+            try:
+                results = [count for batch in pool.imap(count_token_batch, batches) for count in batch]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = count_token_batch(pending, counter["tokenizer"])
+        
+        for (key, positions), count in zip(missing.items(), results):
+            cache[key] = count
+            for position in positions:
+                counts[position] = count
+        while len(cache) > TOKEN_CACHE_SIZE:
+            cache.popitem(last=False)
+        counter["chars"] += sum(len(text) for text in pending)
+        counter["tokens"] += sum(results)
+        return counts
+    
+    def count_message_tokens(self, messages):
+        """Store each message's token count on it. Returns (conversation total, counter name)."""
+        counts = self.count_tokens([message["text"] for message in messages])
+        for message, count in zip(messages, counts):
+            message["tokens"] = count
+        return sum(counts), self.get_token_counter()["name"]
+    
+    def annotate_token_counts(self, pruned_data):
+        """Count tokens for every conversation in pruned_data not yet counted by the current counter.
+        
+        Their messages are counted in one batch, so exact counting can spread over the
+        pool. Exact counts also feed the tokenizer's calibration. Returns how many
+        conversations were counted.
+        """
+        counter = self.get_token_counter()
+        stale = [conversation for _, conversation in self.iter_corpus(pruned_data)
+                 if conversation.get("token_counter") != counter["name"]]
+        counts = iter(self.count_tokens([message["text"] for conversation in stale for message in conversation.get("messages", [])]))
+        for conversation in stale:
+            total = 0
+            for message in conversation.get("messages", []):
+                message["tokens"] = next(counts)
+                total += message["tokens"]
+            conversation["tokens"] = total
+            conversation["token_counter"] = counter["name"]
+        
+        if counter["mode"] == "exact" and counter["tokens"]:
+            self.record_token_calibration(counter["name"], counter["chars"], counter["tokens"])
+            counter["chars"] = counter["tokens"] = 0
+        return len(stale)
+    
+    def iter_bounded(self, pool, function, tasks, limit):
+        """Results of function over a task stream, in order, with at most limit tasks in flight.
+        
+        Unlike pool.imap, which queues the whole task stream up front, this only reads a
+        new task when an earlier result has been taken.
+        """
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(function, (task,)))
+            if len(pending) >= limit:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    
+    def write_token_dataset(self, training_pairs, output_prefix, tokenizer_spec=None, workers=None):
+        """Tokenize (streamed) training pairs across a process pool and write memory-mappable arrays.
         
-        self.log(f"Created {len(training_pairs)} training pairs in {output_file}")
-        return training_pairs
+        Writes <prefix>.npy (every pair's instruction then response ids, packed end to end),
+        <prefix>_index.npy (one int64 row per pair: offset, instruction length, response
+        length) and <prefix>.json (tokenizer, dtype and length statistics). Both arrays are
+        plain .npy files, so loaders can open them with np.load(..., mmap_mode='r').
+        """
+        tokenizer_spec = tokenizer_spec or self.config.get("tokenizer_path", "")
+        tokenizer = load_tokenizer(tokenizer_spec)
+        if tokenizer["vocab_size"] <= 1 << 16:
+            typecode, dtype = "H", "<u2"
+        else:
+            typecode, dtype = ("I" if array("I").itemsize == 4 else "L"), "<u4"
+        
+        chars = 0
+        
+        def iter_tasks():
+            nonlocal chars
+            batch = []
+            for pair in training_pairs:
+                batch.append((pair["instruction"], pair["response"]))
+                chars += len(pair["instruction"]) + len(pair["response"])
+                if len(batch) == TOKENIZE_BATCH_SIZE:
+                    yield batch, typecode
+                    batch = []
+            if batch:
+                yield batch, typecode
+        
+        # Pairs arrive as a stream; only start worker processes when there is more than one batch
+        tasks = iter_tasks()
+        first_tasks = [task for _, task in zip(range(2), tasks)]
+        workers = workers or self.config.get("tokenize_workers") or os.cpu_count() or 1
+        if len(first_tasks) < 2:
+            workers = 1
+        tasks = (task for chunk in (first_tasks, tasks) for task in chunk)
+        
+        tokens_file = f"{output_prefix}.npy"
+        index_file = f"{output_prefix}_index.npy"
+        instruction_lengths = []
+        response_lengths = []
+        index = array("q")
+        offset = 0
+        start = time.perf_counter()
+        
+        pool = multiprocessing.Pool(workers, initializer=init_tokenize_worker, initargs=(tokenizer_spec,)) if workers > 1 else None
+        try:
+            results = self.iter_bounded(pool, tokenize_pair_batch, tasks, workers * 2) if pool else (tokenize_pair_batch(task, tokenizer) for task in tasks)
+            with open(tokens_file, 'wb') as f:
+                f.write(npy_header(dtype, (0,)))
+                for packed, lengths in results:
+                    f.write(packed)
+                    for instruction_length, response_length in lengths:
+                        index.extend((offset, instruction_length, response_length))
+                        offset += instruction_length + response_length
+                        instruction_lengths.append(instruction_length)
+                        response_lengths.append(response_length)
+                f.seek(0)
+                f.write(npy_header(dtype, (offset,)))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        
+        if sys.byteorder == "big":
+            index.byteswap()
+        with open(index_file, 'wb') as f:
+            f.write(npy_header("<i8", (len(instruction_lengths), 3)))
+            index.tofile(f)
+        
+        stats = {
+            "version": TOKEN_DATASET_VERSION,
+            "tokenizer": tokenizer["name"],
+            "vocab_size": tokenizer["vocab_size"],
+            "eos_id": tokenizer["eos_id"],
+            "dtype": dtype,
+            "pairs": len(instruction_lengths),
+            "tokens": offset,
+            "tokens_file": os.path.basename(tokens_file),
+            "index_file": os.path.basename(index_file),
+            "index_columns": ["offset", "instruction_length", "response_length"],
+            "lengths": {
+                "instruction": length_stats(instruction_lengths),
+                "response": length_stats(response_lengths),
+                "total": length_stats([a + b for a, b in zip(instruction_lengths, response_lengths)]),
+            },
+        }
+        with open(f"{output_prefix}.json", 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+        # Every pair was tokenized exactly, so this calibrates the approximation for the tokenizer
+        self.record_token_calibration(tokenizer["name"], chars, offset - (len(instruction_lengths) if tokenizer["eos_id"] is not None else 0))
+        
+        self.log(f"Tokenized {stats['pairs']} training pairs into {offset} tokens with {tokenizer['name']} "
+                 f"({workers} worker(s), {time.perf_counter() - start:.1f}s) -> {tokens_file}")
+        return stats
     
     def generate_conversation_titles(self, data_dir):
         """Generate the conversation_titles.txt file for concept tracker"""
@@ -1525,8 +5629,9 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         all_files = []
         for root, _, files in os.walk(data_dir):
             for file in files:
-                if file.endswith('.txt') and file != 'conversation_titles.txt' and file != 'training_data.txt':
-                    all_files.append(os.path.join(root, file))
+                name = strip_compression_suffix(file)
+                if name.endswith('.txt') and name != 'conversation_titles.txt' and name != 'training_data.txt':
+                    all_files.append(os.path.join(root, name))
         
         # Sort files by date (extracted from filename)
         # Fixed sorting function to handle edge cases
@@ -1585,13 +5690,12 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 continue
                 
             for file in files:
-                if file.endswith('.txt'):
+                if strip_compression_suffix(file).endswith('.txt'):
                     file_path = os.path.join(root, file)
                     
-                    # Check if file contains "untitled" (case insensitive) and is 0KB
+                    # Check if file contains "untitled" (case insensitive) and is empty
                     if 'untitled' in file.lower():
-                        file_size = os.path.getsize(file_path)
-                        if file_size == 0:
+                        if is_empty_output(file_path):
                             empty_untitled_files.append(file_path)
         
         if empty_untitled_files:
@@ -1647,7 +5751,8 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
         and generate Obsidian markdown files for concept tracking.
         """
         
-        def __init__(self, core_concepts=None):
+        def __init__(self, core_concepts=None, time_budget=None, stopwords=None, max_ngram=3,
+                     auto_concepts=False, cluster_count=0, cluster_state=None, embeddings=None, state_file=None):
             # Set default core concepts if none provided
             if core_concepts is None:
                 self.core_concepts = {
@@ -1657,6 +5762,38 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 }
             else:
                 self.core_concepts = core_concepts
+            
+            # Seconds of matching each pattern may use per run before it is disabled
+            self.time_budget = time_budget
+            self.pattern_report = {}
+            
+            # Term mining settings
+            self.stopwords = DEFAULT_TERM_STOPWORDS | {w.lower() for w in (stopwords or [])}
+            self.max_ngram = max(1, max_ngram)
+            self.term_scores_by_month = {}
+            
+            # Concept discovery: cluster count (0 = automatic), where the fitted clusters are
+            # kept between runs, and optional (vectors, {note name: row}, model) embeddings
+            self.auto_concepts = auto_concepts
+            self.cluster_count = cluster_count
+            self.cluster_state = cluster_state
+            self.embeddings = embeddings
+            self.clusters = []
+            self.cluster_mode = None
+            self.cluster_action = None
+            
+            # Where postings, evolution, co-occurrence and term counts persist between runs
+            self.state_file = state_file
+            self.month_term_counts = {}
+            
+            # Every lowercase substring of every concept name, so "is this term part of a
+            # core concept" is one set lookup instead of a loop over all concepts
+            self.concept_lookup = set()
+            for concept in self.core_concepts:
+                name = concept.lower()
+                for i in range(len(name)):
+                    for j in range(i + 1, len(name) + 1):
+                        self.concept_lookup.add(name[i:j])
 
         def process_conversation_file(self, filename):
             """Process a file containing conversation titles and extract data."""
@@ -1689,42 +5826,184 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             
             return conversations
 
-        def extract_concepts(self, conversations):
-            """Extract key concepts from conversation titles."""
-            concept_mentions = {concept: [] for concept in self.core_concepts}
+        def extract_concepts(self, conversations, concepts=None):
+            """Extract key concepts from conversation titles (all concepts, or just `concepts`)."""
+            concepts = list(self.core_concepts) if concepts is None else concepts
+            concept_mentions = {concept: [] for concept in concepts}
             
-            # Extract concepts based on regex patterns
-            for conv in conversations:
-                for concept, pattern in self.core_concepts.items():
-                    if pattern.search(conv['title']):
-                        concept_mentions[concept].append(conv)
+            # Extract concepts based on regex patterns, one pattern at a time so its
+            # cost can be measured and a runaway pattern cut off at the budget
+            titles = None
+            for concept in concepts:
+                pattern = self.core_concepts[concept]
+                mentions = concept_mentions[concept]
+                start = time.perf_counter()
+                exceeded = False
+                
+                if self.time_budget and isinstance(pattern, re.Pattern) and conversations:
+                    # Python re can backtrack for ever inside one search(), so match in a killable child
+                    if titles is None:
+                        titles = [conv['title'] for conv in conversations]
+                    matched, exceeded = self.match_with_budget(pattern, titles)
+                    mentions.extend(conversations[i] for i in matched)
+                else:
+                    # RE2 is linear-time, so checking the clock after every title is enough
+                    for conv in conversations:
+                        if pattern.search(conv['title']):
+                            mentions.append(conv)
+                        if self.time_budget and time.perf_counter() - start > self.time_budget:
+                            exceeded = True
+                            break
+                
+                elapsed = time.perf_counter() - start
+                self.pattern_report[concept] = {
+                    'seconds': elapsed,
+                    'exceeded_budget': exceeded,
+                }
             
             return concept_mentions
         
-        def extract_additional_terms(self, conversations, min_occurrences=3):
-            """Extract additional recurring terms that might be concepts."""
-            # Extract all words from titles
-            all_words = []
-            for conv in conversations:
-                words = re.findall(r'\b[A-Za-z][A-Za-z0-9]{2,}\b', conv['title'])
-                all_words.extend([w for w in words if len(w) > 3])  # Only include words longer than 3 chars
-            
-            # Count word frequencies
-            word_counts = Counter(all_words)
-            
-            # Filter for words that appear multiple times
-            recurring_terms = {word: count for word, count in word_counts.items() 
-                            if count >= min_occurrences}
-            
-            # Remove common words and words already in core concepts
-            common_words = {'with', 'that', 'this', 'from', 'have', 'what', 'your', 'request', 'help', 'about', 'using'}
-            for word in list(recurring_terms.keys()):
-                if word.lower() in common_words:
-                    del recurring_terms[word]
-                for concept in self.core_concepts:
-                    if word.lower() in concept.lower():
-                        del recurring_terms[word]
+        def match_with_budget(self, pattern, titles):
+            """Positions of titles matching pattern, found in a child process killed after time_budget.
+            
+            Returns (positions, exceeded); when the budget runs out the positions found so
+            far are kept, so mentions are partial rather than missing.
+            """
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            worker = multiprocessing.Process(target=match_titles, args=(pattern, titles, sender))
+            worker.daemon = True
+            worker.start()
+            sender.close()
+            
+            matched = []
+            exceeded = False
+            deadline = time.perf_counter() + self.time_budget
+            try:
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or not receiver.poll(remaining):
+                        exceeded = True
+                        break
+                    batch = receiver.recv()
+                    if batch is None:
+                        break
+                    matched.extend(batch)
+            except EOFError:
+                # The child died without finishing; keep what it sent
+                exceeded = True
+            finally:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+                receiver.close()
+            return matched, exceeded
+        
+        def iter_terms(self, text):
+            """Yield unigram and n-gram terms from text, skipping stopwords."""
+            tokens = re.findall(r'\b[A-Za-z][A-Za-z0-9]{2,}\b', text)
+            stopwords = self.stopwords
+            
+            for i, token in enumerate(tokens):
+                if token.lower() in stopwords:
+                    continue
+                if len(token) > 3:  # Only include words longer than 3 chars
+                    yield token
+                
+                # Phrases never start, end or pass through a stopword
+                for n in range(2, self.max_ngram + 1):
+                    if i + n > len(tokens):
                         break
+                    last = tokens[i + n - 1]
+                    if last.lower() in stopwords:
+                        break
+                    yield ' '.join(tokens[i:i + n])
+        
+        def iter_message_bodies(self, pruned_file, months=None):
+            """Stream (month_key, text) for every message in pruned.json or the corpus database.
+            
+            months limits the stream to those YYYY-MM keys; the database only reads their rows.
+            """
+            if pruned_file.endswith(CORPUS_DB_FILE):
+                query = "SELECT c.month, m.text FROM messages m JOIN conversations c ON c.id = m.conversation"
+                names = []
+                if months is not None:
+                    names = [datetime.strptime(month_key, '%Y-%m').strftime('%B_%Y') for month_key in months]
+                    query += f" WHERE c.month IN ({', '.join('?' * len(names))})"
+                with closing(open_corpus_db(pruned_file)) as db:
+                    rows = db.execute(query, names)
+                    for month_name, text in rows:
+                        try:
+                            month_key = datetime.strptime(month_name, '%B_%Y').strftime('%Y-%m')
+                        except (TypeError, ValueError):
+                            month_key = month_name
+                        yield month_key, text or ''
+                return
+            
+            # One conversation at a time, so the whole store is never in memory
+            month_keys = {}
+            with open_input(pruned_file) as f:
+                for month_name, conversation in iter_json_object_arrays(f):
+                    if month_name not in month_keys:
+                        try:
+                            month_keys[month_name] = datetime.strptime(month_name, '%B_%Y').strftime('%Y-%m')
+                        except ValueError:
+                            month_keys[month_name] = month_name
+                    month_key = month_keys[month_name]
+                    if months is not None and month_key not in months:
+                        continue
+                    for message in conversation.get('messages', []):
+                        yield month_key, message.get('text', '')
+        
+        def extract_additional_terms(self, conversations, min_occurrences=3, pruned_file=None, month_counts=None, months=None):
+            """Extract additional recurring terms and phrases that might be concepts.
+            
+            Terms are streamed straight into per-month counters from titles (and message
+            bodies when pruned_file is given). Months are treated as documents to give
+            each term a TF-IDF score in self.term_scores_by_month. Given the month_counts
+            of an earlier run, only the months listed in `months` are counted again.
+            """
+            previous = month_counts or {}
+            if month_counts is None:
+                months = None
+            month_counts = defaultdict(Counter)
+            
+            # Months keep the order a full count would give them, so ties rank the same way
+            for conv in conversations:
+                month_key = f"{conv['year']}-{conv['month']}"
+                if months is None or month_key in months:
+                    month_counts[month_key].update(self.iter_terms(conv['title']))
+                elif month_key not in month_counts:
+                    month_counts[month_key] = previous.get(month_key, Counter())
+            for month_key, counts in previous.items():
+                if months is not None and month_key not in months and month_key not in month_counts:
+                    month_counts[month_key] = counts
+            
+            if pruned_file and os.path.exists(pruned_file) and (months is None or months):
+                for month_key, text in self.iter_message_bodies(pruned_file, months):
+                    month_counts[month_key].update(self.iter_terms(text))
+            self.month_term_counts = month_counts
+            
+            word_counts = Counter()
+            document_frequency = Counter()
+            for counts in month_counts.values():
+                word_counts.update(counts)
+                document_frequency.update(counts.keys())
+            
+            # Keep recurring terms that aren't already core concepts
+            concept_lookup = self.concept_lookup
+            recurring_terms = {word: count for word, count in word_counts.items()
+                               if count >= min_occurrences and word.lower() not in concept_lookup}
+            
+            # TF-IDF with months as documents: high for terms distinctive to a month
+            total_months = len(month_counts)
+            self.term_scores_by_month = {}
+            for month_key, counts in month_counts.items():
+                scores = {}
+                for word, count in counts.items():
+                    if word in recurring_terms:
+                        idf = math.log((1 + total_months) / (1 + document_frequency[word])) + 1
+                        scores[word] = count * idf
+                self.term_scores_by_month[month_key] = dict(sorted(scores.items(), key=lambda x: x[1], reverse=True)[:10])
             
             return recurring_terms
         
@@ -1760,9 +6039,26 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
             
             return evolution
         
-        def find_related_concepts(self, concept_mentions, threshold=0.3):
+        def count_cooccurrence(self, concept_mentions):
+            """Shared conversations for every pair of concepts, in one pass over the mentions."""
+            concepts_by_conversation = defaultdict(list)
+            for concept, mentions in concept_mentions.items():
+                for conv in mentions:
+                    concepts_by_conversation[conv['clean_filename']].append(concept)
+            
+            cooccurrence = defaultdict(Counter)
+            for concepts in concepts_by_conversation.values():
+                for concept1 in concepts:
+                    for concept2 in concepts:
+                        if concept1 != concept2:
+                            cooccurrence[concept1][concept2] += 1
+            return cooccurrence
+        
+        def find_related_concepts(self, concept_mentions, threshold=0.3, cooccurrence=None):
             """Find concepts that frequently appear together."""
             related = {}
+            if cooccurrence is None:
+                cooccurrence = self.count_cooccurrence(concept_mentions)
             
             # For each concept pair, calculate co-occurrence
             concepts = list(concept_mentions.keys())
@@ -1771,20 +6067,17 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                     continue
                     
                 related[concept1] = []
+                shared = cooccurrence.get(concept1, {})
                 
                 for j, concept2 in enumerate(concepts):
                     if i == j or not concept_mentions[concept2]:
                         continue
                     
-                    # Get sets of conversation IDs for each concept
-                    conv_ids1 = {conv['id'] for conv in concept_mentions[concept1]}
-                    conv_ids2 = {conv['id'] for conv in concept_mentions[concept2]}
-                    
                     # Calculate overlap ratio 
-                    intersection = len(conv_ids1.intersection(conv_ids2))
+                    intersection = shared.get(concept2, 0)
                     if intersection > 0:
                         # Use Jaccard similarity coefficient
-                        similarity = intersection / len(conv_ids1.union(conv_ids2))
+                        similarity = intersection / (len(concept_mentions[concept1]) + len(concept_mentions[concept2]) - intersection)
                         
                         if similarity >= threshold:
                             related[concept1].append({
@@ -1856,7 +6149,7 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                         clean_filename = conv['clean_filename']
                         f.write(f"- [[{clean_filename}]] - {conv['date']}\n")
         
-        def generate_moc(self, concept_mentions, evolution, output_dir):
+        def generate_moc(self, concept_mentions, evolution, output_dir, categories=None):
             """Generate a Map of Content for all concepts."""
             moc_path = os.path.join(output_dir, "Concepts-MOC.md")
             
@@ -1864,15 +6157,13 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 f.write("---\ntags:\n  - MOC\n  - concepts\n---\n\n")
                 f.write("# Concepts Map of Content\n\n")
                 
-                # Calculate date range from all conversations
-                all_convs = []
-                for mentions in concept_mentions.values():
-                    all_convs.extend(mentions)
+                # Calculate date range from every concept's first and last mention
+                firsts = [entry['first_mention'] for entry in evolution.values()]
+                lasts = [entry['last_mention'] for entry in evolution.values()]
                 
-                if all_convs:
-                    all_convs.sort(key=lambda x: f"{x['year']}-{x['month']}-{x['day']}")
-                    first_date = all_convs[0]['date']
-                    last_date = all_convs[-1]['date']
+                if firsts:
+                    first_date = min(firsts, key=lambda x: f"{x['year']}-{x['month']}-{x['day']}")['date']
+                    last_date = max(lasts, key=lambda x: f"{x['year']}-{x['month']}-{x['day']}")['date']
                     f.write(f"## Overview\nTracking key concepts across conversations from {first_date} to {last_date}.\n\n")
                 else:
                     f.write("## Overview\nTracking key concepts across conversations.\n\n")
@@ -1893,17 +6184,15 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                         f.write(f" (first: {evolution[concept]['first_mention']['date']})")
                     f.write("\n")
                 
-                f.write("\n## Concept Categories\n\n")
-                f.write("- [[AI Systems]]\n")
-                f.write("- [[Programming Projects]]\n")
-                f.write("- [[Data Analysis]]\n")
-                f.write("- [[Development Topics]]\n")
-                f.write("- [[Security & Privacy]]\n")
+                if categories:
+                    f.write("\n## Concept Categories\n\n")
+                    for category in categories:
+                        f.write(f"- [[{category['name']}]] - {', '.join(category['concepts'])}\n")
                 
                 f.write("\n## Dataview Queries\n\n")
                 f.write("```dataview\nTABLE concept, mentions, first_mention\nFROM #concept\nSORT mentions DESC\n```\n")
         
-        def generate_dashboard(self, concept_mentions, evolution, output_dir):
+        def generate_dashboard(self, concept_mentions, evolution, output_dir, categories=None):
             """Generate an Obsidian dashboard for concept tracking with embedded queries."""
             dashboard_path = os.path.join(output_dir, "Concept-Dashboard.md")
             
@@ -1924,23 +6213,9 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 f.write("For a visual network of concept relationships, consider using the Obsidian Graph View filtered to show only concept notes.\n\n")
                 
                 f.write("## Concept Categories\n\n")
-                # Create a table of concept categories and their counts
-                categories = {
-                    'AI Systems': ['AI', 'GPT', 'Claude', 'LLM', 'Language Model'],
-                    'Programming': ['Python', 'JavaScript', 'Code', 'Programming', 'API'],
-                    'Data & Analysis': ['Data', 'Database', 'CSV', 'JSON', 'Analysis'],
-                    'Development': ['Development', 'Software', 'Application', 'Framework'],
-                    'Cloud & Infrastructure': ['Cloud', 'AWS', 'Azure', 'Deploy'],
-                    'Security': ['Security', 'Privacy', 'Encryption', 'Authentication']
-                }
-                
-                for category, related_terms in categories.items():
-                    count = 0
-                    for concept, mentions in concept_mentions.items():
-                        if any(term.lower() in concept.lower() for term in related_terms):
-                            count += len(mentions)
-                    
-                    f.write(f"- **{category}**: {count} mentions\n")
+                # Categories come from the data (see concept_categories), not a fixed list
+                for category in categories or []:
+                    f.write(f"- **{category['name']}**: {category['mentions']} conversations ({', '.join(category['concepts'])})\n")
 
         def generate_term_analysis(self, terms, output_dir):
             """Generate a note about additional recurring terms found in titles."""
@@ -1966,29 +6241,587 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 for term, count in sorted_terms[:10]:
                     if count >= 5:  # Only suggest terms with 5+ occurrences
                         f.write(f"- [[{term}]] ({count} occurrences)\n")
+                
+                if self.term_scores_by_month:
+                    f.write("\n## Distinctive Terms by Month\n\n")
+                    f.write("Terms ranked by TF-IDF, treating each month as a document.\n\n")
+                    for month_key in sorted(self.term_scores_by_month):
+                        scores = self.term_scores_by_month[month_key]
+                        if scores:
+                            f.write(f"- **{month_key}**: {', '.join(scores)}\n")
 
-        def process(self, input_file, output_dir):
-            """Process conversations and generate Obsidian notes."""
-            conversations = self.process_conversation_file(input_file)
-            concept_mentions = self.extract_concepts(conversations)
-            evolution = self.analyze_concept_evolution(concept_mentions, conversations)
-            related_concepts = self.find_related_concepts(concept_mentions)
+        def concept_categories(self, concept_mentions, related_concepts):
+            """Group concepts into categories for the MOC and dashboard.
+            
+            With discovered clusters, each cluster is a category holding the concepts whose
+            conversations mostly fall into it. Otherwise related concepts (see
+            find_related_concepts) are joined into groups named after their largest concept.
+            """
+            categories = []
+            if self.clusters:
+                cluster_of = {}
+                for cluster in self.clusters:
+                    for conv in concept_mentions.get(cluster['label'], []):
+                        cluster_of[conv['id']] = cluster['label']
+                members = defaultdict(list)
+                for concept, mentions in concept_mentions.items():
+                    if concept in cluster_of.values() or not mentions:
+                        continue
+                    votes = Counter(cluster_of[conv['id']] for conv in mentions if conv['id'] in cluster_of)
+                    if votes:
+                        members[votes.most_common(1)[0][0]].append(concept)
+                for cluster in self.clusters:
+                    categories.append({'name': cluster['label'], 'concepts': [cluster['label']] + members[cluster['label']],
+                                       'mentions': cluster['size']})
+                return categories
+            
+            group_of = {concept: concept for concept, mentions in concept_mentions.items() if mentions}
+            
+            def find(concept):
+                while group_of[concept] != concept:
+                    group_of[concept] = group_of[group_of[concept]]
+                    concept = group_of[concept]
+                return concept
+            
+            for concept, related in related_concepts.items():
+                for entry in related:
+                    if entry['concept'] in group_of:
+                        group_of[find(entry['concept'])] = find(concept)
+            groups = defaultdict(list)
+            for concept in group_of:
+                groups[find(concept)].append(concept)
+            for concepts in groups.values():
+                concepts.sort(key=lambda concept: len(concept_mentions[concept]), reverse=True)
+                conversation_ids = {conv['id'] for concept in concepts for conv in concept_mentions[concept]}
+                categories.append({'name': concepts[0], 'concepts': concepts, 'mentions': len(conversation_ids)})
+            categories.sort(key=lambda category: category['mentions'], reverse=True)
+            return categories
+        
+        def load_conversation_texts(self, corpus_db):
+            """Title-independent text for clustering: opening user/assistant messages per conversation row."""
+            texts = defaultdict(list)
+            sizes = Counter()
+            with closing(open_corpus_db(corpus_db)) as db:
+                rows = db.execute("SELECT conversation, text FROM messages WHERE block_type = 'text' "
+                                  "AND role IN ('user', 'assistant') ORDER BY conversation, position")
+                for row_id, text in rows:
+                    if sizes[row_id] < EMBED_TEXT_CHARS and text:
+                        texts[row_id].append(text[:EMBED_TEXT_CHARS - sizes[row_id]])
+                        sizes[row_id] += len(texts[row_id][-1])
+            return {row_id: "\n".join(parts) for row_id, parts in texts.items()}
+        
+        def cluster_conversations(self, conversations, texts=None):
+            """Discover concepts by clustering conversations; returns {label: [conversation, ...]}.
+            
+            Conversations are vectorised as TF-IDF term vectors (titles plus texts[id] when
+            given) or, with self.embeddings, as their embedding rows. Spherical mini-batch
+            k-means finds the clusters, and each is labelled with its heaviest TF-IDF terms.
+            The fitted clusters are saved to self.cluster_state, so later runs only assign new
+            conversations to the nearest existing cluster (updating its centroid) instead of
+            refitting, until CLUSTER_REFIT_FRACTION of the corpus is new or the settings change.
+            """
+            texts = texts or {}
+            dense = self.embeddings is not None
+            if dense:
+                import numpy as np
+                vectors, rows, model = self.embeddings
+                conversations = [conv for conv in conversations if conv['clean_filename'] in rows]
+                mode = f"embeddings:{model}"
+            else:
+                mode = "tfidf"
+            if len(conversations) < 2:
+                return {}
+            
+            state = None
+            if self.cluster_state and os.path.exists(self.cluster_state):
+                try:
+                    with open(self.cluster_state, 'r', encoding='utf-8') as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = None
+            if state and (state.get('version') != CLUSTER_STATE_VERSION or state.get('mode') != mode
+                          or state.get('requested') != self.cluster_count):
+                state = None
+            
+            # Document frequencies carry over between runs; only new conversations add to them
+            keys = [conv['clean_filename'] for conv in conversations]
+            assignments = state['assignments'] if state else {}
+            new_positions = [i for i, key in enumerate(keys) if key not in assignments]
+            if state and len(new_positions) > CLUSTER_REFIT_FRACTION * len(keys):
+                state = None
+                assignments = {}
+                new_positions = list(range(len(keys)))
+            document_frequency = Counter(state['document_frequency']) if state else Counter()
+            documents = state['documents'] if state else 0
+            
+            term_counts = []
+            for conv in conversations:
+                text = f"{conv['title']}\n{texts.get(conv['id'], '')}"
+                term_counts.append(Counter(term.lower() for term in self.iter_terms(text)))
+            for i in new_positions:
+                document_frequency.update(term_counts[i].keys())
+            documents += len(new_positions)
+            
+            def tfidf(counts):
+                weights = {term: (1 + math.log(count)) * (math.log((1 + documents) / (1 + document_frequency[term])) + 1)
+                           for term, count in counts.items() if 1 < document_frequency[term] <= max(2, documents // 2)}
+                if len(weights) > CLUSTER_DOC_TERMS:
+                    weights = dict(sorted(weights.items(), key=lambda item: item[1], reverse=True)[:CLUSTER_DOC_TERMS])
+                norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+                return {term: weight / norm for term, weight in weights.items()}
+            
+            term_vectors = [tfidf(counts) for counts in term_counts]
+            if not dense:
+                # Conversations without a single usable term cannot be placed
+                kept = [i for i, vector in enumerate(term_vectors) if vector]
+                conversations = [conversations[i] for i in kept]
+                keys = [keys[i] for i in kept]
+                term_vectors = [term_vectors[i] for i in kept]
+                new_positions = [i for i, key in enumerate(keys) if key not in assignments]
+                if len(keys) < 2:
+                    return {}
+            if dense:
+                matrix = np.asarray(vectors[[rows[key] for key in keys]], dtype=np.float32)
+            
+            def nearest(positions, centroids):
+                """(cluster, similarity) for each position against the normalised centroids"""
+                if dense:
+                    scores = matrix[positions] @ centroids.T
+                    return [(int(cluster), float(scores[i, cluster])) for i, cluster in enumerate(scores.argmax(axis=1))]
+                # Score every centroid at once through an inverted index of centroid terms
+                postings = defaultdict(list)
+                for cluster, centroid in enumerate(centroids):
+                    for term, weight in centroid.items():
+                        postings[term].append((cluster, weight))
+                results = []
+                for position in positions:
+                    scores = [0.0] * len(centroids)
+                    for term, weight in term_vectors[position].items():
+                        for cluster, centroid_weight in postings.get(term, ()):
+                            scores[cluster] += weight * centroid_weight
+                    best = max(range(len(scores)), key=scores.__getitem__)
+                    results.append((best, scores[best]))
+                return results
+            
+            def normalise(sums):
+                if dense:
+                    return sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+                centroids = []
+                for weights in sums:
+                    kept = dict(sorted(weights.items(), key=lambda item: item[1], reverse=True)[:CLUSTER_KEEP_TERMS])
+                    norm = math.sqrt(sum(weight * weight for weight in kept.values())) or 1.0
+                    centroids.append({term: weight / norm for term, weight in kept.items()})
+                return centroids
+            
+            def add(sums, cluster, position):
+                if dense:
+                    sums[cluster] += matrix[position]
+                else:
+                    for term, weight in term_vectors[position].items():
+                        sums[cluster][term] = sums[cluster].get(term, 0.0) + weight
+            
+            if state:
+                # Incremental: new conversations join their nearest cluster and pull its centroid
+                count = len(state['counts'])
+                sums = np.asarray(state['centroids'], dtype=np.float32) if dense else [dict(weights) for weights in state['centroids']]
+                counts = state['counts']
+                centroids = normalise(sums)
+                for start in range(0, len(new_positions), CLUSTER_BATCH_SIZE):
+                    batch = new_positions[start:start + CLUSTER_BATCH_SIZE]
+                    for position, (cluster, _) in zip(batch, nearest(batch, centroids)):
+                        counts[cluster] += 1
+                        add(sums, cluster, position)
+                        assignments[keys[position]] = cluster
+                    centroids = normalise(sums)
+                action = f"assigned {len(new_positions)} new conversations to {count} existing concepts"
+            else:
+                count = self.cluster_count or max(2, min(CLUSTER_MAX_COUNT, round(math.sqrt(len(keys) / 2))))
+                count = min(count, len(keys))
+                rng = random.Random(0)
+                
+                # k-means++ seeding on a sample, then mini-batch updates with per-cluster learning rates
+                sample = rng.sample(range(len(keys)), min(len(keys), 1000))
+                seeds = [sample[0]]
+                best = [0.0] * len(sample)
+                while len(seeds) < count:
+                    seed_centroids = normalise(np.stack([matrix[seeds[-1]]]) if dense else [term_vectors[seeds[-1]]])
+                    for i, (_, similarity) in enumerate(nearest(sample, seed_centroids)):
+                        best[i] = max(best[i], similarity) if len(seeds) > 1 else similarity
+                    weights = [max(0.0, 1.0 - similarity) ** 2 for similarity in best]
+                    if not sum(weights):
+                        break
+                    seeds.append(rng.choices(sample, weights)[0])
+                count = len(seeds)
+                sums = np.stack([matrix[seed] for seed in seeds]) if dense else [dict(term_vectors[seed]) for seed in seeds]
+                counts = [1] * count
+                centroids = normalise(sums)
+                
+                for _ in range(max(1, CLUSTER_PASSES * len(keys) // CLUSTER_BATCH_SIZE)):
+                    scales = [1.0] * count
+                    batch = rng.sample(range(len(keys)), min(len(keys), CLUSTER_BATCH_SIZE))
+                    for position, (cluster, _) in zip(batch, nearest(batch, centroids)):
+                        counts[cluster] += 1
+                        rate = 1.0 / counts[cluster]
+                        if dense:
+                            sums[cluster] = (1 - rate) * sums[cluster] + rate * matrix[position]
+                        else:
+                            # centroid = scale * stored weights, so shrinking it is one multiplication
+                            scales[cluster] *= 1 - rate
+                            centroid = sums[cluster]
+                            for term, weight in term_vectors[position].items():
+                                centroid[term] = centroid.get(term, 0.0) + rate * weight / scales[cluster]
+                    if not dense:
+                        sums = [{term: weight * scale for term, weight in weights.items()} for weights, scale in zip(sums, scales)]
+                    centroids = normalise(sums)
+                    if not dense:
+                        sums = [dict(centroid) for centroid in centroids]
+                
+                # Final assignment; centroids become the exact member sums so later runs can add to them
+                assignments = {}
+                sums = np.zeros_like(sums) if dense else [{} for _ in range(count)]
+                counts = [0] * count
+                for start in range(0, len(keys), CLUSTER_BATCH_SIZE):
+                    batch = list(range(start, min(start + CLUSTER_BATCH_SIZE, len(keys))))
+                    for position, (cluster, _) in zip(batch, nearest(batch, centroids)):
+                        counts[cluster] += 1
+                        add(sums, cluster, position)
+                        assignments[keys[position]] = cluster
+                action = f"fitted {count} concepts over {len(keys)} conversations"
+            
+            # Labels from each cluster's summed TF-IDF terms (also for embedding clusters)
+            label_weights = [defaultdict(float) for _ in range(count)]
+            members = defaultdict(list)
+            for position, key in enumerate(keys):
+                cluster = assignments.get(key)
+                if cluster is None:
+                    continue
+                members[cluster].append(conversations[position])
+                for term, weight in term_vectors[position].items():
+                    label_weights[cluster][term] += weight
+            
+            # Terms found in fewer clusters say more about a cluster (class-based TF-IDF)
+            cluster_frequency = Counter(term for weights in label_weights for term in weights)
+            cluster_mentions = {}
+            self.clusters = []
+            for cluster in sorted(members, key=lambda cluster: len(members[cluster]), reverse=True):
+                distinctive = {term: weight * math.log(1 + count / cluster_frequency[term]) for term, weight in label_weights[cluster].items()}
+                terms = top_terms(distinctive, CLUSTER_LABEL_WORDS) or [f"cluster {cluster + 1}"]
+                label = " ".join(terms).title()
+                while label in cluster_mentions or label in self.core_concepts:
+                    label += f" {cluster + 1}"
+                cluster_mentions[label] = members[cluster]
+                self.clusters.append({'label': label, 'terms': terms, 'size': len(members[cluster])})
+            self.cluster_mode = mode
+            
+            if self.cluster_state:
+                os.makedirs(os.path.dirname(self.cluster_state), exist_ok=True)
+                with open(self.cluster_state, 'w', encoding='utf-8') as f:
+                    json.dump({
+                        'version': CLUSTER_STATE_VERSION,
+                        'mode': mode,
+                        'requested': self.cluster_count,
+                        'documents': documents,
+                        'document_frequency': document_frequency,
+                        'counts': counts,
+                        'centroids': sums.tolist() if dense else [dict(sorted(weights.items(), key=lambda item: item[1], reverse=True)[:CLUSTER_KEEP_TERMS * 4])
+                                                                  for weights in sums],
+                        'assignments': {key: assignments[key] for key in keys if key in assignments},
+                    }, f, ensure_ascii=False)
+            self.cluster_action = action
+            return cluster_mentions
+        
+        def load_corpus_conversations(self, corpus_db):
+            """Load conversations from the corpus database in the same shape as process_conversation_file."""
+            conversations = []
+            # Dates come from the transcript filename, exactly as in the titles file
+            pattern = re.compile(r'_(\d{2})_(\d{2})_(\d{4})_(\d{2})_(\d{2})_(\d{2})\.txt$')
+            with closing(open_corpus_db(corpus_db)) as db:
+                rows = db.execute("SELECT id, title, file FROM conversations WHERE file IS NOT NULL ORDER BY updated, id")
+                for row_id, title, file_path in rows:
+                    filename = strip_compression_suffix(os.path.basename(file_path))
+                    match = pattern.search(filename)
+                    if not match:
+                        continue
+                    conversations.append({
+                        'id': row_id,
+                        'title': title or '',
+                        'day': match.group(1),
+                        'month': match.group(2),
+                        'year': match.group(3),
+                        'hour': match.group(4),
+                        'minute': match.group(5),
+                        'second': match.group(6),
+                        'date': f"{match.group(1)}/{match.group(2)}/{match.group(3)}",
+                        'time': f"{match.group(4)}:{match.group(5)}:{match.group(6)}",
+                        'filename': filename,
+                        'clean_filename': filename.replace('.txt', '')
+                    })
+            return conversations
+        
+        def store_concept_matches(self, corpus_db, concept_mentions, changes=None, records=None):
+            """Write this run's matches to the concept_matches table.
+            
+            With changes ({concept: (added keys, removed keys)}) only the differences are
+            written, unless the table no longer holds the previous run's matches.
+            """
+            total = sum(len(mentions) for mentions in concept_mentions.values())
+            with closing(open_corpus_db(corpus_db)) as db:
+                with db:
+                    if changes is not None:
+                        previous = total - sum(len(added) - len(removed) for added, removed in changes.values())
+                        if db.execute("SELECT COUNT(*) FROM concept_matches").fetchone()[0] != previous:
+                            changes = None
+                    if changes is None:
+                        db.execute("DELETE FROM concept_matches")
+                        db.executemany("INSERT OR IGNORE INTO concept_matches (concept, conversation) VALUES (?, ?)",
+                                       [(concept, conv['id']) for concept, mentions in concept_mentions.items() for conv in mentions])
+                        return
+                    # Matches of deleted conversations went with them (ON DELETE CASCADE)
+                    db.executemany("DELETE FROM concept_matches WHERE concept = ? AND conversation = ?",
+                                   [(concept, records[key]['id']) for concept, (_, removed) in changes.items()
+                                    for key in removed if key in records])
+                    db.executemany("INSERT OR IGNORE INTO concept_matches (concept, conversation) VALUES (?, ?)",
+                                   [(concept, records[key]['id']) for concept, (added, _) in changes.items() for key in added])
+        
+        def open_state_db(self, corpus_db=None):
+            """Database for postings and per-month term counts: corpus.db, or a file next to the state file"""
+            if corpus_db:
+                db = open_corpus_db(corpus_db)
+            else:
+                os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+                db = sqlite3.connect(os.path.join(os.path.dirname(self.state_file), TRACKER_DB_FILE))
+            db.executescript(TRACKER_DB_SCHEMA)
+            return db
+        
+        def load_state(self, db=None):
+            """Tracker state from the last run, or an empty state (everything counts as new).
+            
+            Postings and per-month term counts come from db; they only count when db was
+            written by the same run as the state file.
+            """
+            state = {'version': TRACKER_STATE_VERSION, 'run': None, 'conversations': {}, 'definitions': {}, 'postings': {},
+                     'evolution': {}, 'cooccurrence': {}, 'related': {}, 'month_terms': {}, 'term_settings': None}
+            if db is None or not os.path.exists(self.state_file):
+                return state
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                return state
+            row = db.execute("SELECT value FROM tracker_state WHERE name = 'run'").fetchone()
+            if saved.get('version') != TRACKER_STATE_VERSION or not row or row[0] != saved.get('run'):
+                return state
+            
+            state.update(saved)
+            postings = defaultdict(set)
+            for concept, key in db.execute("SELECT concept, key FROM tracker_postings"):
+                postings[concept].add(key)
+            month_terms = defaultdict(Counter)
+            for month_key, term, count in db.execute("SELECT month, term, count FROM tracker_month_terms ORDER BY month, position"):
+                month_terms[month_key][term] = count
+            state['postings'] = dict(postings)
+            state['month_terms'] = dict(month_terms)
+            return state
+        
+        def save_state(self, state, db, changes, term_changes):
+            """Persist the tracker state: changed postings and term counts to db, the rest next to the other caches.
+            
+            changes is {concept: (added keys, removed keys)} and term_changes a list of
+            (month, term, count, position) with count 0 for terms no longer seen in that month.
+            """
+            run = os.urandom(8).hex()
+            with db:
+                if state['run'] is None:
+                    # Starting over - rows left from another run no longer line up with the state file
+                    db.execute("DELETE FROM tracker_postings")
+                    db.execute("DELETE FROM tracker_month_terms")
+                db.executemany("DELETE FROM tracker_postings WHERE concept = ? AND key = ?",
+                               [(concept, key) for concept, (_, removed) in changes.items() for key in removed])
+                db.executemany("INSERT OR IGNORE INTO tracker_postings (concept, key) VALUES (?, ?)",
+                               [(concept, key) for concept, (added, _) in changes.items() for key in added])
+                db.executemany("DELETE FROM tracker_month_terms WHERE month = ? AND term = ?",
+                               [(month_key, term) for month_key, term, count, _ in term_changes if not count])
+                db.executemany("INSERT OR REPLACE INTO tracker_month_terms (month, term, count, position) VALUES (?, ?, ?, ?)",
+                               [change for change in term_changes if change[2]])
+                db.execute("INSERT OR REPLACE INTO tracker_state (name, value) VALUES ('run', ?)", (run,))
+            
+            saved = {key: value for key, value in state.items() if key not in ('postings', 'month_terms')}
+            saved['run'] = run
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            temp_file = self.state_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False)
+            os.replace(temp_file, self.state_file)
+        
+        def process(self, input_file, output_dir, pruned_file=None, corpus_db=None):
+            """Process conversations and generate Obsidian notes.
+            
+            With corpus_db, conversations come from the corpus database instead of the
+            titles file, and concept matches are written back to it. With a state_file, the
+            previous run's postings, evolution, co-occurrence and per-month term counts are
+            updated with deltas: only new or changed conversations are matched (every
+            conversation only for concepts whose pattern changed), and only concept notes
+            whose content changed are rewritten. Postings and term counts are kept in
+            tables (in corpus.db when given) where only the changed rows are written.
+            """
+            if corpus_db:
+                conversations = self.load_corpus_conversations(corpus_db)
+            else:
+                conversations = self.process_conversation_file(input_file)
+            with closing(self.open_state_db(corpus_db)) if self.state_file else nullcontext() as state_db:
+                return self.process_conversations(conversations, output_dir, pruned_file, corpus_db, state_db)
+        
+        def process_conversations(self, conversations, output_dir, pruned_file, corpus_db, state_db):
+            """Match, count and write notes for conversations against the state kept in state_db (None without a state_file)."""
+            state = self.load_state(state_db)
+            self.pattern_report = {}
+            records = {conv['clean_filename']: conv for conv in conversations}
+            position = {key: i for i, key in enumerate(records)}
+            
+            def month_of(conv):
+                return f"{conv['year']}-{conv['month']}"
+            
+            def date_order(key):
+                conv = records[key]
+                return f"{conv['year']}-{conv['month']}-{conv['day']}", position[key]
+            
+            # What changed since the last run
+            known = state['conversations']
+            new_keys = [key for key, conv in records.items() if key not in known or known[key][0] != conv['title']]
+            removed = {key for key, entry in known.items() if key not in records or entry[0] != records[key]['title']}
+            definitions = {concept: f"{getattr(pattern, 'pattern', pattern)}/{getattr(pattern, 'flags', 0)}"
+                           for concept, pattern in self.core_concepts.items()}
+            stale = [concept for concept, source in definitions.items() if state['definitions'].get(concept) != source]
+            
+            old_postings = {concept: set(keys) for concept, keys in state['postings'].items()}
+            postings = {concept: old_postings.get(concept, set()) - removed if concept not in stale else set()
+                        for concept in definitions}
+            current = [concept for concept in definitions if concept not in stale]
+            for concept, mentions in self.extract_concepts([records[key] for key in new_keys], current).items():
+                postings[concept].update(conv['clean_filename'] for conv in mentions)
+            if stale:
+                for concept, mentions in self.extract_concepts(conversations, stale).items():
+                    postings[concept] = {conv['clean_filename'] for conv in mentions}
+            for concept, report in self.pattern_report.items():
+                if report['exceeded_budget']:
+                    definitions[concept] = None  # Partial matches - match everything again next run
+            
+            if self.auto_concepts:
+                texts = self.load_conversation_texts(corpus_db) if corpus_db else None
+                for label, mentions in self.cluster_conversations(conversations, texts).items():
+                    postings[label] = {conv['clean_filename'] for conv in mentions}
+            
+            # Deltas per concept, then per conversation for the co-occurrence counts
+            changes = {}
+            for concept in list(postings) + [concept for concept in old_postings if concept not in postings]:
+                new, old = postings.get(concept, set()), old_postings.get(concept, set())
+                if new != old:
+                    changes[concept] = (new - old, old - new)
+            changed_keys = set()
+            for added, dropped in changes.values():
+                changed_keys |= added | dropped
+            
+            cooccurrence = defaultdict(Counter, {concept: Counter(counts) for concept, counts in state['cooccurrence'].items()})
+            for key in changed_keys:
+                before = [concept for concept in changes if key in old_postings.get(concept, ())]
+                before += [concept for concept in old_postings if concept not in changes and key in old_postings[concept]]
+                after = [concept for concept in changes if key in postings.get(concept, ())]
+                after += [concept for concept in postings if concept not in changes and key in postings[concept]]
+                for concepts, step in ((before, -1), (after, 1)):
+                    for concept1 in concepts:
+                        for concept2 in concepts:
+                            if concept1 != concept2:
+                                cooccurrence[concept1][concept2] += step
+            cooccurrence = {concept: Counter({other: count for other, count in counts.items() if count > 0})
+                            for concept, counts in cooccurrence.items() if concept in postings}
+            
+            # Month counts and first/last mentions move with the deltas
+            evolution_state = state['evolution']
+            for concept, (added, dropped) in changes.items():
+                if not postings.get(concept):
+                    evolution_state.pop(concept, None)
+                    continue
+                entry = evolution_state.setdefault(concept, {'first': None, 'last': None, 'monthly': {}})
+                monthly = Counter(entry['monthly'])
+                monthly.update(month_of(records[key]) for key in added)
+                monthly.subtract(known[key][1] for key in dropped)
+                entry['monthly'] = {month: count for month, count in sorted(monthly.items()) if count > 0}
+                if entry['first'] not in postings[concept] or entry['last'] not in postings[concept]:
+                    entry['first'] = min(postings[concept], key=date_order)
+                    entry['last'] = max(postings[concept], key=date_order)
+                elif added:
+                    entry['first'] = min(added | {entry['first']}, key=date_order)
+                    entry['last'] = max(added | {entry['last']}, key=date_order)
+            
+            concept_mentions = {concept: [records[key] for key in keys] for concept, keys in postings.items()}
+            evolution = {concept: {
+                'first_mention': records[entry['first']],
+                'last_mention': records[entry['last']],
+                'monthly_trend': entry['monthly'],
+                'total_mentions': len(postings[concept])
+            } for concept, entry in evolution_state.items()}
+            related_concepts = self.find_related_concepts(concept_mentions, cooccurrence=cooccurrence)
+            categories = self.concept_categories(concept_mentions, related_concepts)
+            if corpus_db:
+                self.store_concept_matches(corpus_db, concept_mentions, changes if state['postings'] else None, records)
+            
+            # Only notes whose mentions or related concepts changed (or that are missing) are rewritten
+            related_signature = {concept: [[entry['concept'], entry['shared_conversations']] for entry in related[:5]]
+                                 for concept, related in related_concepts.items()}
+            dirty = {}
+            for concept, keys in postings.items():
+                note = os.path.join(output_dir, f"{concept.replace(' ', '_')}.md")
+                if keys and (concept in changes or related_signature.get(concept) != state['related'].get(concept)
+                             or not os.path.exists(note)):
+                    dirty[concept] = sorted(concept_mentions[concept], key=lambda conv: position[conv['clean_filename']])
+            for concept in old_postings:
+                if not postings.get(concept):
+                    note = os.path.join(output_dir, f"{concept.replace(' ', '_')}.md")
+                    if os.path.exists(note):
+                        os.remove(note)
             
             # Generate Obsidian files
             os.makedirs(output_dir, exist_ok=True)
-            self.generate_concept_notes(concept_mentions, evolution, related_concepts, output_dir)
-            self.generate_moc(concept_mentions, evolution, output_dir)
-            self.generate_dashboard(concept_mentions, evolution, output_dir)
+            self.generate_concept_notes(dirty, evolution, related_concepts, output_dir)
+            self.generate_moc(concept_mentions, evolution, output_dir, categories)
+            self.generate_dashboard(concept_mentions, evolution, output_dir, categories)
             
-            # Additional analysis
-            additional_terms = self.extract_additional_terms(conversations)
+            # Additional analysis - only months with new, changed or removed conversations are recounted
+            term_settings = [sorted(self.stopwords), self.max_ngram, bool(pruned_file), bool(corpus_db)]
+            months = None
+            if state['term_settings'] == term_settings:
+                months = {month_of(records[key]) for key in new_keys} | {known[key][1] for key in removed}
+            month_terms = {month_key: Counter(counts) for month_key, counts in state['month_terms'].items()}
+            additional_terms = self.extract_additional_terms(conversations, pruned_file=pruned_file,
+                                                             month_counts=month_terms if months is not None else None, months=months)
             self.generate_term_analysis(additional_terms, output_dir)
             
+            if state_db is not None:
+                # Only months that were counted again can differ from the stored counts
+                previous_terms, current_terms = state['month_terms'], self.month_term_counts
+                term_changes = []
+                for month_key in set(previous_terms) | set(current_terms):
+                    if months is not None and month_key not in months:
+                        continue
+                    old = {term: (count, position) for position, (term, count) in enumerate(previous_terms.get(month_key, {}).items())}
+                    new = {term: (count, position) for position, (term, count) in enumerate(current_terms.get(month_key, {}).items())}
+                    term_changes.extend((month_key, term) + new.get(term, (0, 0)) for term in old.keys() | new.keys()
+                                        if old.get(term) != new.get(term))
+                self.save_state({
+                    'version': TRACKER_STATE_VERSION,
+                    'run': state['run'],
+                    'conversations': {key: [conv['title'], month_of(conv)] for key, conv in records.items()},
+                    'definitions': definitions,
+                    'evolution': evolution_state,
+                    'cooccurrence': cooccurrence,
+                    'related': related_signature,
+                    'term_settings': term_settings,
+                }, state_db, changes, term_changes)
+            
             # Calculate orphaned conversations (conversations with no concept matches)
             conversations_with_concepts = set()
-            for mentions in concept_mentions.values():
-                for conv in mentions:
-                    conversations_with_concepts.add(conv['id'])
+            for keys in postings.values():
+                conversations_with_concepts |= keys
             
             orphaned_count = len(conversations) - len(conversations_with_concepts)
             
@@ -1996,10 +6829,38 @@ v3 Improvements by GitHub Copilot (Claude Opus 4.5)
                 'conversations': len(conversations),
                 'orphaned': orphaned_count,
                 'concepts': {concept: len(mentions) for concept, mentions in concept_mentions.items()},
-                'additional_terms': additional_terms
+                'additional_terms': additional_terms,
+                'pattern_report': self.pattern_report,
+                'clusters': self.clusters,
+                'cluster_mode': self.cluster_mode,
+                'new_conversations': len(new_keys),
+                'removed_conversations': len(removed),
+                'notes_written': len(dirty)
             }
 
 def main():
+    parser = argparse.ArgumentParser(description="ChatInsights - AI chat analysis tool (starts the GUI without options)")
+    parser.add_argument("--watch", metavar="FOLDER", help="run headless and import exports dropped into FOLDER")
+    parser.add_argument("--once", action="store_true", help="with --watch, import what is in FOLDER and exit")
+    parser.add_argument("--serve", action="store_true", help="run the local JSON query service over the processed corpus")
+    parser.add_argument("--host", help="address for --serve (default: serve_host setting)")
+    parser.add_argument("--port", type=int, help="port for --serve (default: serve_port setting)")
+    parser.add_argument("--benchmark", type=int, metavar="REQUESTS",
+                        help="load-test the query service on a free local port with REQUESTS requests and exit")
+    parser.add_argument("--concurrency", type=int, default=8, help="connections used by --benchmark (default: 8)")
+    args = parser.parse_args()
+    
+    if args.watch:
+        app = ChatInsightsApp()
+        app.watch_exports(args.watch, once=args.once)
+        return
+    if args.serve:
+        ChatInsightsApp().serve_corpus(args.host, args.port)
+        return
+    if args.benchmark:
+        ChatInsightsApp().benchmark_query_service(args.benchmark, args.concurrency)
+        return
+    
     root = tk.Tk()
     app = ChatInsightsApp(root)
     root.mainloop()